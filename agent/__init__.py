@@ -3,10 +3,15 @@ StudyMate Agent Module
 """
 
 from .core import StudyMateAgent
+from .transcript import Transcript
 from .tools import (
     analyze_repo_structure,
     extract_code_snippet,
     search_repo_concept,
+    find_callers,
+    find_callees,
+    module_dependencies,
+    find_dependency_path,
     generate_socratic_question,
     assess_student_understanding,
     provide_progressive_hint,
@@ -15,9 +20,14 @@ from .tools import (
 
 __all__ = [
     'StudyMateAgent',
+    'Transcript',
     'analyze_repo_structure',
     'extract_code_snippet',
     'search_repo_concept',
+    'find_callers',
+    'find_callees',
+    'module_dependencies',
+    'find_dependency_path',
     'generate_socratic_question',
     'assess_student_understanding',
     'provide_progressive_hint',
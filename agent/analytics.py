@@ -0,0 +1,272 @@
+"""
+Columnar learning analytics for StudyMate
+
+Progress events from track_learning_progress are appended to NumPy
+columns with dictionary-encoded sessions and concepts, so class-wide
+questions ("which concepts are weak?") are answered with a few
+vectorized passes instead of opening one JSON file per session.
+"""
+
+import json
+import os
+import threading
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+
+MASTERY_LEVELS = ("poor", "partial", "good", "excellent")
+_MASTERY_CODES = {level: code for code, level in enumerate(MASTERY_LEVELS)}
+
+PROGRESS_DIR = "data/progress"
+
+_INITIAL_CAPACITY = 1024
+
+# Composite keys up to this many values are aggregated with dense arrays
+# instead of sorting (np.unique)
+DENSE_KEY_LIMIT = 1 << 24
+
+
+class _Dictionary:
+    """String <-> int code mapping."""
+
+    def __init__(self):
+        self.codes: Dict[str, int] = {}
+        self.values: List[str] = []
+
+    def encode(self, value: str) -> int:
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+
+class AnalyticsStore:
+    """
+    Append-only event columns: session, concept, mastery and timestamp.
+
+    Columns grow by doubling; readers take a consistent prefix under the
+    lock and then aggregate without holding it.
+    """
+
+    def __init__(self):
+        self.sessions = _Dictionary()
+        self.concepts = _Dictionary()
+        self._session = np.empty(_INITIAL_CAPACITY, dtype=np.int32)
+        self._concept = np.empty(_INITIAL_CAPACITY, dtype=np.int32)
+        self._mastery = np.empty(_INITIAL_CAPACITY, dtype=np.int8)
+        self._ts = np.empty(_INITIAL_CAPACITY, dtype=np.float64)
+        self._size = 0
+        # Events already ingested per progress file
+        self._ingested: Dict[str, int] = {}
+        self._backfilled = False
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _reserve(self, extra: int):
+        needed = self._size + extra
+        capacity = len(self._ts)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        for name in ("_session", "_concept", "_mastery", "_ts"):
+            old = getattr(self, name)
+            new = np.empty(capacity, dtype=old.dtype)
+            new[:self._size] = old[:self._size]
+            setattr(self, name, new)
+
+    def extend(self, session_ids: List[str], concepts: List[str], masteries: List[str], timestamps: List[float]):
+        """
+        Appends a batch of events; events with an unknown mastery level are skipped.
+
+        Args:
+            session_ids: Session of each event
+            concepts: Concept of each event (case-insensitive)
+            masteries: poor/partial/good/excellent
+            timestamps: Epoch seconds
+        """
+        rows = [
+            (s, c.strip().lower(), _MASTERY_CODES[m], t)
+            for s, c, m, t in zip(session_ids, concepts, masteries, timestamps)
+            if m in _MASTERY_CODES
+        ]
+        if not rows:
+            return
+        with self._lock:
+            self._reserve(len(rows))
+            start, end = self._size, self._size + len(rows)
+            self._session[start:end] = [self.sessions.encode(r[0]) for r in rows]
+            self._concept[start:end] = [self.concepts.encode(r[1]) for r in rows]
+            self._mastery[start:end] = [r[2] for r in rows]
+            self._ts[start:end] = [r[3] for r in rows]
+            self._size = end
+
+    def ingest_progress_file(self, path: str):
+        """Appends events from a progress JSON file that were not ingested yet."""
+        try:
+            with open(path, 'r') as f:
+                progress = json.load(f)
+        except (OSError, ValueError):
+            return
+        self.ingest_progress(path, progress)
+
+    def ingest_progress(self, path: str, progress: dict):
+        """
+        Appends events of an already loaded progress file that were not
+        ingested yet, so a writer only passes on the events it just added.
+
+        Args:
+            path: The progress file (tracks how many events were ingested)
+            progress: Its contents
+        """
+        events = progress.get("concepts_covered", [])
+        key = os.path.abspath(path)
+        with self._lock:
+            seen = self._ingested.get(key, 0)
+            self._ingested[key] = len(events)
+        new = events[seen:]
+        if not new:
+            return
+        session_id = progress.get("session_id") or os.path.basename(path)
+        self.extend(
+            [session_id] * len(new),
+            [e.get("concept", "") for e in new],
+            [e.get("mastery", "") for e in new],
+            [_epoch(e.get("timestamp")) for e in new],
+        )
+
+    def backfill(self, progress_dir: str = PROGRESS_DIR):
+        """Ingests every existing progress file once per process."""
+        if self._backfilled:
+            return
+        self._backfilled = True
+        if not os.path.isdir(progress_dir):
+            return
+        for name in sorted(os.listdir(progress_dir)):
+            if name.endswith('.json'):
+                self.ingest_progress_file(os.path.join(progress_dir, name))
+
+    def _columns(self, since: Optional[float] = None):
+        with self._lock:
+            n = self._size
+            session, concept = self._session[:n], self._concept[:n]
+            mastery, ts = self._mastery[:n], self._ts[:n]
+            n_sessions, n_concepts = len(self.sessions), len(self.concepts)
+        if since is not None:
+            keep = ts >= since
+            session, concept, mastery, ts = session[keep], concept[keep], mastery[keep], ts[keep]
+        return session, concept, mastery, ts, n_sessions, n_concepts
+
+    def mastery_distribution(self, since: Optional[float] = None, latest: bool = True) -> Dict[str, dict]:
+        """
+        Mastery level counts per concept.
+
+        Args:
+            since: Only events at or after this epoch time
+            latest: Count only each session's most recent event per
+                concept (its current standing) instead of every event
+
+        Returns:
+            {concept: {"poor": n, ..., "excellent": n, "sessions": n, "mean": m}}
+            where mean is the average level on a 0-3 scale
+        """
+        session, concept, mastery, ts, n_sessions, n_concepts = self._columns(since)
+        if latest and len(ts):
+            # Keep the most recent row per (session, concept); events are
+            # usually appended in time order, so the sort is rarely needed
+            order = None if np.all(ts[1:] >= ts[:-1]) else np.argsort(ts, kind="stable")
+            pair = session.astype(np.int64) * max(n_concepts, 1) + concept
+            if order is not None:
+                pair = pair[order]
+            rows = _last_rows(pair, max(n_sessions, 1) * max(n_concepts, 1))
+            if order is not None:
+                rows = order[rows]
+            concept, mastery = concept[rows], mastery[rows]
+
+        levels = len(MASTERY_LEVELS)
+        counts = np.bincount(
+            concept.astype(np.int64) * levels + mastery, minlength=n_concepts * levels
+        ).reshape(n_concepts, levels)
+        totals = counts.sum(axis=1)
+        means = (counts * np.arange(levels)).sum(axis=1) / np.maximum(totals, 1)
+
+        names = self.concepts.values
+        return {
+            names[c]: {
+                **{level: int(counts[c, i]) for i, level in enumerate(MASTERY_LEVELS)},
+                "sessions" if latest else "events": int(totals[c]),
+                "mean": round(float(means[c]), 3),
+            }
+            for c in np.nonzero(totals)[0]
+        }
+
+    def weak_concepts(self, limit: int = 10, min_sessions: int = 1, since: Optional[float] = None) -> List[dict]:
+        """Concepts with the lowest mean current mastery across sessions."""
+        dist = self.mastery_distribution(since=since, latest=True)
+        ranked = sorted(
+            ({"concept": c, **d} for c, d in dist.items() if d["sessions"] >= min_sessions),
+            key=lambda d: (d["mean"], -d["sessions"]),
+        )
+        return ranked[:limit]
+
+    def activity(self, bucket_s: float = 3600.0, since: Optional[float] = None) -> List[dict]:
+        """
+        Event and active-session counts per time bucket.
+
+        Returns:
+            [{"start": iso, "events": n, "sessions": n}] for non-empty buckets
+        """
+        session, _, _, ts, n_sessions, _ = self._columns(since)
+        if not len(ts):
+            return []
+        origin = np.floor(ts.min() / bucket_s) * bucket_s
+        bucket = ((ts - origin) // bucket_s).astype(np.int64)
+        events = np.bincount(bucket)
+        # Distinct sessions per bucket via distinct (bucket, session) pairs
+        width = max(n_sessions, 1)
+        pairs = _distinct(bucket * width + session, len(events) * width)
+        sessions = np.bincount(pairs // width, minlength=len(events))
+        return [
+            {
+                "start": datetime.fromtimestamp(origin + b * bucket_s).isoformat(),
+                "events": int(events[b]),
+                "sessions": int(sessions[b]),
+            }
+            for b in np.nonzero(events)[0]
+        ]
+
+
+def _last_rows(keys: np.ndarray, space: int) -> np.ndarray:
+    """Index of the last occurrence of each distinct key in ``keys``."""
+    if space <= DENSE_KEY_LIMIT:
+        last = np.full(space, -1, dtype=np.int64)
+        np.maximum.at(last, keys, np.arange(len(keys)))
+        return last[last >= 0]
+    _, first = np.unique(keys[::-1], return_index=True)
+    return len(keys) - 1 - first
+
+
+def _distinct(keys: np.ndarray, space: int) -> np.ndarray:
+    """Sorted distinct values of ``keys`` (all in ``[0, space)``)."""
+    if space <= DENSE_KEY_LIMIT:
+        seen = np.zeros(space, dtype=bool)
+        seen[keys] = True
+        return np.flatnonzero(seen)
+    return np.unique(keys)
+
+
+def _epoch(timestamp: Optional[str]) -> float:
+    try:
+        return datetime.fromisoformat(timestamp).timestamp()
+    except (TypeError, ValueError):
+        return 0.0
+
+
+analytics = AnalyticsStore()
@@ -0,0 +1,187 @@
+"""
+Per-session token and latency accounting for StudyMate
+
+Every routed model call and tool call made while a session's ledger is
+current (see ``metering``) is charged to that session. Budgets degrade a
+session in steps before refusing it outright:
+
+    normal   - full history, retrieval context and speculation
+    reduced  - shorter history window, smaller retrieval context,
+               clipped input, no speculative pre-generation
+    cheap    - as reduced, and every call goes to the fastest tier
+    exhausted - turns are refused with BudgetExceeded
+
+Environment:
+    STUDYMATE_SESSION_TOKEN_BUDGET - prompt + completion tokens per session (0 = unlimited, default)
+    STUDYMATE_SESSION_LLM_SECONDS  - model seconds per session (0 = unlimited, default)
+    STUDYMATE_BUDGET_REDUCE_AT     - budget share that switches to "reduced" (default 0.7)
+    STUDYMATE_BUDGET_CHEAP_AT      - budget share that switches to "cheap" (default 0.9)
+"""
+
+import contextvars
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+BUDGET_LEVELS = ("normal", "reduced", "cheap", "exhausted")
+
+
+class BudgetExceeded(Exception):
+    """Raised when a session has used up its token or model-time budget."""
+
+
+class SessionLedger:
+    """
+    Usage counters and budget for one session.
+
+    Args:
+        token_budget: Prompt + completion tokens allowed (0 = unlimited)
+        llm_seconds_budget: Model call seconds allowed (0 = unlimited)
+        reduce_at: Budget share from which context is reduced
+        cheap_at: Budget share from which calls use the fastest tier
+    """
+
+    def __init__(self, token_budget: int = 0, llm_seconds_budget: float = 0.0,
+                 reduce_at: float = 0.7, cheap_at: float = 0.9):
+        self.token_budget = token_budget
+        self.llm_seconds_budget = llm_seconds_budget
+        self.reduce_at = reduce_at
+        self.cheap_at = cheap_at
+        self.totals = {
+            "llm_calls": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0,
+            "llm_seconds": 0.0, "tool_calls": 0, "tool_seconds": 0.0,
+            "refused_turns": 0, "degraded_calls": 0,
+        }
+        self.by_site = {}
+        self.by_tool = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "SessionLedger":
+        """Ledger with the budgets configured by STUDYMATE_* variables."""
+        return cls(
+            token_budget=int(os.getenv("STUDYMATE_SESSION_TOKEN_BUDGET", "0")),
+            llm_seconds_budget=float(os.getenv("STUDYMATE_SESSION_LLM_SECONDS", "0")),
+            reduce_at=float(os.getenv("STUDYMATE_BUDGET_REDUCE_AT", "0.7")),
+            cheap_at=float(os.getenv("STUDYMATE_BUDGET_CHEAP_AT", "0.9")),
+        )
+
+    def record_llm(self, site: str, seconds: float, usage: Optional[dict]):
+        """Charges one model call (``usage`` is LangChain usage_metadata)."""
+        usage = usage or {}
+        prompt = usage.get("input_tokens", 0) or 0
+        completion = usage.get("output_tokens", 0) or 0
+        cached = (usage.get("input_token_details") or {}).get("cache_read", 0) or 0
+        with self._lock:
+            self.totals["llm_calls"] += 1
+            self.totals["prompt_tokens"] += prompt
+            self.totals["completion_tokens"] += completion
+            self.totals["cached_tokens"] += cached
+            self.totals["llm_seconds"] += seconds
+            site_totals = self.by_site.setdefault(site, {"calls": 0, "tokens": 0, "seconds": 0.0})
+            site_totals["calls"] += 1
+            site_totals["tokens"] += prompt + completion
+            site_totals["seconds"] += seconds
+
+    def record_tool(self, name: str, seconds: float):
+        """Charges one tool call (its time includes any model calls it made)."""
+        with self._lock:
+            self.totals["tool_calls"] += 1
+            self.totals["tool_seconds"] += seconds
+            tool_totals = self.by_tool.setdefault(name, {"calls": 0, "seconds": 0.0})
+            tool_totals["calls"] += 1
+            tool_totals["seconds"] += seconds
+
+    def used_share(self) -> float:
+        """Largest share of any configured budget used so far."""
+        shares = [0.0]
+        if self.token_budget:
+            tokens = self.totals["prompt_tokens"] + self.totals["completion_tokens"]
+            shares.append(tokens / self.token_budget)
+        if self.llm_seconds_budget:
+            shares.append(self.totals["llm_seconds"] / self.llm_seconds_budget)
+        return max(shares)
+
+    def level(self) -> str:
+        """Current degradation level (see BUDGET_LEVELS)."""
+        share = self.used_share()
+        if share >= 1.0:
+            return "exhausted"
+        if share >= self.cheap_at:
+            return "cheap"
+        if share >= self.reduce_at:
+            return "reduced"
+        return "normal"
+
+    def check(self):
+        """Raises BudgetExceeded (and counts the refusal) once the budget is used up."""
+        if self.level() == "exhausted":
+            with self._lock:
+                self.totals["refused_turns"] += 1
+            raise BudgetExceeded("Session budget exhausted")
+
+    def count_degraded(self):
+        with self._lock:
+            self.totals["degraded_calls"] += 1
+
+    def run(self, fn, *args, **kwargs):
+        """Calls ``fn`` with this ledger current (e.g. on a background thread)."""
+        with metering(self):
+            return fn(*args, **kwargs)
+
+    def snapshot(self) -> dict:
+        """Counters, per-site/per-tool breakdown and budget state for the API."""
+        with self._lock:
+            totals = dict(self.totals)
+            by_site = {site: dict(v) for site, v in self.by_site.items()}
+            by_tool = {name: dict(v) for name, v in self.by_tool.items()}
+        totals["total_tokens"] = totals["prompt_tokens"] + totals["completion_tokens"]
+        for key in ("llm_seconds", "tool_seconds"):
+            totals[key] = round(totals[key], 4)
+        return {
+            **totals,
+            "by_site": by_site,
+            "by_tool": by_tool,
+            "budget": {
+                "tokens": self.token_budget or None,
+                "llm_seconds": self.llm_seconds_budget or None,
+                "used_share": round(self.used_share(), 4),
+                "level": self.level(),
+            },
+        }
+
+
+_current: contextvars.ContextVar = contextvars.ContextVar("studymate_session_ledger", default=None)
+
+
+def current_ledger() -> Optional[SessionLedger]:
+    """The ledger of the session whose work is running in this context."""
+    return _current.get()
+
+
+@contextmanager
+def metering(ledger: Optional[SessionLedger]):
+    """Charges model and tool calls in the block to ``ledger``."""
+    token = _current.set(ledger)
+    try:
+        yield ledger
+    finally:
+        _current.reset(token)
+
+
+def metered_tool(fn):
+    """Records a tool's wall time in the current session's ledger."""
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        ledger = _current.get()
+        if ledger is None:
+            return fn(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            ledger.record_tool(fn.__name__, time.perf_counter() - start)
+    return wrapper
@@ -0,0 +1,137 @@
+"""
+Record/replay of LLM HTTP traffic for StudyMate
+
+A cassette is a JSON-lines file of request/response pairs captured at
+the HTTP layer underneath the OpenAI SDK, so every ChatOpenAI call in
+the project (agent turns, tools, summaries) can be replayed offline.
+
+Modes:
+    record  - forward to the real API and append each exchange
+    replay  - answer from the cassette only; unknown requests fail
+    auto    - replay when recorded, otherwise record
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Dict, List
+
+import httpx
+
+CASSETTE_MODES = ("record", "replay", "auto")
+
+# Response headers that no longer apply once the body is stored decoded
+_DROPPED_HEADERS = {"content-encoding", "content-length", "transfer-encoding", "connection"}
+
+
+class CassetteMissError(Exception):
+    """Raised in replay mode for a request that was never recorded."""
+
+
+def request_key(method: str, path: str, body: bytes) -> str:
+    """Stable identity for a request: method, path and canonical JSON body."""
+    try:
+        canonical = json.dumps(json.loads(body or b"null"), sort_keys=True, separators=(",", ":"))
+    except ValueError:
+        canonical = body.decode("utf-8", errors="replace")
+    return hashlib.sha1(f"{method} {path}\n{canonical}".encode("utf-8")).hexdigest()
+
+
+class CassetteTransport(httpx.BaseTransport):
+    """
+    httpx transport that records to or replays from a cassette file.
+
+    Identical requests are replayed in the order they were recorded; once
+    the recordings for a key are used up the last one is repeated.
+
+    Args:
+        path: Cassette file (JSON lines)
+        mode: One of CASSETTE_MODES
+        realistic_timing: Sleep for the recorded latency on replay
+        speed: Divides recorded latencies (2.0 = twice as fast)
+    """
+
+    def __init__(self, path: str, mode: str = "replay", realistic_timing: bool = False, speed: float = 1.0):
+        if mode not in CASSETTE_MODES:
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        self.path = path
+        self.mode = mode
+        self.realistic_timing = realistic_timing
+        self.speed = speed
+        self._lock = threading.Lock()
+        self._recorded: Dict[str, List[dict]] = {}
+        self._played: Dict[str, int] = {}
+        self._inner = None
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self._recorded.setdefault(entry["key"], []).append(entry)
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        body = request.read()
+        key = request_key(request.method, request.url.path, body)
+
+        entry = None
+        with self._lock:
+            entries = self._recorded.get(key)
+            if entries and self.mode != "record":
+                index = min(self._played.get(key, 0), len(entries) - 1)
+                self._played[key] = index + 1
+                entry = entries[index]
+        if entry is not None:
+            return self._replay(entry, request)
+
+        if self.mode == "replay":
+            raise CassetteMissError(f"No recording for {request.method} {request.url.path} ({key[:12]})")
+        return self._record(key, request, body)
+
+    def _replay(self, entry: dict, request: httpx.Request) -> httpx.Response:
+        if self.realistic_timing and entry.get("latency_s"):
+            time.sleep(entry["latency_s"] / self.speed)
+        return httpx.Response(
+            entry["status"],
+            headers=entry["headers"],
+            content=entry["body"].encode("utf-8"),
+            request=request,
+        )
+
+    def _record(self, key: str, request: httpx.Request, body: bytes) -> httpx.Response:
+        if self._inner is None:
+            self._inner = httpx.HTTPTransport()
+        start = time.perf_counter()
+        response = self._inner.handle_request(request)
+        content = response.read()
+        latency = time.perf_counter() - start
+        response.close()
+
+        # read() has already decoded the body, so the encoding headers are dropped
+        entry = {
+            "key": key,
+            "method": request.method,
+            "path": request.url.path,
+            "request": body.decode("utf-8", errors="replace"),
+            "status": response.status_code,
+            "headers": {k: v for k, v in response.headers.items() if k.lower() not in _DROPPED_HEADERS},
+            "body": content.decode("utf-8", errors="replace"),
+            "latency_s": round(latency, 4),
+            "recorded_at": time.time(),
+        }
+        with self._lock:
+            self._recorded.setdefault(key, []).append(entry)
+            self._played[key] = len(self._recorded[key])
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+        return self._replay(dict(entry, latency_s=0), request)
+
+    def close(self):
+        if self._inner is not None:
+            self._inner.close()
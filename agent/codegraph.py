@@ -0,0 +1,512 @@
+"""
+Static import graph and approximate call graph for StudyMate
+
+Python files are parsed once with ``ast``; what each file defines,
+imports and calls is kept per file so a changed file only needs to be
+re-parsed. Names are then resolved across the repository into two
+graphs held as CSR adjacency arrays (forward and reverse), which answer
+"who calls X", "what does X call", "what does this module import" and
+shortest dependency paths without touching the files again.
+
+The call graph is approximate: calls through imported names, ``self``
+and module attributes are resolved exactly; other ``obj.method()``
+calls are linked to every method of that name when there are at most
+AMBIGUOUS_LIMIT candidates, and dropped otherwise.
+"""
+
+import ast
+import copy
+import math
+import os
+import time
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from . import retrieval
+from .search import MAX_FILE_BYTES, files_fingerprint, iter_text_files
+
+# Node kinds
+MODULE, CLASS, FUNCTION, EXTERNAL = 0, 1, 2, 3
+KIND_NAMES = ("module", "class", "function", "external")
+
+# Unresolved obj.method() calls link to at most this many same-named methods
+AMBIGUOUS_LIMIT = 3
+
+# Re-exports (from .core import X in __init__.py) followed when resolving names
+REEXPORT_DEPTH = 3
+
+# obj.append() and friends are far more often builtins than repository methods
+_BUILTIN_METHODS = frozenset(
+    name for kind in (list, dict, str, set, bytes, tuple) for name in dir(kind)
+)
+
+
+def module_name(rel: str) -> str:
+    """Dotted module name of a repository-relative .py path."""
+    parts = os.path.splitext(rel)[0].split(os.sep)
+    if parts[-1] == "__init__":
+        parts = parts[:-1]
+    return ".".join(parts)
+
+
+class FileFacts:
+    """What one file defines, imports and calls, before cross-file resolution."""
+
+    __slots__ = ("rel", "module", "is_package", "defs", "imports", "aliases", "calls")
+
+    def __init__(self, rel: str):
+        self.rel = rel
+        self.module = module_name(rel)
+        self.is_package = os.path.basename(rel) == "__init__.py"
+        # (qualified name, kind, line)
+        self.defs: List[Tuple[str, int, int]] = []
+        # (imported module, line)
+        self.imports: List[Tuple[str, int]] = []
+        # Local name -> qualified name it was imported as
+        self.aliases: Dict[str, str] = {}
+        # (calling qualified name, callee reference, line)
+        self.calls: List[Tuple[str, tuple, int]] = []
+
+
+class _FactsVisitor(ast.NodeVisitor):
+    def __init__(self, facts: FileFacts):
+        self.facts = facts
+        self.scope = [facts.module]
+        self.classes: List[str] = []
+
+    def _absolute(self, module: Optional[str], level: int) -> str:
+        if not level:
+            return module or ""
+        package = self.facts.module.split(".") if self.facts.is_package else self.facts.module.split(".")[:-1]
+        base = package[:len(package) - (level - 1)] if level > 1 else package
+        return ".".join(base + ([module] if module else []))
+
+    def visit_Import(self, node):
+        for alias in node.names:
+            self.facts.imports.append((alias.name, node.lineno))
+            if alias.asname:
+                self.facts.aliases[alias.asname] = alias.name
+            else:
+                top = alias.name.split(".")[0]
+                self.facts.aliases.setdefault(top, top)
+
+    def visit_ImportFrom(self, node):
+        source = self._absolute(node.module, node.level)
+        for alias in node.names:
+            if alias.name == "*":
+                continue
+            self.facts.imports.append((f"{source}.{alias.name}" if source else alias.name, node.lineno))
+            self.facts.aliases[alias.asname or alias.name] = f"{source}.{alias.name}" if source else alias.name
+
+    def _define(self, node, kind: int):
+        qualname = f"{self.scope[-1]}.{node.name}"
+        self.facts.defs.append((qualname, kind, node.lineno))
+        return qualname
+
+    def visit_ClassDef(self, node):
+        qualname = self._define(node, CLASS)
+        self.scope.append(qualname)
+        self.classes.append(qualname)
+        self.generic_visit(node)
+        self.classes.pop()
+        self.scope.pop()
+
+    def visit_FunctionDef(self, node):
+        qualname = self._define(node, FUNCTION)
+        # Decorators run in the enclosing scope
+        for decorator in node.decorator_list:
+            self.visit(decorator)
+        self.scope.append(qualname)
+        for child in node.body:
+            self.visit(child)
+        self.scope.pop()
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit_Call(self, node):
+        ref = None
+        func = node.func
+        if isinstance(func, ast.Name):
+            ref = ("name", func.id)
+        elif isinstance(func, ast.Attribute):
+            base = func.value
+            if isinstance(base, ast.Name) and base.id in ("self", "cls") and self.classes:
+                ref = ("self", self.classes[-1], func.attr)
+            elif isinstance(base, ast.Name):
+                ref = ("attr", base.id, func.attr)
+            else:
+                ref = ("method", func.attr)
+        if ref is not None:
+            self.facts.calls.append((self.scope[-1], ref, node.lineno))
+        self.generic_visit(node)
+
+
+def parse_file(path: str, rel: str) -> Optional[FileFacts]:
+    """Parses one Python file (None if it is too large, unreadable or invalid)."""
+    try:
+        if os.path.getsize(path) > MAX_FILE_BYTES:
+            return None
+        with open(path, "rb") as f:
+            tree = ast.parse(f.read(), filename=rel)
+    except (OSError, SyntaxError, ValueError):
+        return None
+    facts = FileFacts(rel)
+    _FactsVisitor(facts).visit(tree)
+    return facts
+
+
+def _csr(n: int, src_a: np.ndarray, dst_a: np.ndarray, line_a: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(indptr, targets, lines) with duplicate edges merged onto their first line."""
+    order = np.lexsort((line_a, dst_a, src_a))
+    src_a, dst_a, line_a = src_a[order], dst_a[order], line_a[order]
+    if len(src_a):
+        first = np.ones(len(src_a), dtype=bool)
+        first[1:] = (src_a[1:] != src_a[:-1]) | (dst_a[1:] != dst_a[:-1])
+        src_a, dst_a, line_a = src_a[first], dst_a[first], line_a[first]
+    indptr = np.zeros(n + 1, dtype=np.int32)
+    np.cumsum(np.bincount(src_a, minlength=n), out=indptr[1:])
+    return indptr, dst_a, line_a
+
+
+class CodeGraph:
+    """
+    Import and call graphs for one repository.
+
+    Node ``i`` is ``names[i]`` (dotted qualified name) of kind
+    ``kinds[i]``, defined in ``files[i]`` at ``lines[i]``. Each graph is
+    stored forward and reversed as (indptr, targets, call/import line).
+    """
+
+    def __init__(self, repo_path: str, facts: Dict[str, FileFacts], fingerprint: str = ""):
+        self.repo_path = repo_path
+        self.facts = facts
+        self.fingerprint = fingerprint
+        self._index_nodes()
+        # Resolved (import src, dst, line, call src, dst, line) lists per file
+        self._edges = {rel: self._resolve_file(f) for rel, f in sorted(facts.items())}
+        self._assemble()
+
+    @classmethod
+    def build(cls, repo_path: str, paths: List[str] = None) -> "CodeGraph":
+        """
+        Parses every Python file of a repository.
+
+        Args:
+            repo_path: Repository root
+            paths: Python files to parse (defaults to the .py files
+                iter_text_files yields)
+        """
+        if paths is None:
+            paths = sorted(p for p in iter_text_files(repo_path) if p.endswith(".py"))
+        facts = {}
+        for path in paths:
+            rel = os.path.relpath(path, repo_path)
+            parsed = parse_file(path, rel)
+            if parsed is not None:
+                facts[rel] = parsed
+        return cls(repo_path, facts, files_fingerprint(paths))
+
+    def updated(self, rel_paths: List[str], removed: List[str] = ()) -> "CodeGraph":
+        """
+        New graph with only the given files re-parsed (changed, added or deleted).
+
+        When the changed files still define and import the same names
+        (the usual edit inside function bodies) only their own edges are
+        re-resolved; otherwise every file's stored facts are re-resolved,
+        which reads no files but is linear in the size of the repository.
+
+        Args:
+            rel_paths: Paths relative to the repository root
+            removed: Paths to drop without re-reading them (e.g. files
+                that became gitignored)
+        """
+        facts = dict(self.facts)
+        for rel in removed:
+            facts.pop(rel, None)
+        for rel in rel_paths:
+            if not rel.endswith(".py"):
+                continue
+            facts.pop(rel, None)
+            path = os.path.join(self.repo_path, rel)
+            if os.path.isfile(path):
+                parsed = parse_file(path, rel)
+                if parsed is not None:
+                    facts[rel] = parsed
+
+        # Files that fail to parse before and after the edit have no facts either way
+        changed = [rel for rel in set(rel_paths) if rel.endswith(".py") and rel in facts]
+        same_shape = facts.keys() == self.facts.keys() and all(
+            [d[:2] for d in facts[rel].defs] == [d[:2] for d in self.facts[rel].defs]
+            and facts[rel].aliases == self.facts[rel].aliases
+            for rel in changed
+        )
+        if not same_shape:
+            return CodeGraph(self.repo_path, facts)
+
+        graph = copy.copy(self)
+        graph.facts = facts
+        graph.fingerprint = ""
+        graph.names, graph.files, graph._ids = list(self.names), list(self.files), dict(self._ids)
+        graph._by_last = {last: list(ids) for last, ids in self._by_last.items()}
+        graph._kinds, graph._lines = list(self._kinds), list(self._lines)
+        graph._edges = dict(self._edges)
+        for rel in changed:
+            for qualname, _, line in facts[rel].defs:
+                graph._lines[graph._ids[qualname]] = line
+            graph._edges[rel] = graph._resolve_file(facts[rel])
+        graph._assemble()
+        return graph
+
+    # -- resolution --------------------------------------------------------
+
+    def _add(self, name: str, kind: int, rel: str, line: int) -> int:
+        if name not in self._ids:
+            self._ids[name] = len(self.names)
+            self._by_last.setdefault(name.rsplit(".", 1)[-1], []).append(len(self.names))
+            self.names.append(name)
+            self._kinds.append(kind)
+            self.files.append(rel)
+            self._lines.append(line)
+        return self._ids[name]
+
+    def _index_nodes(self):
+        """Node table plus the name lookups resolution needs."""
+        self.names: List[str] = []
+        self.files: List[str] = []
+        self._kinds: List[int] = []
+        self._lines: List[int] = []
+        self._ids: Dict[str, int] = {}
+        self._by_last: Dict[str, List[int]] = {}
+        self._by_module: Dict[str, FileFacts] = {}
+        for rel in sorted(self.facts):
+            facts = self.facts[rel]
+            self._by_module[facts.module] = facts
+            self._add(facts.module, MODULE, rel, 1)
+            for qualname, kind, line in facts.defs:
+                self._add(qualname, kind, rel, line)
+
+        self._methods_by_name: Dict[str, List[int]] = {}
+        for i, name in enumerate(self.names):
+            owner, attr = name.rsplit(".", 1) if "." in name else ("", name)
+            if (self._kinds[i] == FUNCTION and self._kinds[self._ids.get(owner, i)] == CLASS
+                    and attr not in _BUILTIN_METHODS):
+                self._methods_by_name.setdefault(attr, []).append(i)
+
+    def _symbol(self, qualified: str, depth: int = 0) -> Optional[int]:
+        """Node for an imported dotted name, following package re-exports."""
+        if qualified in self._ids:
+            return self._ids[qualified]
+        if depth >= REEXPORT_DEPTH or "." not in qualified:
+            return None
+        owner, attr = qualified.rsplit(".", 1)
+        facts = self._by_module.get(owner)
+        if facts is not None and attr in facts.aliases:
+            return self._symbol(facts.aliases[attr], depth + 1)
+        # Attribute of an imported name (Class.method, module.func via re-export)
+        base = self._symbol(owner, depth + 1)
+        if base is not None:
+            return self._ids.get(f"{self.names[base]}.{attr}")
+        return None
+
+    def _approximate(self, attr: str) -> List[int]:
+        candidates = self._methods_by_name.get(attr, [])
+        return candidates if len(candidates) <= AMBIGUOUS_LIMIT else []
+
+    def _resolve_call(self, facts: FileFacts, ref: tuple) -> List[int]:
+        kind = ref[0]
+        if kind == "name":
+            name = ref[1]
+            if name in facts.aliases:
+                target = self._symbol(facts.aliases[name])
+            else:
+                target = self._ids.get(f"{facts.module}.{name}")
+            return [target] if target is not None else []
+        if kind == "self":
+            target = self._ids.get(f"{ref[1]}.{ref[2]}")
+            return [target] if target is not None else self._approximate(ref[2])
+        if kind == "attr":
+            base, attr = ref[1], ref[2]
+            if base in facts.aliases:
+                # None: imported module or class outside the repository
+                target = self._symbol(f"{facts.aliases[base]}.{attr}")
+                return [target] if target is not None else []
+            target = self._ids.get(f"{facts.module}.{base}.{attr}")
+            return [target] if target is not None else self._approximate(attr)
+        return self._approximate(ref[1])
+
+    def _resolve_file(self, facts: FileFacts) -> tuple:
+        module_id = self._ids[facts.module]
+        import_src, import_dst, import_lines = [], [], []
+        for imported, line in facts.imports:
+            # "from pkg.mod import name": the module is pkg.mod unless name is a submodule
+            owner = imported.rsplit(".", 1)[0]
+            if imported in self._by_module:
+                target_id = self._ids[imported]
+            elif owner in self._by_module:
+                target_id = self._ids[owner]
+            else:
+                target_id = self._add(imported.split(".")[0], EXTERNAL, "", 0)
+            if target_id != module_id:
+                import_src.append(module_id)
+                import_dst.append(target_id)
+                import_lines.append(line)
+
+        call_src, call_dst, call_lines = [], [], []
+        for caller, ref, line in facts.calls:
+            caller_id = self._ids.get(caller, module_id)
+            for target_id in self._resolve_call(facts, ref):
+                call_src.append(caller_id)
+                call_dst.append(target_id)
+                call_lines.append(line)
+        return tuple(
+            np.asarray(column, dtype=np.int32)
+            for column in (import_src, import_dst, import_lines, call_src, call_dst, call_lines)
+        )
+
+    def _assemble(self):
+        """Builds the CSR arrays from the per-file edge arrays."""
+        n = len(self.names)
+        per_file = list(self._edges.values())
+        import_src, import_dst, import_lines, call_src, call_dst, call_lines = (
+            np.concatenate([edges[c] for edges in per_file]) if per_file else np.zeros(0, dtype=np.int32)
+            for c in range(6)
+        )
+        self.kinds = np.asarray(self._kinds, dtype=np.int8)
+        self.lines = np.asarray(self._lines, dtype=np.int32)
+        self.imports = _csr(n, import_src, import_dst, import_lines)
+        self.imported_by = _csr(n, import_dst, import_src, import_lines)
+        self.calls = _csr(n, call_src, call_dst, call_lines)
+        self.called_by = _csr(n, call_dst, call_src, call_lines)
+
+    # -- queries -----------------------------------------------------------
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    @property
+    def edge_counts(self) -> dict:
+        return {"imports": len(self.imports[1]), "calls": len(self.calls[1])}
+
+    def lookup(self, name: str, kinds: tuple = None) -> List[int]:
+        """
+        Nodes matching a qualified name, a file path or a trailing name part.
+
+        "teach", "StudyMateAgent.teach", "agent.core.StudyMateAgent.teach",
+        "api/main.py" and "api.main" all work.
+        """
+        name = name.strip().strip("`").rstrip("()")
+        if name.endswith(".py"):
+            name = module_name(os.path.normpath(name))
+        if name in self._ids:
+            found = [self._ids[name]]
+        else:
+            suffix = "." + name
+            found = [i for i in self._by_last.get(name.rsplit(".", 1)[-1], [])
+                     if self.names[i] == name or self.names[i].endswith(suffix)]
+        if kinds is not None:
+            found = [i for i in found if self.kinds[i] in kinds]
+        return found
+
+    def _row(self, graph, i: int) -> List[Tuple[int, int]]:
+        indptr, targets, lines = graph
+        return list(zip(targets[indptr[i]:indptr[i + 1]].tolist(), lines[indptr[i]:indptr[i + 1]].tolist()))
+
+    def _describe(self, i: int, line: int = None, line_file: str = None) -> dict:
+        entry = {"name": self.names[i], "kind": KIND_NAMES[self.kinds[i]], "file": self.files[i],
+                 "line": int(self.lines[i])}
+        if line is not None:
+            entry["at"] = f"{line_file}:{line}"
+        return entry
+
+    def callers(self, name: str) -> List[dict]:
+        """Functions (or module-level code) that call ``name``, with call-site lines."""
+        result = []
+        for target in self.lookup(name, (FUNCTION, CLASS)):
+            for caller, line in self._row(self.called_by, target):
+                result.append(dict(self._describe(caller, line, self.files[caller]), callee=self.names[target]))
+        return result
+
+    def callees(self, name: str) -> List[dict]:
+        """Repository functions and classes that ``name`` calls, with call-site lines."""
+        result = []
+        for source in self.lookup(name, (FUNCTION, CLASS, MODULE)):
+            for callee, line in self._row(self.calls, source):
+                result.append(dict(self._describe(callee, line, self.files[source]), caller=self.names[source]))
+        return result
+
+    def dependencies(self, module: str, reverse: bool = False) -> List[dict]:
+        """Modules ``module`` imports (or, with ``reverse``, modules importing it)."""
+        graph = self.imported_by if reverse else self.imports
+        result = []
+        for source in self.lookup(module, (MODULE,)):
+            for other, line in self._row(graph, source):
+                where = self.files[other] if reverse else self.files[source]
+                result.append(self._describe(other, line, where))
+        return result
+
+    def path(self, source: str, target: str) -> Optional[List[str]]:
+        """
+        Shortest chain from ``source`` to ``target``.
+
+        Module to module follows imports; anything else follows calls.
+
+        Returns:
+            Qualified names from source to target, or None if unreachable
+        """
+        sources, targets = self.lookup(source), set(self.lookup(target))
+        if not sources or not targets:
+            return None
+        modules = all(self.kinds[i] == MODULE for i in sources) and all(self.kinds[i] == MODULE for i in targets)
+        indptr, edges, _ = self.imports if modules else self.calls
+        previous = {i: None for i in sources}
+        queue = deque(sources)
+        while queue:
+            node = queue.popleft()
+            if node in targets:
+                chain = []
+                while node is not None:
+                    chain.append(self.names[node])
+                    node = previous[node]
+                return chain[::-1]
+            for nxt in edges[indptr[node]:indptr[node + 1]].tolist():
+                if nxt not in previous:
+                    previous[nxt] = node
+                    queue.append(nxt)
+        return None
+
+
+# Graphs already built in this process, keyed by absolute repo path
+_graphs: Dict[str, CodeGraph] = {}
+
+# When each graph was last checked against the repository's files
+_graph_checked: Dict[str, float] = {}
+
+
+def get_graph(repo_path: str) -> Optional[CodeGraph]:
+    """
+    Returns an up-to-date graph for a repository.
+
+    Watched repositories are kept current from the change journal;
+    otherwise the graph is rebuilt when the .py files' sizes or mtimes
+    change. Like retrieval indexes, a checked graph is reused for
+    ``retrieval.INDEX_CHECK_S`` seconds before the files are walked again.
+    """
+    if not repo_path or not os.path.isdir(repo_path):
+        return None
+    from .watcher import watched
+
+    watcher = watched(repo_path)
+    if watcher is not None:
+        return watcher.graph()
+    repo_path = os.path.abspath(repo_path)
+    now = time.monotonic()
+    graph = _graphs.get(repo_path)
+    if graph is not None and now - _graph_checked.get(repo_path, -math.inf) < retrieval.INDEX_CHECK_S:
+        return graph
+    paths = sorted(p for p in iter_text_files(repo_path) if p.endswith(".py"))
+    _graph_checked[repo_path] = now
+    if graph is None or graph.fingerprint != files_fingerprint(paths):
+        graph = _graphs[repo_path] = CodeGraph.build(repo_path, paths)
+    return graph
@@ -2,10 +2,12 @@
 Core Agent Logic for StudyMate - Simplified Version
 """
 
-from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+from langchain_core.messages import BaseMessage, HumanMessage
 from .tools import (
+    hint_level,
+    progressive_hint_text,
+    socratic_question_text,
     analyze_repo_structure,
     extract_code_snippet,
     search_repo_concept,
@@ -15,10 +17,52 @@ from .tools import (
     track_learning_progress
 )
 from .prompts import SYSTEM_PROMPT
+from .transcript import Transcript
+from .retrieval import get_index, repo_fingerprint
+from .summaries import load_summaries
+from .llm import DEFAULT_MODEL
+from .routing import routed_model
+from .speculation import speculation_enabled, speculator
+from .watcher import watch, watched, watching_enabled
+from .deadline import CancelScope, TurnCancelled, cancel_scope, count_cancelled, current_scope
+from .budget import SessionLedger, metering
+from .response_cache import response_cache, response_cache_enabled
 import os
-from openai import OpenAI
+import re
+import threading
+from typing import Generator, List
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+FALLBACK_REPLY = "I encountered an issue. Could you rephrase your question?"
+
+# History sent to the model after the system prompt. The window start
+# only moves in steps of HISTORY_STEP turns, so consecutive requests share
+# a byte-identical prefix (system prompt + repo block + older turns) that
+# the provider's prompt cache can reuse. Between
+# HISTORY_MAX_TURNS - HISTORY_STEP + 1 and HISTORY_MAX_TURNS turns are kept.
+HISTORY_MAX_TURNS = 16
+HISTORY_STEP = 6
+
+# Upper bound on retrieved repository code injected per turn
+CONTEXT_TOKEN_BUDGET = 1500
+
+# Smaller prompts for sessions past the "reduced" share of their budget
+# (see agent.budget): shorter history, less code, clipped input
+REDUCED_HISTORY_TURNS = 4
+REDUCED_HISTORY_STEP = 2
+REDUCED_CONTEXT_TOKEN_BUDGET = 400
+REDUCED_INPUT_CHARS = 4000
+
+# Path-like words in a message; a mention must be a whole word, so a.py
+# does not match data.py
+_PATH_WORD = re.compile(r"[\w./-]+")
+
+
+def history_start(turns: int, max_turns: int = HISTORY_MAX_TURNS, step: int = HISTORY_STEP) -> int:
+    """First transcript turn to send, aligned to ``step``."""
+    if turns <= max_turns:
+        return 0
+    steps = -(-(turns - max_turns) // step)
+    return steps * step
 
 
 class StudyMateAgent:
@@ -27,63 +71,422 @@ class StudyMateAgent:
     Simplified version without LangChain Agent framework.
     """
     
-    def __init__(self, repo_path: str = None):
+    def __init__(self, repo_path: str = None, transcript: Transcript = None,
+                 knowledge_level: str = "intermediate"):
         """
         Initialize the StudyMate agent.
         
         Args:
             repo_path: Path to the cloned repository
+            transcript: Existing session transcript to continue from
+            knowledge_level: Student's level (beginner/intermediate/advanced)
         """
         self.repo_path = repo_path
-        self.model = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+        self.knowledge_level = knowledge_level
         
-        # Initialize LLM
-        self.llm = ChatOpenAI(
-            model=self.model,
-            temperature=0.7,
-            api_key=os.getenv("OPENAI_API_KEY"),
-        )
+        # Keep structure/search/retrieval data current while the repo is edited
+        if repo_path and watching_enabled():
+            watch(repo_path)
+        self.model = os.getenv("OPENAI_MODEL", DEFAULT_MODEL)
+        
+        # Initialize LLM (model chosen per call by the router)
+        self.llm = routed_model("teach", temperature=0.7)
+        
+        # Conversation history, shared with the API's session record
+        self.transcript = transcript if transcript is not None else Transcript()
         
-        # Simple chat history
-        self.chat_history = [SystemMessage(content=SYSTEM_PROMPT)]
+        # Token usage reported by the provider, including prompt cache hits
+        self.usage = {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0}
+        
+        # Every model and tool call made for this session, checked against its budget
+        self.ledger = SessionLedger.from_env()
+        
+        # Concept currently being taught and how often the student struggled with it
+        self.session_id = None
+        self.active_concept = None
+        self.struggle_count = 0
+        
+        # Understanding level from the latest focus(), acted on by the next turn
+        self._assessment = None
+        
+        # One turn at a time, so a cancelled turn can roll back only its own messages
+        self._turn_lock = threading.Lock()
     
-    def teach(self, student_input: str, session_id: str = None) -> str:
+    def teach(self, student_input: str, session_id: str = None, record_input: bool = True,
+              scope: CancelScope = None) -> str:
         """
         Main teaching interaction.
         
         Args:
             student_input: What the student said
             session_id: Session identifier for progress tracking
+            record_input: Store the input in the transcript (False for
+                internal instructions such as the greeting prompt)
+            scope: Deadline/cancellation for this turn (defaults to the
+                caller's current scope)
             
         Returns:
             Agent's response
-        """
-        try:
-            # Add repo path context if available
-            if self.repo_path:
-                enhanced_input = f"[Repository at: {self.repo_path}]\n\nStudent: {student_input}"
-            else:
-                enhanced_input = student_input
             
-            # Add student message to history
-            self.chat_history.append(HumanMessage(content=enhanced_input))
+        Raises:
+            TurnCancelled: The scope was cancelled; the transcript is
+                left as it was before the turn
+            BudgetExceeded: The session has used up its budget; nothing
+                is recorded
+        """
+        scope = scope or current_scope()
+        with self._turn_lock, cancel_scope(scope), metering(self.ledger):
+            self.ledger.check()
+            mark = len(self.transcript)
+            cache_key, cached = self._cache_lookup(student_input) if record_input else (None, None)
+            if cached is not None:
+                self._cached_turn(student_input, session_id, cached)
+                return cached
+            try:
+                messages = self._start_turn(student_input, session_id, record_input,
+                                            standalone=cache_key is not None)
+                
+                # Get response from LLM
+                response = self.llm.invoke(messages)
+                self._record_usage(response)
+                reply = response.content
+                if scope is not None:
+                    scope.check()
+                self._cache_reply(cache_key, reply)
+                
+            except TurnCancelled as e:
+                self._rollback(mark, e.reason)
+                raise
+            except Exception as e:
+                print(f"Agent error: {str(e)}")
+                reply = FALLBACK_REPLY
             
-            # Get response from LLM
-            response = self.llm.invoke(self.chat_history)
+            self._finish_turn(reply)
+            return reply
+    
+    def teach_stream(self, student_input: str, session_id: str = None,
+                     scope: CancelScope = None) -> Generator[str, None, str]:
+        """
+        Same as ``teach`` but yields the response as it is generated.
+        
+        Args:
+            student_input: What the student said
+            session_id: Session identifier for progress tracking
+            scope: Deadline/cancellation for this turn
             
-            # Add AI response to history
-            self.chat_history.append(AIMessage(content=response.content))
+        Yields:
+            Response text fragments; the full reply is recorded once the
+            stream is exhausted
             
-            # Keep only last 12 messages (system + 5 exchanges)
-            if len(self.chat_history) > 12:
-                self.chat_history = [self.chat_history[0]] + self.chat_history[-11:]
+        Returns:
+            The recorded reply (the generator's return value). If the model
+            fails after fragments were yielded it is FALLBACK_REPLY, which
+            is not yielded, so callers can tell it apart from the fragments
             
-            return response.content
+        Raises:
+            BudgetExceeded: The session has used up its budget (before
+                anything is yielded)
+        """
+        parts = []
+        aggregate = None
+        scope = scope or current_scope()
+        
+        with self._turn_lock:
+            self.ledger.check()
+            mark = len(self.transcript)
+            cache_key, cached = self._cache_lookup(student_input)
+            if cached is not None:
+                self._cached_turn(student_input, session_id, cached)
+                yield cached
+                return cached
+            try:
+                try:
+                    with cancel_scope(scope), metering(self.ledger):
+                        messages = self._start_turn(student_input, session_id, record_input=True,
+                                                    standalone=cache_key is not None)
+                        stream = self.llm.stream(messages)
+                    # The scope is re-entered per chunk: a generator must not hold a
+                    # context variable across yields
+                    while True:
+                        with cancel_scope(scope), metering(self.ledger):
+                            chunk = next(stream, None)
+                        if chunk is None:
+                            break
+                        aggregate = chunk if aggregate is None else aggregate + chunk
+                        if chunk.content:
+                            parts.append(chunk.content)
+                            yield chunk.content
+                    if aggregate is not None:
+                        self._record_usage(aggregate)
+                    reply = ''.join(parts)
+                    self._cache_reply(cache_key, reply)
+                
+                except TurnCancelled as e:
+                    self._rollback(mark, e.reason)
+                    raise
+                except Exception as e:
+                    print(f"Agent error: {str(e)}")
+                    # Never streamed as a continuation of a partial reply
+                    reply = FALLBACK_REPLY
+                    if not parts:
+                        yield reply
+                
+            except GeneratorExit:
+                # Closed by the consumer (the client went away): same as a cancelled turn
+                self._rollback(mark, "client_disconnected")
+                raise
             
+            self._finish_turn(reply)
+            return reply
+    
+    def _rollback(self, mark: int, reason: str):
+        """Drops a cancelled turn's messages from the transcript."""
+        self.transcript.truncate(mark)
+        count_cancelled("turns_cancelled", reason)
+        print(f"⏹️ Turn cancelled ({reason}); history rolled back")
+    
+    def _start_turn(self, student_input: str, session_id: str, record_input: bool,
+                    standalone: bool = False) -> List[BaseMessage]:
+        """
+        Records the input and assembles the messages for the model.
+        
+        A ``standalone`` turn is sent without the session's history (its
+        reply may be cached and shown to other students, so it must not
+        depend on, or repeat, anything personal such as the greeting).
+        """
+        if session_id:
+            self.session_id = session_id
+        if record_input:
+            self.transcript.append("user", student_input)
+        
+        # Sessions nearing their budget get a shorter prompt before being refused
+        reduced = self.ledger.level() != "normal"
+        if reduced:
+            self.ledger.count_degraded()
+            if len(student_input) > REDUCED_INPUT_CHARS:
+                student_input = student_input[:REDUCED_INPUT_CHARS] + "\n[... message truncated]"
+        
+        # Stable prefix: system prompt + repo block + step-aligned history
+        if standalone:
+            start = len(self.transcript) - 1
+        elif reduced:
+            start = history_start(len(self.transcript), REDUCED_HISTORY_TURNS, REDUCED_HISTORY_STEP)
+        else:
+            start = history_start(len(self.transcript))
+        messages = self.transcript.to_messages(self._system_prompt(), start)
+        
+        # Variable suffix: per-turn repository context, guidance + the new input
+        extras = []
+        if self.repo_path:
+            context = self._repo_context(
+                student_input, REDUCED_CONTEXT_TOKEN_BUDGET if reduced else CONTEXT_TOKEN_BUDGET
+            )
+            if context:
+                extras.append(f"Relevant code from the repository:\n{context}")
+        guidance = self._guidance() if record_input else ""
+        if guidance:
+            extras.append(guidance)
+        if self.repo_path or extras:
+            enhanced_input = "\n\n".join(extras + [f"Student: {student_input}"])
+        else:
+            enhanced_input = student_input
+        
+        if record_input:
+            messages[-1] = HumanMessage(content=enhanced_input)
+        else:
+            messages.append(HumanMessage(content=enhanced_input))
+        return messages
+    
+    def _finish_turn(self, reply: str):
+        """Records the reply and kicks off background work for the next turn."""
+        self.transcript.append("assistant", reply)
+        self._speculate()
+    
+    def _cache_key(self, student_input: str):
+        """Response cache key for this input, or None when it must not be cached."""
+        if not response_cache_enabled():
+            return None
+        # Cached replies are only valid for the repository as it was when stored
+        version = 0
+        if self.repo_path:
+            watcher = watched(self.repo_path)
+            version = watcher.seq if watcher is not None else repo_fingerprint(self.repo_path)
+        repo = (os.path.abspath(self.repo_path) if self.repo_path else "", version)
+        first_turn = self.transcript.count("user") == 0
+        return response_cache.key(repo, self.knowledge_level, student_input, first_turn)
+    
+    def _cache_lookup(self, student_input: str) -> tuple:
+        """(cache key, cached reply or None); a failing lookup skips the cache instead of the turn."""
+        try:
+            cache_key = self._cache_key(student_input)
+            return cache_key, response_cache.lookup(cache_key) if cache_key else None
         except Exception as e:
-            print(f"Agent error: {str(e)}")
-            return "I encountered an issue. Could you rephrase your question?"
+            print(f"Response cache error: {str(e)}")
+            return None, None
+    
+    def _cache_reply(self, cache_key, reply: str):
+        """Stores a full-quality reply (not a fallback or a budget-reduced one)."""
+        if cache_key is None or not reply or reply == FALLBACK_REPLY:
+            return
+        if self.ledger.level() != "normal":
+            return
+        response_cache.store(cache_key, reply)
+    
+    def _cached_turn(self, student_input: str, session_id: str, reply: str):
+        """Records a turn answered from the response cache, without a model call."""
+        if session_id:
+            self.session_id = session_id
+        self.transcript.append("user", student_input)
+        self._finish_turn(reply)
+    
+    def focus(self, concept: str, understanding_level: str = None):
+        """
+        Records the concept under discussion and how the student is doing.
+        
+        Switching concept resets the struggle count and discards anything
+        pre-generated for the old one. With speculation on, the next turn
+        works a hint (poor/partial) or a follow-up question (good/excellent)
+        for the concept into its prompt.
+        
+        Args:
+            concept: Concept being taught
+            understanding_level: Latest assessment (poor/partial/good/excellent)
+        """
+        concept = concept.strip()
+        if concept.lower() != (self.active_concept or "").lower():
+            if self.session_id:
+                speculator.discard(self.session_id)
+            self.active_concept = concept
+            self.struggle_count = 0
+        if understanding_level in ("poor", "partial"):
+            self.struggle_count += 1
+        elif understanding_level in ("good", "excellent"):
+            self.struggle_count = 0
+        self._assessment = understanding_level
+    
+    def _speculate(self):
+        """Pre-generates the next hint level and question for the active concept."""
+        if not (speculation_enabled() and self.session_id and self.active_concept):
+            return
+        # Speculative calls are the first thing a session over budget gives up
+        if self.ledger.level() != "normal":
+            return
+        ledger = self.ledger
+        concept, level = self.active_concept, hint_level(self.struggle_count + 1)
+        speculator.schedule(
+            self.session_id, ("hint", concept.lower(), level),
+            lambda: ledger.run(progressive_hint_text, concept, level),
+        )
+        student_level = self.knowledge_level
+        speculator.schedule(
+            self.session_id, ("question", concept.lower(), student_level),
+            lambda: ledger.run(socratic_question_text, concept, student_level),
+        )
+    
+    def _guidance(self) -> str:
+        """
+        Hint or follow-up question for the concept the student was just assessed on.
+        
+        Goes through the hint/question tools with the session id, so what
+        ``_speculate`` pre-generated after the last turn is used without a
+        model call.
+        """
+        assessment, self._assessment = self._assessment, None
+        if not (speculation_enabled() and self.session_id and self.active_concept):
+            return ""
+        if self.ledger.level() != "normal":
+            return ""
+        concept = self.active_concept
+        if assessment in ("poor", "partial"):
+            hint = provide_progressive_hint.func(concept, self.struggle_count, session_id=self.session_id)
+            return f"The student is struggling with {concept}. Hint to build on: {hint}"
+        if assessment in ("good", "excellent"):
+            question = generate_socratic_question.func(concept, self.knowledge_level, session_id=self.session_id)
+            return f"The student understands {concept}. Possible next question: {question}"
+        return ""
+    
+    def _system_prompt(self) -> str:
+        """
+        System prompt plus the repo block.
+        
+        Depends only on the repository, so every session on the same repo
+        sends the same bytes and can share the provider's prefix cache.
+        """
+        if not self.repo_path:
+            return SYSTEM_PROMPT
+        block = f"[Repository at: {self.repo_path}]"
+        overview = self._repo_overview()
+        if overview:
+            block += f"\n\nRepository overview: {overview}"
+        return f"{SYSTEM_PROMPT}\n\n{block}"
+    
+    def _record_usage(self, response):
+        """Accumulates token counts from the response's usage metadata."""
+        usage = getattr(response, "usage_metadata", None) or {}
+        self.usage["calls"] += 1
+        self.usage["prompt_tokens"] += usage.get("input_tokens", 0) or 0
+        self.usage["completion_tokens"] += usage.get("output_tokens", 0) or 0
+        details = usage.get("input_token_details") or {}
+        self.usage["cached_tokens"] += details.get("cache_read", 0) or 0
+    
+    @property
+    def cached_token_ratio(self) -> float:
+        """Share of prompt tokens served from the provider's prompt cache."""
+        if not self.usage["prompt_tokens"]:
+            return 0.0
+        return self.usage["cached_tokens"] / self.usage["prompt_tokens"]
+    
+    def _repo_context(self, student_input: str, token_budget: int = CONTEXT_TOKEN_BUDGET) -> str:
+        """Summaries of mentioned paths plus repository chunks relevant to the message."""
+        parts = [self._path_summaries(student_input)]
+        try:
+            watcher = watched(self.repo_path)
+            index = watcher.index() if watcher is not None else get_index(self.repo_path)
+            if index is not None:
+                parts.append(index.context_for(student_input, token_budget=token_budget))
+        except Exception as e:
+            print(f"Retrieval error: {str(e)}")
+        return '\n\n'.join(p for p in parts if p)
+    
+    def _repo_overview(self) -> str:
+        """Precomputed whole-repository summary, if any."""
+        summaries = load_summaries(self.repo_path) if self.repo_path else None
+        if not summaries or "" not in summaries["dirs"]:
+            return ""
+        return summaries["dirs"][""]["summary"]
+    
+    def _path_summaries(self, student_input: str) -> str:
+        """Precomputed summaries of files and directories the input mentions."""
+        summaries = load_summaries(self.repo_path) if self.repo_path else None
+        if not summaries:
+            return ""
+        mentioned = set()
+        for word in _PATH_WORD.findall(student_input):
+            # Sentence punctuation, trailing slashes and a leading ./ are not part of the path
+            word = word.rstrip("./")
+            mentioned.add(word[2:] if word.startswith("./") else word)
+        lines = []
+        for kind in ("dirs", "files"):
+            for rel, entry in summaries[kind].items():
+                if rel and rel in mentioned:
+                    lines.append(f"{rel}: {entry['summary']}")
+        return '\n'.join(lines)
+    
+    def describe(self, student_input: str = "") -> str:
+        """
+        Looks up precomputed summaries without calling the model.
+        
+        Args:
+            student_input: Text that may mention files or directories
+            
+        Returns:
+            The repository summary plus summaries of any paths the input
+            mentions (empty string if the repo has not been summarized)
+        """
+        overview = self._repo_overview()
+        parts = [f"Repository overview: {overview}" if overview else "", self._path_summaries(student_input)]
+        return '\n'.join(p for p in parts if p)
     
     def reset_memory(self):
         """Clears conversation history."""
-        self.chat_history = [SystemMessage(content=SYSTEM_PROMPT)]
+        self.transcript.clear()
@@ -0,0 +1,113 @@
+"""
+Deadlines and cancellation for StudyMate turns
+
+A CancelScope travels with a turn through a context variable, so the
+agent, the tools and every routed model call see the same deadline
+without it being passed through each signature. Model calls made inside
+a scope stream their response and stop reading as soon as the scope is
+cancelled, which closes the upstream connection instead of paying for a
+reply nobody will read.
+
+Environment:
+    STUDYMATE_CHAT_DEADLINE_S - default deadline for one API turn (default 120)
+"""
+
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Optional
+
+CANCEL_REASONS = ("deadline_exceeded", "client_disconnected", "cancelled")
+
+
+class TurnCancelled(BaseException):
+    """
+    Raised inside a turn whose scope was cancelled or ran out of time.
+
+    Like asyncio.CancelledError it is not an Exception, so the broad
+    ``except Exception`` fallbacks in the agent and tools let it through.
+    """
+
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class CancelScope:
+    """
+    Cancellation flag plus optional deadline for one unit of work.
+
+    Args:
+        timeout_s: Seconds from now until the deadline (None = no deadline)
+    """
+
+    def __init__(self, timeout_s: Optional[float] = None):
+        self.deadline = time.monotonic() + timeout_s if timeout_s else None
+        self.reason: Optional[str] = None
+        self._event = threading.Event()
+
+    def cancel(self, reason: str = "cancelled"):
+        """Cancels the scope; the first reason given is kept."""
+        if self.reason is None:
+            self.reason = reason
+        self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        if not self._event.is_set() and self.deadline is not None and time.monotonic() >= self.deadline:
+            self.cancel("deadline_exceeded")
+        return self._event.is_set()
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left before the deadline, or None without one."""
+        if self.deadline is None:
+            return None
+        return max(self.deadline - time.monotonic(), 0.0)
+
+    def check(self):
+        """Raises TurnCancelled if the scope is cancelled or past its deadline."""
+        if self.cancelled:
+            raise TurnCancelled(self.reason)
+
+
+_current: contextvars.ContextVar = contextvars.ContextVar("studymate_cancel_scope", default=None)
+
+
+def current_scope() -> Optional[CancelScope]:
+    """The scope of the turn running in this context, if any."""
+    return _current.get()
+
+
+@contextmanager
+def cancel_scope(scope: Optional[CancelScope]):
+    """Makes ``scope`` the current scope for the duration of the block."""
+    token = _current.set(scope)
+    try:
+        yield scope
+    finally:
+        _current.reset(token)
+
+
+# Work abandoned because of a cancelled scope
+_stats = {
+    "turns_cancelled": 0,
+    "model_calls_aborted": 0,
+    "model_calls_skipped": 0,
+    "searches_stopped": 0,
+    **{reason: 0 for reason in CANCEL_REASONS},
+}
+_stats_lock = threading.Lock()
+
+
+def count_cancelled(counter: str, reason: str = None):
+    """Increments a cancelled-work counter (and the per-reason total for turns)."""
+    with _stats_lock:
+        _stats[counter] += 1
+        if reason in CANCEL_REASONS:
+            _stats[reason] += 1
+
+
+def cancellation_metrics() -> dict:
+    with _stats_lock:
+        return dict(_stats)
@@ -0,0 +1,71 @@
+"""
+Chat model construction for StudyMate
+
+Every ChatOpenAI instance in the project is created here so that
+cross-cutting concerns (record/replay today) apply to all call sites.
+
+Environment:
+    OPENAI_MODEL                 - model name (default gpt-4o-mini)
+    STUDYMATE_CASSETTE           - cassette file; enables record/replay
+    STUDYMATE_CASSETTE_MODE      - record, replay or auto (default replay)
+    STUDYMATE_CASSETTE_TIMING    - "1" to replay with recorded latencies
+    STUDYMATE_CASSETTE_SPEED     - latency divisor for timed replay
+"""
+
+import os
+from typing import Dict, Optional
+
+import httpx
+from langchain_openai import ChatOpenAI
+
+from .cassette import CassetteTransport
+
+DEFAULT_MODEL = "gpt-4o-mini"
+
+# One transport per cassette configuration, shared by every model so
+# repeated identical requests replay in recorded order across call sites
+_transports: Dict[tuple, CassetteTransport] = {}
+
+
+def cassette_transport() -> Optional[CassetteTransport]:
+    """Returns the configured cassette transport, or None when disabled."""
+    path = os.getenv("STUDYMATE_CASSETTE")
+    if not path:
+        return None
+    config = (
+        path,
+        os.getenv("STUDYMATE_CASSETTE_MODE", "replay"),
+        os.getenv("STUDYMATE_CASSETTE_TIMING") == "1",
+        float(os.getenv("STUDYMATE_CASSETTE_SPEED", "1")),
+    )
+    if config not in _transports:
+        _transports[config] = CassetteTransport(*config)
+    return _transports[config]
+
+
+def chat_model(temperature: float, model: str = None) -> ChatOpenAI:
+    """
+    Creates a ChatOpenAI client.
+
+    Args:
+        temperature: Sampling temperature
+        model: Model name (defaults to OPENAI_MODEL)
+
+    Returns:
+        ChatOpenAI wired to the cassette when one is configured
+    """
+    kwargs = {}
+    api_key = os.getenv("OPENAI_API_KEY")
+    transport = cassette_transport()
+    if transport is not None:
+        kwargs["http_client"] = httpx.Client(transport=transport)
+        # Replaying needs no credentials
+        api_key = api_key or "sk-cassette"
+    return ChatOpenAI(
+        model=model or os.getenv("OPENAI_MODEL", DEFAULT_MODEL),
+        temperature=temperature,
+        api_key=api_key,
+        # Streamed calls (WebSocket turns, cancellable calls) still report token usage
+        stream_usage=True,
+        **kwargs,
+    )
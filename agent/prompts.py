@@ -61,3 +61,23 @@ guided discovery.
 
 Before we dive in, tell me: **What interests you most about this project?** 
 What specific aspect would you like to understand?"""
+
+FILE_SUMMARY_PROMPT = """Summarize what this source file does for a student who is new to the codebase.
+
+File: {path}
+
+```
+{code}
+```
+
+In 2-3 sentences, describe its purpose and the main functions/classes it defines.
+Return ONLY the summary."""
+
+DIRECTORY_SUMMARY_PROMPT = """Summarize what this part of a repository does, based on summaries of its contents.
+
+Directory: {path}
+
+{children}
+
+In 2-4 sentences, describe the directory's overall responsibility and how its parts fit together.
+Return ONLY the summary."""
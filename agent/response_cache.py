@@ -0,0 +1,223 @@
+"""
+Semantic response cache for StudyMate
+
+Students on the same repository open with the same questions in
+different words ("what does this project do?", "explain this repo").
+With the cache on, the first answer is reused for later near-duplicates
+asked at the same knowledge level, instead of making another model call.
+
+A question is reduced to intent words (synonyms folded, filler dropped)
+and salient words (identifiers, file names, numbers, negations, "why"
+and the like). Two questions only match when their salient words are
+identical and the hashed embeddings of their intent words (the same
+feature hashing retrieval uses) reach the similarity threshold. Only
+first turns and context-free questions about the whole project are
+cached; anything that points back at the conversation ("it", "that",
+"again", ...) or carries code is never served from or stored in the
+cache. Cacheable turns are sent to the model without the session's
+history, so a shared reply cannot carry anything personal from it (such
+as the student's name in the greeting).
+
+Environment:
+    STUDYMATE_RESPONSE_CACHE           - "1" to enable (off by default)
+    STUDYMATE_RESPONSE_CACHE_THRESHOLD - cosine similarity for a hit (default 0.9)
+    STUDYMATE_RESPONSE_CACHE_SIZE      - entries kept before LRU eviction (default 1000)
+    STUDYMATE_RESPONSE_CACHE_TTL_S     - seconds an entry stays valid (default 86400)
+"""
+
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, FrozenSet, Optional, Tuple
+
+import numpy as np
+
+from .retrieval import _hash_counts
+
+# Longer questions are too specific to be worth caching
+MAX_QUESTION_CHARS = 300
+
+# Canonical intent for words students use interchangeably
+SYNONYMS = {
+    **dict.fromkeys(("project", "repo", "repository", "codebase", "code", "app", "application"), "project"),
+    **dict.fromkeys(("explain", "describe", "summarize", "summary", "overview", "about", "purpose",
+                     "do", "does", "doing", "work", "works", "goal"), "explain"),
+    **dict.fromkeys(("structure", "structured", "organized", "organised", "layout", "architecture"), "structure"),
+    **dict.fromkeys(("start", "begin", "first", "setup", "install", "run", "running"), "start"),
+    **dict.fromkeys(("learn", "study", "understand"), "learn"),
+}
+INTENT_WORDS = frozenset(SYNONYMS.values())
+
+# Filler that does not change what is being asked
+STOPWORDS = frozenset((
+    "a", "an", "the", "this", "is", "are", "be", "of", "to", "in", "on", "for", "and", "with",
+    "what", "how", "can", "could", "would", "you", "me", "please", "tell", "give", "i", "my",
+    "we", "our", "its", "whole", "overall", "entire", "main", "quick", "brief", "briefly", "hi",
+    "hello", "hey", "so", "just", "should", "want", "like", "know", "help", "let", "us",
+))
+
+# Words that refer back to the conversation: never context-free
+ANAPHORA = frozenset((
+    "it", "that", "those", "these", "they", "them", "again", "above", "previous", "earlier",
+    "last", "more", "instead", "also", "else", "same", "there", "then", "next",
+))
+
+_WORD = re.compile(r"[a-z0-9_./'-]+")
+
+
+def parse_question(question: str) -> Optional[Tuple[FrozenSet[str], FrozenSet[str], bool]]:
+    """
+    Splits a question into (intent words, salient words, refers back).
+
+    Returns:
+        None when the question is too long, contains code or has no words
+    """
+    if len(question) > MAX_QUESTION_CHARS or "```" in question or "\n" in question.strip():
+        return None
+    intents, salient, refers_back = set(), set(), False
+    for word in _WORD.findall(question.lower()):
+        word = word.replace("n't", " not").split()[-1] if "n't" in word else word
+        word = word.strip("./'-")
+        if word.endswith("'s"):
+            word = word[:-2]
+        if not word or word in STOPWORDS:
+            continue
+        if word in ANAPHORA:
+            refers_back = True
+        elif word in SYNONYMS:
+            intents.add(SYNONYMS[word])
+        else:
+            salient.add(word)
+    if not intents and not salient:
+        return None
+    return frozenset(intents), frozenset(salient), refers_back
+
+
+def _embed(intents: FrozenSet[str]) -> np.ndarray:
+    vec = _hash_counts(sorted(intents))
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm else vec
+
+
+class ResponseCache:
+    """
+    LRU cache of replies keyed by (repository, knowledge level, question).
+
+    Args:
+        threshold: Cosine similarity of intent embeddings needed for a hit
+        max_entries: Entries kept before the least recently used is evicted
+        ttl_s: Seconds an entry stays valid
+    """
+
+    def __init__(self, threshold: float = 0.9, max_entries: int = 1000, ttl_s: float = 86400.0):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        # (bucket, intents) -> (embedding, reply, expiry)
+        self._entries: "OrderedDict[tuple, Tuple[np.ndarray, str, float]]" = OrderedDict()
+        # bucket -> intent sets cached under it
+        self._buckets: Dict[tuple, set] = {}
+        self._lock = threading.Lock()
+        self.stats = {"lookups": 0, "hits": 0, "misses": 0, "skipped": 0,
+                      "stores": 0, "evictions": 0, "expired": 0}
+
+    @classmethod
+    def from_env(cls) -> "ResponseCache":
+        return cls(
+            threshold=float(os.getenv("STUDYMATE_RESPONSE_CACHE_THRESHOLD", "0.9")),
+            max_entries=int(os.getenv("STUDYMATE_RESPONSE_CACHE_SIZE", "1000")),
+            ttl_s=float(os.getenv("STUDYMATE_RESPONSE_CACHE_TTL_S", "86400")),
+        )
+
+    def key(self, repo: str, knowledge_level: str, question: str, first_turn: bool) -> Optional[tuple]:
+        """
+        Cache key for a question, or None (counted as skipped) if it must not be cached.
+
+        Args:
+            repo: Repository identity, including a version that changes
+                when its files change (watcher batch or index fingerprint)
+            knowledge_level: Student's level (replies are pitched to it)
+            question: The student's message
+            first_turn: No earlier student message in the session
+        """
+        parsed = parse_question(question)
+        cacheable = parsed is not None and not parsed[2] and (
+            # Later turns only for generic questions about the whole project
+            first_turn or (not parsed[1] and "project" in parsed[0])
+        )
+        if not cacheable:
+            with self._lock:
+                self.stats["skipped"] += 1
+            return None
+        intents, salient, _ = parsed
+        return (repo, knowledge_level, salient), intents
+
+    def _drop(self, key: tuple):
+        self._entries.pop(key, None)
+        bucket = self._buckets.get(key[0])
+        if bucket is not None:
+            bucket.discard(key[1])
+            if not bucket:
+                del self._buckets[key[0]]
+
+    def lookup(self, key: tuple) -> Optional[str]:
+        """Cached reply for the closest question in the same bucket, if similar enough."""
+        bucket, intents = key
+        now = time.monotonic()
+        with self._lock:
+            self.stats["lookups"] += 1
+            best, best_score = None, -1.0
+            query = _embed(intents)
+            for other in list(self._buckets.get(bucket, ())):
+                entry_key = (bucket, other)
+                vector, _, expires = self._entries[entry_key]
+                if expires <= now:
+                    self._drop(entry_key)
+                    self.stats["expired"] += 1
+                    continue
+                # Questions with no intent words only match each other
+                score = float(vector @ query) if other and intents else float(other == intents)
+                if score > best_score:
+                    best, best_score = entry_key, score
+            if best is None or best_score < self.threshold:
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(best)
+            self.stats["hits"] += 1
+            return self._entries[best][1]
+
+    def store(self, key: tuple, reply: str):
+        """Caches a reply, evicting the least recently used entries beyond ``max_entries``."""
+        bucket, intents = key
+        with self._lock:
+            self._entries[key] = (_embed(intents), reply, time.monotonic() + self.ttl_s)
+            self._entries.move_to_end(key)
+            self._buckets.setdefault(bucket, set()).add(intents)
+            self.stats["stores"] += 1
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.stats["evictions"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._buckets.clear()
+
+    def metrics(self) -> dict:
+        """Counters plus hit rate over cacheable lookups and current size."""
+        with self._lock:
+            stats = dict(self.stats)
+            stats["entries"] = len(self._entries)
+        stats["hit_rate"] = stats["hits"] / stats["lookups"] if stats["lookups"] else 0.0
+        stats["threshold"] = self.threshold
+        return stats
+
+
+def response_cache_enabled() -> bool:
+    return os.getenv("STUDYMATE_RESPONSE_CACHE") == "1"
+
+
+response_cache = ResponseCache.from_env()
@@ -0,0 +1,338 @@
+"""
+Offline chunk retrieval over a repository for StudyMate
+
+Embeds fixed-size line windows with signed feature hashing + TF-IDF
+weighting (no model download, no API call) and answers queries with a
+single matrix-vector product.
+
+Environment:
+    STUDYMATE_INDEX_DIR     - where indexes are persisted (default data/index in the project)
+    STUDYMATE_INDEX_CHECK_S - seconds an unwatched repository's index (and code
+                              graph) is trusted before its files are
+                              re-checked (default 5)
+"""
+
+import hashlib
+import math
+import os
+import re
+import time
+import zlib
+from collections import Counter
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from .search import MAX_FILE_BYTES, files_fingerprint, iter_text_files
+
+EMBED_DIM = 512
+
+# Chunking: windows of CHUNK_LINES lines, advancing by CHUNK_STRIDE
+CHUNK_LINES = 40
+CHUNK_STRIDE = 30
+
+INDEX_DIR = os.getenv("STUDYMATE_INDEX_DIR") or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "index"
+)
+
+# Checking an index walks and stats the whole repository, so a checked
+# index is reused without checking for this long
+INDEX_CHECK_S = float(os.getenv("STUDYMATE_INDEX_CHECK_S", "5"))
+
+# Rough characters-per-token ratio for budgeting prompt size
+CHARS_PER_TOKEN = 4
+
+_IDENTIFIER = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+_CAMEL = re.compile(r"[A-Z]?[a-z0-9]+|[A-Z]+(?![a-z])")
+
+
+def tokenize(text: str) -> List[str]:
+    """Splits identifiers on snake_case and camelCase boundaries."""
+    tokens = []
+    for word in _IDENTIFIER.findall(text):
+        for part in word.split('_'):
+            for piece in _CAMEL.findall(part):
+                if len(piece) > 1:
+                    tokens.append(piece.lower())
+    return tokens
+
+
+def _hash_counts(tokens: List[str]) -> np.ndarray:
+    """Signed hashing trick with sublinear term frequency."""
+    vec = np.zeros(EMBED_DIM, dtype=np.float32)
+    for token, count in Counter(tokens).items():
+        h = zlib.crc32(token.encode('utf-8'))
+        sign = 1.0 if h & 0x80000000 else -1.0
+        vec[h % EMBED_DIM] += sign * (1.0 + math.log(count))
+    return vec
+
+
+def _chunk_file(path: str, rel: str) -> List[tuple]:
+    """Unweighted hashed vectors for one file's line windows as (vector, start, end)."""
+    try:
+        if os.path.getsize(path) > MAX_FILE_BYTES:
+            return []
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return []
+    if b'\0' in data[:8192]:
+        return []
+    lines = data.decode('utf-8', errors='replace').splitlines()
+    chunks = []
+    for start in range(0, max(len(lines), 1), CHUNK_STRIDE):
+        window = lines[start:start + CHUNK_LINES]
+        # The file path is part of the chunk's vocabulary
+        tokens = tokenize(rel) + tokenize('\n'.join(window))
+        if tokens:
+            chunks.append((_hash_counts(tokens), start + 1, start + len(window)))
+        if start + CHUNK_LINES >= len(lines):
+            break
+    return chunks
+
+
+class RepoIndex:
+    """
+    Dense chunk index for one repository.
+
+    Rows of ``vectors`` are L2-normalised, so cosine similarity is a dot
+    product. Chunk text is not kept in memory; it is re-read from disk
+    for the handful of chunks returned by a query.
+    """
+
+    def __init__(self, repo_path: str, vectors: np.ndarray, idf: np.ndarray,
+                 paths: List[str], starts: np.ndarray, ends: np.ndarray, fingerprint: str):
+        self.repo_path = repo_path
+        self.vectors = vectors
+        self.idf = idf
+        self.paths = paths
+        self.starts = starts
+        self.ends = ends
+        self.fingerprint = fingerprint
+
+    def __len__(self) -> int:
+        return len(self.paths)
+
+    @classmethod
+    def build(cls, repo_path: str) -> "RepoIndex":
+        """
+        Chunks and embeds every text file in the repository.
+
+        Args:
+            repo_path: Repository root
+
+        Returns:
+            A new RepoIndex
+        """
+        files = sorted(iter_text_files(repo_path))
+        rows, paths, starts, ends = [], [], [], []
+
+        for path in files:
+            rel = os.path.relpath(path, repo_path)
+            for vec, start, end in _chunk_file(path, rel):
+                rows.append(vec)
+                paths.append(rel)
+                starts.append(start)
+                ends.append(end)
+
+        vectors = np.vstack(rows) if rows else np.zeros((0, EMBED_DIM), dtype=np.float32)
+        df = np.count_nonzero(vectors, axis=0)
+        idf = (np.log((len(rows) + 1) / (df + 1)) + 1.0).astype(np.float32)
+        vectors *= idf
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors /= np.maximum(norms, 1e-12)
+
+        return cls(
+            repo_path, vectors, idf, paths,
+            np.asarray(starts, dtype=np.int32), np.asarray(ends, dtype=np.int32),
+            files_fingerprint(files),
+        )
+
+    def update(self, rel_paths: List[str], removed: List[str] = ()) -> int:
+        """
+        Re-embeds only the given files (changed, added or deleted).
+
+        IDF weights are kept from the last full build, so new chunks are
+        weighted with the existing vocabulary statistics. The fingerprint
+        is cleared, so a persisted copy is rebuilt on the next start.
+
+        Args:
+            rel_paths: Paths relative to the repository root
+            removed: Paths to drop without re-reading them (e.g. files
+                that became gitignored)
+
+        Returns:
+            Number of chunks embedded
+        """
+        changed = set(rel_paths)
+        dropped = changed | set(removed)
+        keep = [i for i, rel in enumerate(self.paths) if rel not in dropped]
+        rows, paths, starts, ends = [], [], [], []
+        for rel in sorted(changed):
+            for vec, start, end in _chunk_file(os.path.join(self.repo_path, rel), rel):
+                rows.append(vec)
+                paths.append(rel)
+                starts.append(start)
+                ends.append(end)
+
+        if rows:
+            new = np.vstack(rows) * self.idf
+            new /= np.maximum(np.linalg.norm(new, axis=1, keepdims=True), 1e-12)
+        else:
+            new = np.zeros((0, EMBED_DIM), dtype=np.float32)
+        self.vectors = np.concatenate([self.vectors[keep], new])
+        self.paths = [self.paths[i] for i in keep] + paths
+        self.starts = np.concatenate([self.starts[keep], np.asarray(starts, dtype=np.int32)])
+        self.ends = np.concatenate([self.ends[keep], np.asarray(ends, dtype=np.int32)])
+        self.fingerprint = ""
+        return len(rows)
+
+    def save(self, path: str):
+        """Persists the index as an uncompressed .npz (fast to load)."""
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        np.savez(
+            path,
+            vectors=self.vectors,
+            idf=self.idf,
+            paths=np.asarray(self.paths, dtype=str),
+            starts=self.starts,
+            ends=self.ends,
+            meta=np.asarray([self.repo_path, self.fingerprint], dtype=str),
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "RepoIndex":
+        """Loads an index written by ``save``."""
+        with np.load(path) as data:
+            repo_path, fingerprint = data["meta"].tolist()
+            return cls(
+                repo_path, data["vectors"], data["idf"], data["paths"].tolist(),
+                data["starts"], data["ends"], fingerprint,
+            )
+
+    def query(self, text: str, k: int = 5) -> List[dict]:
+        """
+        Returns the ``k`` chunks most similar to ``text``.
+
+        Returns:
+            List of {"file", "start_line", "end_line", "score"} dicts,
+            best first
+        """
+        tokens = tokenize(text)
+        if not tokens or not len(self):
+            return []
+        q = _hash_counts(tokens) * self.idf
+        norm = np.linalg.norm(q)
+        if norm == 0:
+            return []
+        scores = self.vectors @ (q / norm)
+
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            {
+                "file": self.paths[i],
+                "start_line": int(self.starts[i]),
+                "end_line": int(self.ends[i]),
+                "score": float(scores[i]),
+            }
+            for i in top
+            if scores[i] > 0
+        ]
+
+    def context_for(self, text: str, token_budget: int = 1500, k: int = 8) -> str:
+        """
+        Formats the most relevant chunks for a prompt.
+
+        Chunks are added best-first; any chunk that would push the total
+        past ``token_budget`` is skipped.
+
+        Returns:
+            Markdown block of code chunks (empty string if none match)
+        """
+        parts = []
+        used = 0
+        for hit in self.query(text, k=k):
+            try:
+                with open(os.path.join(self.repo_path, hit["file"]), 'r',
+                          encoding='utf-8', errors='replace') as f:
+                    lines = f.read().splitlines()
+            except OSError:
+                continue
+            code = '\n'.join(lines[hit["start_line"] - 1:hit["end_line"]])
+            lang = os.path.splitext(hit["file"])[1].lstrip('.')
+            block = f"{hit['file']} (lines {hit['start_line']}-{hit['end_line']}):\n```{lang}\n{code}\n```"
+            cost = len(block) // CHARS_PER_TOKEN + 1
+            if used + cost > token_budget:
+                continue
+            parts.append(block)
+            used += cost
+        return '\n\n'.join(parts)
+
+
+# Indexes already loaded in this process, keyed by absolute repo path
+_indexes: Dict[str, RepoIndex] = {}
+
+# Each repository's latest fingerprint and when it was taken
+_checked: Dict[str, tuple] = {}
+
+
+def index_path(repo_path: str) -> str:
+    """Location of the persisted index for a repository."""
+    key = hashlib.sha1(os.path.abspath(repo_path).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(INDEX_DIR, f"{key}.npz")
+
+
+def repo_fingerprint(repo_path: str) -> str:
+    """
+    Fingerprint of a repository's files (see ``files_fingerprint``).
+
+    The repository is walked at most every ``INDEX_CHECK_S`` seconds;
+    in between the last fingerprint is returned. Never loads or builds
+    an index.
+    """
+    repo_path = os.path.abspath(repo_path)
+    now = time.monotonic()
+    checked = _checked.get(repo_path)
+    if checked is not None and now - checked[0] < INDEX_CHECK_S:
+        return checked[1]
+    fingerprint = files_fingerprint(sorted(iter_text_files(repo_path)))
+    _checked[repo_path] = (now, fingerprint)
+    return fingerprint
+
+
+def get_index(repo_path: str) -> Optional[RepoIndex]:
+    """
+    Returns an up-to-date index for a repository.
+
+    Uses the in-process copy, then the on-disk copy, and rebuilds only
+    when the repository's files have changed since it was written. The
+    files are re-checked at most every ``INDEX_CHECK_S`` seconds (see
+    ``repo_fingerprint``), so edits can take that long to show up.
+    """
+    if not repo_path or not os.path.isdir(repo_path):
+        return None
+    repo_path = os.path.abspath(repo_path)
+    fingerprint = repo_fingerprint(repo_path)
+    index = _indexes.get(repo_path)
+    if index is not None and index.fingerprint == fingerprint:
+        return index
+
+    path = index_path(repo_path)
+    if os.path.exists(path):
+        try:
+            index = RepoIndex.load(path)
+        except (OSError, ValueError, KeyError):
+            index = None
+        if index is not None and index.fingerprint == fingerprint:
+            _indexes[repo_path] = index
+            return index
+
+    print(f"🔎 Building retrieval index for {repo_path}...")
+    index = RepoIndex.build(repo_path)
+    index.save(path)
+    _indexes[repo_path] = index
+    # The build saw the files as they are now
+    _checked[repo_path] = (time.monotonic(), index.fingerprint)
+    return index
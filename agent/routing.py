@@ -0,0 +1,338 @@
+"""
+Latency-aware model routing for StudyMate
+
+Each LLM call site (the teaching turn, the JSON assessment, hints, ...)
+is mapped to a model tier by configuration. The router tracks observed
+latency and errors per model and fails over to the next, faster tier
+while a model breaches its p95 latency SLO or error-rate limit.
+
+Environment:
+    STUDYMATE_MODEL_TIERS     - JSON object tier -> model, ordered from
+                                highest quality to fastest
+                                (default {"default": OPENAI_MODEL})
+    STUDYMATE_ROUTES          - JSON object call site -> tier
+                                (unlisted sites use the first tier)
+    STUDYMATE_P95_SLO_S       - p95 latency SLO in seconds (default 10)
+    STUDYMATE_MAX_ERROR_RATE  - error rate that degrades a model (default 0.25)
+    STUDYMATE_ROUTER_COOLDOWN_S - seconds a degraded model is avoided (default 60)
+"""
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional, Tuple
+
+from langchain_core.messages import AIMessage
+
+from .budget import current_ledger
+from .deadline import TurnCancelled, count_cancelled, current_scope
+from .llm import DEFAULT_MODEL, chat_model
+
+# Call sites used across the project
+CALL_SITES = ("teach", "socratic_question", "assessment", "hint", "summary")
+
+# Samples kept per model, and needed before the SLO is evaluated
+STATS_WINDOW = 50
+MIN_SAMPLES = 5
+
+
+class _ModelStats:
+    __slots__ = ("latencies", "errors", "degraded_until")
+
+    def __init__(self):
+        self.latencies = deque(maxlen=STATS_WINDOW)
+        self.errors = deque(maxlen=STATS_WINDOW)
+        self.degraded_until = 0.0
+
+    def p95(self) -> float:
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[int(0.95 * (len(ordered) - 1))]
+
+    def error_rate(self) -> float:
+        return sum(self.errors) / len(self.errors) if self.errors else 0.0
+
+
+class ModelRouter:
+    """
+    Chooses a model per call site and records how each model performs.
+
+    Args:
+        tiers: Tier name -> model, ordered from preferred to fastest
+        routes: Call site -> tier name
+        p95_slo_s: p95 latency above which a model is degraded
+        max_error_rate: Error rate above which a model is degraded
+        cooldown_s: How long a degraded model is skipped before its
+            stats are reset and it is tried again
+    """
+
+    def __init__(self, tiers: Dict[str, str], routes: Dict[str, str] = None,
+                 p95_slo_s: float = 10.0, max_error_rate: float = 0.25, cooldown_s: float = 60.0):
+        if not tiers:
+            raise ValueError("At least one model tier is required")
+        unknown = set((routes or {}).values()) - set(tiers)
+        if unknown:
+            raise ValueError(f"Routes reference unknown tiers: {sorted(unknown)}")
+        self.tiers = dict(tiers)
+        self.tier_order = list(tiers)
+        self.routes = dict(routes or {})
+        self.p95_slo_s = p95_slo_s
+        self.max_error_rate = max_error_rate
+        self.cooldown_s = cooldown_s
+        self._stats: Dict[str, _ModelStats] = {}
+        self._decisions: Dict[str, Dict[str, Dict[str, int]]] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "ModelRouter":
+        """Builds a router from the STUDYMATE_* environment variables."""
+        tiers = json.loads(os.getenv("STUDYMATE_MODEL_TIERS") or "null") or {
+            "default": os.getenv("OPENAI_MODEL", DEFAULT_MODEL)
+        }
+        return cls(
+            tiers,
+            json.loads(os.getenv("STUDYMATE_ROUTES") or "{}"),
+            p95_slo_s=float(os.getenv("STUDYMATE_P95_SLO_S", "10")),
+            max_error_rate=float(os.getenv("STUDYMATE_MAX_ERROR_RATE", "0.25")),
+            cooldown_s=float(os.getenv("STUDYMATE_ROUTER_COOLDOWN_S", "60")),
+        )
+
+    def _healthy(self, model: str, now: float) -> bool:
+        stats = self._stats.get(model)
+        if stats is None or not stats.degraded_until:
+            return True
+        if now < stats.degraded_until:
+            return False
+        # Cooldown over: forget the bad samples and give it another chance
+        self._stats[model] = _ModelStats()
+        return True
+
+    def _count(self, site: str, model: str, reason: str):
+        by_model = self._decisions.setdefault(site, {}).setdefault(model, {})
+        by_model[reason] = by_model.get(reason, 0) + 1
+
+    def choose(self, site: str, cheapest: bool = False) -> Tuple[str, str]:
+        """
+        Picks the model for a call.
+
+        Args:
+            site: Call site
+            cheapest: Use the fastest tier regardless of the route (for
+                sessions close to their budget)
+
+        Returns:
+            (model, reason) where reason is "preferred", "slo_failover",
+            "all_degraded" or "budget"
+        """
+        if cheapest:
+            model = self.tiers[self.tier_order[-1]]
+            with self._lock:
+                self._count(site, model, "budget")
+            return model, "budget"
+        preferred = self.routes.get(site, self.tier_order[0])
+        candidates = self.tier_order[self.tier_order.index(preferred):]
+        now = time.monotonic()
+        with self._lock:
+            for tier in candidates:
+                model = self.tiers[tier]
+                if self._healthy(model, now):
+                    reason = "preferred" if tier == preferred else "slo_failover"
+                    break
+            else:
+                model, reason = self.tiers[candidates[-1]], "all_degraded"
+            self._count(site, model, reason)
+        return model, reason
+
+    def fallback(self, site: str, model: str) -> Optional[str]:
+        """Next faster model after ``model`` for a failed call, if any."""
+        tiers = [t for t in self.tier_order if self.tiers[t] == model]
+        if not tiers:
+            return None
+        index = self.tier_order.index(tiers[-1])
+        for tier in self.tier_order[index + 1:]:
+            if self.tiers[tier] != model:
+                with self._lock:
+                    self._count(site, self.tiers[tier], "error_failover")
+                return self.tiers[tier]
+        return None
+
+    def record(self, model: str, latency_s: float, ok: bool):
+        """Adds an observation and degrades the model if it breaches the SLO."""
+        with self._lock:
+            stats = self._stats.setdefault(model, _ModelStats())
+            stats.latencies.append(latency_s)
+            stats.errors.append(0 if ok else 1)
+            if len(stats.latencies) >= MIN_SAMPLES and not stats.degraded_until and (
+                stats.p95() > self.p95_slo_s or stats.error_rate() > self.max_error_rate
+            ):
+                stats.degraded_until = time.monotonic() + self.cooldown_s
+                print(f"⚠️ Model {model} degraded (p95 {stats.p95():.2f}s, errors {stats.error_rate():.0%})")
+
+    def metrics(self) -> dict:
+        """Routing decisions per call site and health per model."""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                "tiers": dict(self.tiers),
+                "routes": {site: self.routes.get(site, self.tier_order[0]) for site in CALL_SITES},
+                "p95_slo_s": self.p95_slo_s,
+                "decisions": json.loads(json.dumps(self._decisions)),
+                "models": {
+                    model: {
+                        "samples": len(stats.latencies),
+                        "p95_s": round(stats.p95(), 4),
+                        "error_rate": round(stats.error_rate(), 4),
+                        "degraded": stats.degraded_until > now,
+                    }
+                    for model, stats in self._stats.items()
+                },
+            }
+
+
+_router: Optional[ModelRouter] = None
+
+
+def get_router() -> ModelRouter:
+    """Process-wide router, built from the environment on first use."""
+    global _router
+    if _router is None:
+        _router = ModelRouter.from_env()
+    return _router
+
+
+def reset_router():
+    """Drops the process-wide router so the next call re-reads the environment."""
+    global _router
+    _router = None
+
+
+class RoutedChatModel:
+    """
+    Drop-in for ChatOpenAI.invoke/stream that routes each call through the router.
+
+    A failed call is retried once per faster tier before the error is
+    raised to the caller.
+
+    Args:
+        site: Call site name (see CALL_SITES)
+        temperature: Sampling temperature
+        router: Router to use (defaults to the process-wide one)
+    """
+
+    def __init__(self, site: str, temperature: float, router: ModelRouter = None):
+        self.site = site
+        self.temperature = temperature
+        self.router = router or get_router()
+        self._clients = {}
+
+    def _client(self, model: str):
+        if model not in self._clients:
+            self._clients[model] = chat_model(temperature=self.temperature, model=model)
+        return self._clients[model]
+
+    def _choose(self, ledger):
+        """Routed model, or the fastest tier for a session close to its budget."""
+        if ledger is not None and ledger.level() in ("cheap", "exhausted"):
+            ledger.count_degraded()
+            return self.router.choose(self.site, cheapest=True)[0]
+        return self.router.choose(self.site)[0]
+
+    def invoke(self, messages, **kwargs):
+        scope = current_scope()
+        if scope is not None:
+            # Streamed under the hood so cancellation can stop mid-response
+            aggregate = None
+            for chunk in self.stream(messages, **kwargs):
+                aggregate = chunk if aggregate is None else aggregate + chunk
+            return aggregate if aggregate is not None else AIMessage(content="")
+
+        ledger = current_ledger()
+        model = self._choose(ledger)
+        while True:
+            start = time.perf_counter()
+            try:
+                response = self._client(model).invoke(messages, **kwargs)
+            except Exception:
+                elapsed = time.perf_counter() - start
+                self.router.record(model, elapsed, ok=False)
+                if ledger is not None:
+                    ledger.record_llm(self.site, elapsed, None)
+                model = self.router.fallback(self.site, model)
+                if model is None:
+                    raise
+                continue
+            elapsed = time.perf_counter() - start
+            self.router.record(model, elapsed, ok=True)
+            if ledger is not None:
+                ledger.record_llm(self.site, elapsed, getattr(response, "usage_metadata", None))
+            return response
+
+    def stream(self, messages, **kwargs):
+        """
+        Routed ChatOpenAI.stream.
+
+        Failover only happens before the first chunk; once output has been
+        yielded an error is raised to the caller. Inside a cancel scope the
+        remaining time is the request timeout, a cancelled scope stops the
+        stream (closing the connection) and never fails over.
+
+        Latency is the time spent waiting on the model only: time the
+        consumer takes between chunks (e.g. a slow client) is not counted,
+        and calls ended by the scope's deadline or cancellation are not
+        recorded as model errors.
+        """
+        scope = current_scope()
+        ledger = current_ledger()
+        model = self._choose(ledger)
+        while True:
+            call_kwargs = kwargs
+            if scope is not None:
+                if scope.cancelled:
+                    count_cancelled("model_calls_skipped")
+                    raise TurnCancelled(scope.reason)
+                if scope.remaining() is not None:
+                    call_kwargs = dict(kwargs, timeout=scope.remaining())
+            upstream = 0.0
+            started = False
+            usage = None
+            chunks = self._client(model).stream(messages, **call_kwargs)
+            try:
+                while True:
+                    waited = time.perf_counter()
+                    chunk = next(chunks, None)
+                    upstream += time.perf_counter() - waited
+                    if chunk is None:
+                        break
+                    if scope is not None and scope.cancelled:
+                        count_cancelled("model_calls_aborted")
+                        raise TurnCancelled(scope.reason)
+                    started = True
+                    # Only the final chunk carries usage (stream_usage=True)
+                    usage = getattr(chunk, "usage_metadata", None) or usage
+                    yield chunk
+            except Exception:
+                upstream += time.perf_counter() - waited
+                if scope is not None and scope.cancelled:
+                    # Our deadline or cancellation, not the model's fault
+                    count_cancelled("model_calls_aborted")
+                    raise TurnCancelled(scope.reason)
+                self.router.record(model, upstream, ok=False)
+                fallback = None if started else self.router.fallback(self.site, model)
+                if fallback is None:
+                    raise
+                model = fallback
+                continue
+            finally:
+                chunks.close()
+                if ledger is not None:
+                    ledger.record_llm(self.site, upstream, usage)
+            self.router.record(model, upstream, ok=True)
+            return
+
+
+def routed_model(site: str, temperature: float) -> RoutedChatModel:
+    """Creates a routed chat model for a call site."""
+    return RoutedChatModel(site, temperature)
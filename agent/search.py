@@ -0,0 +1,357 @@
+"""
+Index-free repository search for StudyMate
+
+Streams matches out of repository files (memory-mapping the large ones)
+so freshly ingested repos can be searched before any index exists.
+"""
+
+import fnmatch
+import hashlib
+import mmap
+import os
+import re
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import lru_cache
+from itertools import islice
+from typing import Iterable, Iterator, List, Optional
+
+from .deadline import TurnCancelled, count_cancelled, current_scope
+
+SKIP_DIRS = {'__pycache__', 'node_modules', 'venv'}
+
+# Files above this size are left out of the retrieval index and code graph
+# (generated code, data dumps)
+MAX_FILE_BYTES = 512 * 1024
+
+# Files are treated as binary if this prefix contains a NUL byte
+BINARY_SNIFF_BYTES = 8192
+
+# Lines of context around each hit
+CONTEXT_LINES = 2
+
+# Files larger than this are memory-mapped instead of read
+MMAP_THRESHOLD_BYTES = 1 << 20
+
+# Literal terms are scanned in windows of this size
+CHUNK_BYTES = 1 << 20
+
+# Files handed to a worker per task
+BATCH_FILES = 32
+
+SEARCH_MODES = ("literal", "all", "regex")
+
+# Letters from most to least common in source files; a file lacking one
+# of a term's rarest letters (in either case) is ruled out without
+# lowercasing it
+LETTER_FREQUENCY = b"etaoinsrlcdupmhfgbyvwkxjqz"
+
+
+class GitIgnore:
+    """
+    Minimal .gitignore matcher.
+
+    Supports comments, blank lines, ``*``/``?`` globs, leading ``/``
+    anchors and trailing ``/`` directory patterns. Negations (``!``)
+    are ignored.
+    """
+
+    def __init__(self, base: str, patterns: List[str]):
+        self.base = base
+        self.rules = []
+        for raw in patterns:
+            line = raw.strip()
+            if not line or line.startswith('#') or line.startswith('!'):
+                continue
+            dir_only = line.endswith('/')
+            line = line.rstrip('/')
+            anchored = line.startswith('/') or '/' in line
+            self.rules.append((line.lstrip('/'), anchored, dir_only))
+
+    @classmethod
+    def load(cls, directory: str) -> Optional["GitIgnore"]:
+        """Reads ``directory/.gitignore`` if it exists."""
+        path = os.path.join(directory, '.gitignore')
+        try:
+            with open(path, 'r', encoding='utf-8', errors='replace') as f:
+                return cls(directory, f.read().splitlines())
+        except OSError:
+            return None
+
+    def matches(self, path: str, is_dir: bool) -> bool:
+        """Returns True if ``path`` is ignored by this file's rules."""
+        rel = os.path.relpath(path, self.base).replace(os.sep, '/')
+        name = rel.rsplit('/', 1)[-1]
+        for pattern, anchored, dir_only in self.rules:
+            if dir_only and not is_dir:
+                continue
+            if fnmatch.fnmatch(rel if anchored else name, pattern):
+                return True
+        return False
+
+
+def iter_text_files(repo_path: str) -> Iterator[str]:
+    """
+    Walks a repository yielding paths that are worth searching.
+
+    Skips hidden entries, dependency/cache directories and anything
+    matched by a ``.gitignore`` on the way down. Binary detection is
+    left to the searcher so it happens on the worker threads.
+    """
+    ignores: dict = {}
+    # Normalized so each root's dirname is exactly its parent's key
+    for root, dirs, files in os.walk(os.path.normpath(repo_path)):
+        parent = ignores.get(os.path.dirname(root), [])
+        own = GitIgnore.load(root)
+        active = parent + [own] if own else parent
+        ignores[root] = active
+
+        def ignored(path, is_dir):
+            return any(rule.matches(path, is_dir) for rule in active)
+
+        dirs[:] = [
+            d for d in dirs
+            if not d.startswith('.') and d not in SKIP_DIRS
+            and not (active and ignored(os.path.join(root, d), True))
+        ]
+        prefix = os.path.join(root, '')
+        for file in files:
+            path = prefix + file
+            if file.startswith('.') or (active and ignored(path, False)):
+                continue
+            yield path
+
+
+def files_fingerprint(paths: Iterable[str]) -> str:
+    """Cheap change detector over files: paths, sizes and mtimes."""
+    digest = hashlib.sha1()
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        digest.update(f"{path}\0{st.st_size}\0{st.st_mtime_ns}\n".encode('utf-8', errors='replace'))
+    return digest.hexdigest()
+
+
+def compile_query(query: str, mode: str = "literal") -> list:
+    """
+    Turns a query into matchers.
+
+    Args:
+        query: Text to search for
+        mode: "literal" (exact phrase), "all" (every whitespace-separated
+            term must occur in the file) or "regex"
+
+    Returns:
+        List of matchers (lowercased bytes for literal terms, compiled
+        byte regexes otherwise); a file matches when all of them do
+    """
+    if mode not in SEARCH_MODES:
+        raise ValueError(f"Unknown search mode: {mode}")
+    if mode == "regex":
+        return [re.compile(query.encode('utf-8'), re.IGNORECASE | re.MULTILINE)]
+    terms = query.split() if mode == "all" else [query]
+    return [term.lower().encode('utf-8') for term in terms if term]
+
+
+@lru_cache(maxsize=256)
+def _anchors(term: bytes) -> tuple:
+    """The term's two rarest letters as (lowercase, uppercase) byte pairs."""
+    letters = sorted(set(term) & set(LETTER_FREQUENCY), key=LETTER_FREQUENCY.index, reverse=True)
+    return tuple((bytes([c]), bytes([c]).upper()) for c in letters[:2])
+
+
+def _positions(buf, matcher) -> Iterator[int]:
+    """
+    Yields match offsets for one matcher.
+
+    Literal terms are searched chunk by chunk with a lowercased copy of
+    each chunk, which is several times faster than a case-insensitive
+    regex and keeps memory flat for large memory-mapped files. Files
+    missing one of the term's rarest letters are skipped before that.
+    """
+    if not isinstance(matcher, bytes):
+        for match in matcher.finditer(buf):
+            yield match.start()
+        return
+    for lower, upper in _anchors(matcher):
+        if buf.find(lower) == -1 and buf.find(upper) == -1:
+            return
+    overlap = len(matcher) - 1
+    size = len(buf)
+    for offset in range(0, size, CHUNK_BYTES):
+        # Small files are lowered whole, without slicing a copy first
+        chunk = buf.lower() if size <= CHUNK_BYTES else buf[offset:offset + CHUNK_BYTES + overlap].lower()
+        i = chunk.find(matcher)
+        # Matches starting in the overlap are reported by the next chunk
+        while i != -1 and i < CHUNK_BYTES:
+            yield offset + i
+            i = chunk.find(matcher, i + 1)
+
+
+def _snippet(buf, pos: int) -> str:
+    """Decodes the lines around byte offset ``pos``."""
+    start = pos
+    for _ in range(CONTEXT_LINES + 1):
+        start = buf.rfind(b'\n', 0, start)
+        if start < 0:
+            break
+    start = start + 1
+    end = pos
+    for _ in range(CONTEXT_LINES + 1):
+        end = buf.find(b'\n', end + 1)
+        if end < 0:
+            end = len(buf)
+            break
+    return buf[start:end].decode('utf-8', errors='replace')
+
+
+def _scan(path: str, buf, matchers: list, max_hits: int) -> List[dict]:
+    """Finds up to ``max_hits`` matching lines in an open buffer."""
+    if buf.find(b'\0', 0, BINARY_SNIFF_BYTES) != -1:
+        return []
+
+    # Every matcher must occur somewhere in the file
+    iterators = [_positions(buf, matcher) for matcher in matchers]
+    first = [next(it, None) for it in iterators]
+    if None in first:
+        return []
+
+    positions = sorted(first)
+    if max_hits > 1:
+        positions = sorted(set(positions).union(*iterators))
+
+    hits = []
+    seen_lines = set()
+    line, counted_to = 1, 0
+    for pos in positions:
+        line += buf[counted_to:pos].count(b'\n')
+        counted_to = pos
+        if line in seen_lines:
+            continue
+        seen_lines.add(line)
+        hits.append({"file": path, "line": line, "snippet": _snippet(buf, pos)})
+        if len(hits) >= max_hits:
+            break
+    return hits
+
+
+def search_file(path: str, matchers: list, max_hits: int = 1) -> List[dict]:
+    """
+    Searches a single file.
+
+    Small files are read in one call; larger ones are memory-mapped so
+    only the pages being scanned are resident.
+
+    Args:
+        path: File to search
+        matchers: Output of ``compile_query``
+        max_hits: Stop after this many matching lines
+
+    Returns:
+        List of {"file", "line", "snippet"} dicts (empty for binary,
+        unreadable or non-matching files)
+    """
+    try:
+        # Unbuffered: small files are read in one call with no extra copy
+        with open(path, 'rb', buffering=0) as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                return []
+            if size <= MMAP_THRESHOLD_BYTES:
+                return _scan(path, f.read(), matchers, max_hits)
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return _scan(path, mm, matchers, max_hits)
+    except (OSError, ValueError):
+        return []
+
+
+def _search_batch(paths: List[str], matchers: list, max_hits: int) -> List[dict]:
+    """Searches several files in one pool task to amortise dispatch cost."""
+    hits = []
+    for path in paths:
+        hits.extend(search_file(path, matchers, max_hits))
+    return hits
+
+
+def search_repo(
+    repo_path: str,
+    query: str,
+    mode: str = "literal",
+    max_results: int = 50,
+    hits_per_file: int = 1,
+    workers: int = None,
+    files: Optional[Iterable[str]] = None,
+) -> Iterator[dict]:
+    """
+    Streams matches from a repository without building an index.
+
+    Files are searched in batches on a thread pool so reads overlap with
+    scanning (inline when there is a single worker), and hits are
+    yielded as soon as a batch finishes. The walk
+    stops as soon as ``max_results`` hits have been produced, so result
+    order follows completion order rather than path order.
+
+    Args:
+        repo_path: Repository root
+        query: Text, terms or regex to look for
+        mode: See ``compile_query``
+        max_results: Stop after this many hits
+        hits_per_file: Maximum hits reported per file
+        workers: Thread pool size (defaults to min(8, cpu count))
+        files: Paths to search instead of walking ``repo_path`` (e.g.
+            the file list kept current by a RepoWatcher)
+
+    Yields:
+        {"file", "line", "snippet"} dicts
+    """
+    matchers = compile_query(query, mode)
+    if not matchers or max_results < 1:
+        return
+    workers = workers or min(8, os.cpu_count() or 1)
+    produced = 0
+    files = iter(files) if files is not None else iter_text_files(repo_path)
+    scope = current_scope()
+
+    if workers == 1:
+        # Scanning holds the GIL, so one worker thread would only add hand-offs
+        while True:
+            batch = list(islice(files, BATCH_FILES))
+            if not batch:
+                return
+            if scope is not None and scope.cancelled:
+                count_cancelled("searches_stopped")
+                raise TurnCancelled(scope.reason)
+            for hit in _search_batch(batch, matchers, hits_per_file):
+                yield hit
+                produced += 1
+                if produced >= max_results:
+                    return
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = set()
+        exhausted = False
+        try:
+            while True:
+                # Keep a bounded number of batches in flight
+                while not exhausted and len(pending) < workers * 2:
+                    batch = list(islice(files, BATCH_FILES))
+                    if not batch:
+                        exhausted = True
+                        break
+                    pending.add(pool.submit(_search_batch, batch, matchers, hits_per_file))
+                if not pending:
+                    return
+                if scope is not None and scope.cancelled:
+                    count_cancelled("searches_stopped")
+                    raise TurnCancelled(scope.reason)
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    for hit in future.result():
+                        yield hit
+                        produced += 1
+                        if produced >= max_results:
+                            return
+        finally:
+            for future in pending:
+                future.cancel()
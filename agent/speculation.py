@@ -0,0 +1,153 @@
+"""
+Speculative pre-generation for StudyMate
+
+While the student is thinking, the next likely hint level (and the next
+Socratic question) for the active concept is generated in the background
+and parked in a short-lived per-session cache. The hint/question tools
+consult the cache first, so a struggling student gets an instant answer
+instead of a full LLM round trip. The agent calls those tools itself on
+the turn after an assessment, so what is speculated for a session with
+an active concept is used on its next assessed turn.
+
+Environment:
+    STUDYMATE_SPECULATE        - "1" to enable (off by default; it spends tokens)
+    STUDYMATE_SPECULATE_TTL_S  - seconds a pre-generated entry stays valid (default 300)
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Hashable, Optional, Tuple
+
+# Speculative work waiting to run; anything beyond this is dropped
+MAX_PENDING = 32
+
+
+class SpeculationCache:
+    """
+    Per-session cache of pre-generated responses with a background worker.
+
+    A single worker thread keeps speculation from competing with live
+    requests for more than one connection at a time.
+
+    Args:
+        ttl_s: Seconds before an unused entry expires
+        max_pending: Queue bound for scheduled generations
+    """
+
+    def __init__(self, ttl_s: float = 300.0, max_pending: int = MAX_PENDING):
+        self.ttl_s = ttl_s
+        self.max_pending = max_pending
+        self._entries: Dict[str, Dict[Hashable, Tuple[str, float, int]]] = {}
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="speculate")
+        self.stats = {
+            "scheduled": 0, "dropped": 0, "generated": 0, "failed": 0,
+            "hits": 0, "misses": 0, "expired": 0, "tokens_generated": 0, "tokens_wasted": 0,
+        }
+
+    def _waste(self, entry: Tuple[str, float, int]):
+        self.stats["tokens_wasted"] += entry[2]
+
+    def _sweep(self, now: float):
+        """Drops expired entries of every session (lock held)."""
+        for session_id, entries in list(self._entries.items()):
+            for key, entry in list(entries.items()):
+                if entry[1] <= now:
+                    self._waste(entry)
+                    self.stats["expired"] += 1
+                    del entries[key]
+            if not entries:
+                del self._entries[session_id]
+
+    def schedule(self, session_id: str, key: Hashable, generate: Callable[[], Tuple[str, int]]) -> bool:
+        """
+        Queues ``generate`` unless the entry is already cached or pending.
+
+        Args:
+            session_id: Session the entry belongs to
+            key: Identifies the response, e.g. ("hint", concept, level)
+            generate: Returns (text, tokens_used); exceptions are swallowed
+
+        Returns:
+            True if the work was queued
+        """
+        with self._lock:
+            entry = self._entries.get(session_id, {}).get(key)
+            if entry and entry[1] > time.monotonic():
+                return False
+            if (session_id, key) in self._pending:
+                return False
+            if len(self._pending) >= self.max_pending:
+                self.stats["dropped"] += 1
+                return False
+            self._pending.add((session_id, key))
+            self.stats["scheduled"] += 1
+        self._executor.submit(self._run, session_id, key, generate)
+        return True
+
+    def _run(self, session_id: str, key: Hashable, generate: Callable[[], Tuple[str, int]]):
+        try:
+            text, tokens = generate()
+        except Exception as e:
+            print(f"Speculation error: {str(e)}")
+            with self._lock:
+                self._pending.discard((session_id, key))
+                self.stats["failed"] += 1
+            return
+        with self._lock:
+            self.stats["generated"] += 1
+            self.stats["tokens_generated"] += tokens
+            if (session_id, key) not in self._pending:
+                # Discarded (topic change) while generating
+                self.stats["tokens_wasted"] += tokens
+                return
+            self._pending.discard((session_id, key))
+            now = time.monotonic()
+            # Entries of finished sessions are never taken, so expire them here
+            self._sweep(now)
+            entries = self._entries.setdefault(session_id, {})
+            if key in entries:
+                self._waste(entries[key])
+            entries[key] = (text, now + self.ttl_s, tokens)
+
+    def take(self, session_id: str, key: Hashable) -> Optional[str]:
+        """Pops a fresh entry, counting a hit or a miss."""
+        with self._lock:
+            now = time.monotonic()
+            entry = self._entries.get(session_id, {}).pop(key, None)
+            if entry is not None and entry[1] <= now:
+                self._waste(entry)
+                self.stats["expired"] += 1
+                entry = None
+            self.stats["hits" if entry else "misses"] += 1
+            return entry[0] if entry else None
+
+    def discard(self, session_id: str):
+        """Drops everything cached or in flight for a session (e.g. topic change)."""
+        with self._lock:
+            for entry in self._entries.pop(session_id, {}).values():
+                self._waste(entry)
+            self._pending = {p for p in self._pending if p[0] != session_id}
+
+    def metrics(self) -> dict:
+        """Counters plus hit rate and share of speculative tokens wasted."""
+        with self._lock:
+            stats = dict(self.stats)
+            stats["pending"] = len(self._pending)
+            stats["cached"] = sum(len(e) for e in self._entries.values())
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        stats["wasted_token_ratio"] = (
+            stats["tokens_wasted"] / stats["tokens_generated"] if stats["tokens_generated"] else 0.0
+        )
+        return stats
+
+
+def speculation_enabled() -> bool:
+    return os.getenv("STUDYMATE_SPECULATE") == "1"
+
+
+speculator = SpeculationCache(ttl_s=float(os.getenv("STUDYMATE_SPECULATE_TTL_S", "300")))
@@ -0,0 +1,204 @@
+"""
+Precomputed hierarchical repository summaries for StudyMate
+
+Files are summarized in parallel (map), then directories are rolled up
+level by level from the deepest up to the repository root (reduce).
+Every summary is cached by a content hash, so re-running after an edit
+only resummarizes the changed files and their ancestor directories.
+
+Usage:
+    python -m agent.summaries <repo_path>
+
+Environment:
+    STUDYMATE_SUMMARY_DIR - where summaries are cached (default data/summaries in the project)
+"""
+
+import hashlib
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+from .routing import routed_model
+from .prompts import DIRECTORY_SUMMARY_PROMPT, FILE_SUMMARY_PROMPT
+from .search import iter_text_files
+
+SUMMARY_DIR = os.getenv("STUDYMATE_SUMMARY_DIR") or os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "summaries"
+)
+
+# Concurrent LLM calls while summarizing
+SUMMARY_WORKERS = 4
+
+# Only the head of large files is sent to the model
+MAX_FILE_CHARS = 6000
+
+# Files above this size are not summarized at all
+MAX_FILE_BYTES = 512 * 1024
+
+# Parsed summary files, keyed by path and invalidated by mtime/size
+_loaded: Dict[str, tuple] = {}
+
+
+def summary_path(repo_path: str) -> str:
+    """Location of the cached summaries for a repository."""
+    key = hashlib.sha1(os.path.abspath(repo_path).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(SUMMARY_DIR, f"{key}.json")
+
+
+def load_summaries(repo_path: str) -> Optional[dict]:
+    """
+    Reads cached summaries without calling the model.
+
+    Returns:
+        {"repo_path", "files": {rel: {"hash", "summary"}},
+        "dirs": {rel: {"hash", "summary"}}} or None if never built.
+        The repository summary is ``dirs[""]``.
+    """
+    path = summary_path(repo_path)
+    try:
+        st = os.stat(path)
+        version = (st.st_mtime_ns, st.st_size)
+        cached = _loaded.get(path)
+        if cached and cached[0] == version:
+            return cached[1]
+        with open(path, 'r', encoding='utf-8') as f:
+            summaries = json.load(f)
+    except (OSError, ValueError):
+        return None
+    _loaded[path] = (version, summaries)
+    return summaries
+
+
+def get_summary(repo_path: str, rel_path: str = "") -> Optional[str]:
+    """Returns the cached summary of a file or directory ("" = whole repo)."""
+    summaries = load_summaries(repo_path)
+    if not summaries:
+        return None
+    rel_path = rel_path.strip('/').replace(os.sep, '/')
+    entry = summaries["files"].get(rel_path) or summaries["dirs"].get(rel_path)
+    return entry["summary"] if entry else None
+
+
+def _default_llm():
+    return routed_model("summary", temperature=0.3)
+
+
+def _ask(llm, prompt: str) -> Optional[str]:
+    """Single model call; failures are not cached so they are retried next run."""
+    try:
+        response = llm.invoke(prompt)
+        text = getattr(response, "content", response)
+        return str(text).strip() or None
+    except Exception as e:
+        print(f"Summary error: {str(e)}")
+        return None
+
+
+def _parent(rel: str) -> str:
+    return rel.rsplit('/', 1)[0] if '/' in rel else ""
+
+
+def build_summaries(repo_path: str, llm=None, max_workers: int = SUMMARY_WORKERS) -> dict:
+    """
+    Summarizes a repository bottom-up, reusing cached summaries.
+
+    Args:
+        repo_path: Repository root
+        llm: Object with ``invoke(prompt)`` (defaults to ChatOpenAI)
+        max_workers: Upper bound on concurrent model calls
+
+    Returns:
+        The summaries dict (also written to ``summary_path(repo_path)``)
+    """
+    llm = llm or _default_llm()
+    cached = load_summaries(repo_path) or {"files": {}, "dirs": {}}
+    files: Dict[str, dict] = {}
+    dirs: Dict[str, dict] = {}
+
+    # Map: hash every file, summarize only new or changed ones
+    todo = []
+    reused = dir_calls = 0
+    for path in sorted(iter_text_files(repo_path)):
+        try:
+            if os.path.getsize(path) > MAX_FILE_BYTES:
+                continue
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            continue
+        if not data.strip() or b'\0' in data[:8192]:
+            continue
+        rel = os.path.relpath(path, repo_path).replace(os.sep, '/')
+        digest = hashlib.sha1(data).hexdigest()
+        previous = cached["files"].get(rel)
+        if previous and previous["hash"] == digest:
+            files[rel] = previous
+            reused += 1
+        else:
+            code = data.decode('utf-8', errors='replace')[:MAX_FILE_CHARS]
+            todo.append((rel, digest, FILE_SUMMARY_PROMPT.format(path=rel, code=code)))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for (rel, digest, _), summary in zip(todo, pool.map(lambda t: _ask(llm, t[2]), todo)):
+            if summary:
+                files[rel] = {"hash": digest, "summary": summary}
+
+        # Reduce: roll directories up one depth level at a time
+        children: Dict[str, list] = {}
+        for rel in files:
+            children.setdefault(_parent(rel), []).append(rel)
+        for d in list(children):
+            while d:
+                children.setdefault(_parent(d), [])
+                if d not in children[_parent(d)]:
+                    children[_parent(d)].append(d)
+                d = _parent(d)
+
+        by_depth: Dict[int, list] = {}
+        for d in children:
+            by_depth.setdefault(d.count('/') + 1 if d else 0, []).append(d)
+
+        for depth in sorted(by_depth, reverse=True):
+            level = []
+            for d in sorted(by_depth[depth]):
+                parts = [
+                    (child, (files.get(child) or dirs.get(child))["summary"])
+                    for child in sorted(children[d])
+                    if child in files or child in dirs
+                ]
+                if not parts:
+                    continue
+                digest = hashlib.sha1(
+                    json.dumps(parts, ensure_ascii=False).encode('utf-8')
+                ).hexdigest()
+                previous = cached["dirs"].get(d)
+                if previous and previous["hash"] == digest:
+                    dirs[d] = previous
+                    continue
+                listing = '\n'.join(f"- {child}: {summary}" for child, summary in parts)
+                prompt = DIRECTORY_SUMMARY_PROMPT.format(path=d or "(repository root)", children=listing)
+                level.append((d, digest, prompt))
+            dir_calls += len(level)
+
+            for (d, digest, _), summary in zip(level, pool.map(lambda t: _ask(llm, t[2]), level)):
+                if summary:
+                    dirs[d] = {"hash": digest, "summary": summary}
+
+    summaries = {"repo_path": os.path.abspath(repo_path), "files": files, "dirs": dirs}
+    out = summary_path(repo_path)
+    os.makedirs(os.path.dirname(out), exist_ok=True)
+    with open(out, 'w', encoding='utf-8') as f:
+        json.dump(summaries, f, indent=2)
+
+    print(f"📝 Summaries: {len(todo)} file(s) and {dir_calls} director(ies) summarized, "
+          f"{reused} file(s) reused")
+    return summaries
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python -m agent.summaries <repo_path>")
+        sys.exit(1)
+    build_summaries(sys.argv[1])
@@ -3,14 +3,29 @@ Agent Tools for StudyMate
 """
 
 from langchain.tools import tool
-from langchain_openai import ChatOpenAI
 import os
 import json
 from datetime import datetime
-from typing import Optional
+from typing import Optional, Tuple
+
+from .analytics import analytics
+from .budget import metered_tool
+from .codegraph import MODULE, get_graph
+from .routing import routed_model
+from .search import search_repo
+from .speculation import speculator
+from .summaries import load_summaries
+from .watcher import KEY_FILE_NAMES, README_NAMES, watched
+
+# Files reported by search_repo_concept
+SEARCH_RESULT_LIMIT = 5
+
+# Entries listed by the call/import graph tools
+GRAPH_RESULT_LIMIT = 25
 
 
 @tool
+@metered_tool
 def analyze_repo_structure(repo_path: str) -> dict:
     """
     Analyzes GitHub repository structure to understand project layout.
@@ -32,36 +47,54 @@ def analyze_repo_structure(repo_path: str) -> dict:
         "readme_exists": False
     }
     
-    # Walk through repo
-    for root, dirs, files in os.walk(repo_path):
-        # Skip hidden and cache dirs
-        dirs[:] = [d for d in dirs if not d.startswith('.') and d not in ['__pycache__', 'node_modules', 'venv']]
-        
-        for file in files:
-            if file.startswith('.'):
-                continue
-                
-            structure["total_files"] += 1
-            ext = os.path.splitext(file)[1]
-            if ext:
-                structure["languages"][ext] = structure["languages"].get(ext, 0) + 1
+    watcher = watched(repo_path)
+    if watcher is not None:
+        # Kept current by the filesystem watcher; no walk needed
+        current = watcher.structure()
+        structure.update(current)
+        structure["key_files"] = [os.path.join(repo_path, f) for f in current["key_files"]]
+    else:
+        # Walk through repo
+        for root, dirs, files in os.walk(repo_path):
+            # Skip hidden and cache dirs
+            dirs[:] = [d for d in dirs if not d.startswith('.') and d not in ['__pycache__', 'node_modules', 'venv']]
             
-            # Identify key files
-            if file.lower() in ['readme.md', 'readme.txt']:
-                structure["key_files"].append(os.path.join(root, file))
-                structure["readme_exists"] = True
-            elif file in ['requirements.txt', 'setup.py', 'main.py', 'app.py']:
-                structure["key_files"].append(os.path.join(root, file))
+            for file in files:
+                if file.startswith('.'):
+                    continue
+                    
+                structure["total_files"] += 1
+                ext = os.path.splitext(file)[1]
+                if ext:
+                    structure["languages"][ext] = structure["languages"].get(ext, 0) + 1
+                
+                # Identify key files
+                if file.lower() in README_NAMES:
+                    structure["key_files"].append(os.path.join(root, file))
+                    structure["readme_exists"] = True
+                elif file in KEY_FILE_NAMES:
+                    structure["key_files"].append(os.path.join(root, file))
     
     structure["main_directories"] = [
         d for d in os.listdir(repo_path) 
         if os.path.isdir(os.path.join(repo_path, d)) and not d.startswith('.')
     ]
     
+    # Serve precomputed summaries if the repo has been summarized
+    summaries = load_summaries(repo_path)
+    if summaries:
+        dirs = summaries["dirs"]
+        if "" in dirs:
+            structure["summary"] = dirs[""]["summary"]
+        structure["directory_summaries"] = {
+            d: dirs[d]["summary"] for d in structure["main_directories"] if d in dirs
+        }
+    
     return structure
 
 
 @tool
+@metered_tool
 def extract_code_snippet(file_path: str, line_start: int, line_end: int) -> dict:
     """
     Extracts specific code snippets from a file by line numbers.
@@ -99,10 +132,12 @@ def extract_code_snippet(file_path: str, line_start: int, line_end: int) -> dict
 
 
 @tool
+@metered_tool
 def search_repo_concept(query: str, repo_path: str) -> str:
     """
     Searches repository for code related to a specific concept.
-    Simple keyword search through Python files.
+    Streams through every text file (any language), skipping binaries
+    and .gitignored paths.
     
     Args:
         query: The concept to search for
@@ -111,46 +146,24 @@ def search_repo_concept(query: str, repo_path: str) -> str:
     Returns:
         String with relevant file paths and snippets
     """
-    results = []
-    query_lower = query.lower()
-    
     try:
-        for root, dirs, files in os.walk(repo_path):
-            dirs[:] = [d for d in dirs if not d.startswith('.')]
-            
-            for file in files:
-                if file.endswith('.py'):
-                    file_path = os.path.join(root, file)
-                    try:
-                        with open(file_path, 'r', encoding='utf-8') as f:
-                            content = f.read()
-                            
-                            if query_lower in content.lower():
-                                lines = content.split('\n')
-                                for i, line in enumerate(lines):
-                                    if query_lower in line.lower():
-                                        start = max(0, i-2)
-                                        end = min(len(lines), i+3)
-                                        snippet = '\n'.join(lines[start:end])
-                                        results.append({
-                                            "file": file_path,
-                                            "line": i+1,
-                                            "snippet": snippet
-                                        })
-                                        break
-                    except:
-                        continue
-            
-            if len(results) >= 3:
-                break
+        # A watched repo already knows its file list
+        watcher = watched(repo_path)
+        files = watcher.searchable_files() if watcher is not None else None
+        
+        # Prefer the exact phrase, then fall back to files containing every term
+        results = list(search_repo(repo_path, query, mode="literal", max_results=SEARCH_RESULT_LIMIT, files=files))
+        if not results and len(query.split()) > 1:
+            results = list(search_repo(repo_path, query, mode="all", max_results=SEARCH_RESULT_LIMIT, files=files))
         
         if not results:
             return f"No code found related to '{query}' in the repository."
         
         formatted = f"Found {len(results)} file(s) related to '{query}':\n\n"
-        for i, result in enumerate(results[:3], 1):
-            formatted += f"{i}. **{os.path.basename(result['file'])}** (Line {result['line']})\n"
-            formatted += f"```python\n{result['snippet']}\n```\n\n"
+        for i, result in enumerate(results, 1):
+            lang = os.path.splitext(result['file'])[1].lstrip('.')
+            formatted += f"{i}. **{os.path.relpath(result['file'], repo_path)}** (Line {result['line']})\n"
+            formatted += f"```{lang}\n{result['snippet']}\n```\n\n"
         
         return formatted
         
@@ -158,19 +171,149 @@ def search_repo_concept(query: str, repo_path: str) -> str:
         return f"Error searching repository: {str(e)}"
 
 
+def _graph_list(entries: list, describe) -> str:
+    lines = [f"- {describe(entry)}" for entry in entries[:GRAPH_RESULT_LIMIT]]
+    if len(entries) > GRAPH_RESULT_LIMIT:
+        lines.append(f"- ... and {len(entries) - GRAPH_RESULT_LIMIT} more")
+    return "\n".join(lines)
+
+
 @tool
-def generate_socratic_question(concept: str, student_level: str) -> str:
+@metered_tool
+def find_callers(function_name: str, repo_path: str) -> str:
     """
-    Generates a Socratic question to guide student learning.
+    Finds where a function, method or class is called from in the repository.
+    Uses the precomputed call graph, so it is instant even on large repos.
     
     Args:
-        concept: The concept being taught
-        student_level: Student's knowledge level (beginner/intermediate/advanced)
+        function_name: Name such as "teach", "StudyMateAgent.teach" or a fully qualified name
+        repo_path: Path to repository
         
     Returns:
-        A Socratic question string
+        String listing the calling functions and call-site lines
+    """
+    try:
+        graph = get_graph(repo_path)
+        if graph is None:
+            return f"Repository path does not exist: {repo_path}"
+        if not graph.lookup(function_name):
+            return f"No function or class named '{function_name}' found in the repository."
+        callers = graph.callers(function_name)
+        if not callers:
+            return f"No callers of '{function_name}' found (it may only be called dynamically or from outside the repository)."
+        return f"'{function_name}' is called from {len(callers)} place(s):\n\n" + _graph_list(
+            callers, lambda c: f"**{c['name']}** at {c['at']} (calls `{c['callee']}`)"
+        )
+    except Exception as e:
+        return f"Error reading call graph: {str(e)}"
+
+
+@tool
+@metered_tool
+def find_callees(function_name: str, repo_path: str) -> str:
+    """
+    Lists the repository functions and classes a function (or module) calls.
+    
+    Args:
+        function_name: Function, method or module name (e.g. "teach", "api/main.py")
+        repo_path: Path to repository
+        
+    Returns:
+        String listing the called functions with where they are defined
+    """
+    try:
+        graph = get_graph(repo_path)
+        if graph is None:
+            return f"Repository path does not exist: {repo_path}"
+        if not graph.lookup(function_name):
+            return f"No function or module named '{function_name}' found in the repository."
+        callees = graph.callees(function_name)
+        if not callees:
+            return f"'{function_name}' does not call any function defined in the repository."
+        return f"'{function_name}' calls {len(callees)} repository function(s):\n\n" + _graph_list(
+            callees, lambda c: f"**{c['name']}** ({c['file']}:{c['line']}), called at {c['at']}"
+        )
+    except Exception as e:
+        return f"Error reading call graph: {str(e)}"
+
+
+@tool
+@metered_tool
+def module_dependencies(module: str, repo_path: str) -> str:
+    """
+    Shows what a module imports and which modules import it.
+    
+    Args:
+        module: Module path or dotted name (e.g. "api/main.py" or "agent.core")
+        repo_path: Path to repository
+        
+    Returns:
+        String listing imported modules (repository and external) and importers
+    """
+    try:
+        graph = get_graph(repo_path)
+        if graph is None:
+            return f"Repository path does not exist: {repo_path}"
+        if not graph.lookup(module, (MODULE,)):
+            return f"No module '{module}' found in the repository."
+        imports = graph.dependencies(module)
+        internal = [d for d in imports if d["kind"] == "module"]
+        external = sorted({d["name"] for d in imports if d["kind"] == "external"})
+        importers = graph.dependencies(module, reverse=True)
+        
+        formatted = f"**{module}** imports {len(internal)} repository module(s):\n"
+        formatted += _graph_list(internal, lambda d: f"{d['name']} ({d['file']}, imported at {d['at']})") or "- none"
+        formatted += f"\n\nExternal packages: {', '.join(external) if external else 'none'}"
+        formatted += f"\n\nImported by {len(importers)} module(s):\n"
+        formatted += _graph_list(importers, lambda d: f"{d['name']} (at {d['at']})") or "- none"
+        return formatted
+    except Exception as e:
+        return f"Error reading import graph: {str(e)}"
+
+
+@tool
+@metered_tool
+def find_dependency_path(source: str, target: str, repo_path: str) -> str:
+    """
+    Finds the shortest chain linking two modules (through imports) or two
+    functions (through calls).
+    
+    Args:
+        source: Starting module or function
+        target: Module or function to reach
+        repo_path: Path to repository
+        
+    Returns:
+        String with the chain, or an explanation if there is none
+    """
+    try:
+        graph = get_graph(repo_path)
+        if graph is None:
+            return f"Repository path does not exist: {repo_path}"
+        for name in (source, target):
+            if not graph.lookup(name):
+                return f"Nothing named '{name}' found in the repository."
+        chain = graph.path(source, target)
+        if chain is None:
+            return f"'{source}' does not depend on '{target}' (no static import or call chain)."
+        return f"'{source}' reaches '{target}' in {len(chain) - 1} step(s):\n\n" + " → ".join(chain)
+    except Exception as e:
+        return f"Error reading code graph: {str(e)}"
+
+
+def _tokens_used(response) -> int:
+    usage = getattr(response, "usage_metadata", None) or {}
+    return usage.get("total_tokens", 0) or 0
+
+
+def socratic_question_text(concept: str, student_level: str) -> Tuple[str, int]:
     """
-    llm = ChatOpenAI(model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"), temperature=0.7)
+    Calls the model for a Socratic question.
+    
+    Returns:
+        (question, tokens used); raises if the model call fails
+    """
+    llm = routed_model("socratic_question", temperature=0.7)
     
     prompt = f"""Generate ONE Socratic question to teach this programming concept.
 
@@ -185,14 +328,37 @@ The question should:
 
 Return ONLY the question, no explanation."""
 
+    response = llm.invoke(prompt)
+    return response.content.strip(), _tokens_used(response)
+
+
+@tool
+@metered_tool
+def generate_socratic_question(concept: str, student_level: str, session_id: str = "") -> str:
+    """
+    Generates a Socratic question to guide student learning.
+    
+    Args:
+        concept: The concept being taught
+        student_level: Student's knowledge level (beginner/intermediate/advanced)
+        session_id: Session identifier (lets pre-generated questions be reused)
+        
+    Returns:
+        A Socratic question string
+    """
+    if session_id:
+        cached = speculator.take(session_id, ("question", concept.lower(), student_level))
+        if cached:
+            return cached
+    
     try:
-        question = llm.predict(prompt)
-        return question.strip()
+        return socratic_question_text(concept, student_level)[0]
     except Exception as e:
         return f"What do you think is the main purpose of {concept}?"
 
 
 @tool
+@metered_tool
 def assess_student_understanding(student_response: str, expected_concept: str) -> dict:
     """
     Assesses student's response to determine understanding level.
@@ -204,7 +370,7 @@ def assess_student_understanding(student_response: str, expected_concept: str) -
     Returns:
         Dictionary with assessment results
     """
-    llm = ChatOpenAI(model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"), temperature=0.3)
+    llm = routed_model("assessment", temperature=0.3)
     
     prompt = f"""Analyze this student's response about {expected_concept}.
 
@@ -220,10 +386,10 @@ Respond in this EXACT JSON format:
 }}"""
 
     try:
-        response = llm.predict(prompt)
+        response = llm.invoke(prompt).content
         assessment = json.loads(response)
         return assessment
-    except:
+    except Exception:
         return {
             "understanding_level": "partial",
             "correct_points": ["Attempting to engage"],
@@ -233,42 +399,66 @@ Respond in this EXACT JSON format:
         }
 
 
+HINT_STYLES = {
+    1: "very subtle - just nudge their thinking",
+    2: "moderate - point toward the right direction",
+    3: "explicit - nearly give the answer but make them take final step"
+}
+
+
+def hint_level(student_struggle_count: int) -> int:
+    """Maps a struggle count onto hint levels 1-3."""
+    return max(1, min(student_struggle_count, 3))
+
+
+def progressive_hint_text(concept: str, level: int) -> Tuple[str, int]:
+    """
+    Calls the model for a hint at the given level.
+    
+    Returns:
+        (hint, tokens used); raises if the model call fails
+    """
+    llm = routed_model("hint", temperature=0.6)
+    
+    prompt = f"""Provide a hint about {concept}.
+
+Hint level: {level}/3 ({HINT_STYLES[level]})
+
+Return ONLY the hint, no extra text."""
+
+    response = llm.invoke(prompt)
+    return response.content.strip(), _tokens_used(response)
+
+
 @tool
-def provide_progressive_hint(concept: str, student_struggle_count: int) -> str:
+@metered_tool
+def provide_progressive_hint(concept: str, student_struggle_count: int, session_id: str = "") -> str:
     """
     Provides hints that get progressively more explicit.
     
     Args:
         concept: The concept the student is struggling with
         student_struggle_count: How many times they've struggled (1-3+)
+        session_id: Session identifier (lets pre-generated hints be reused)
         
     Returns:
         A hint string
     """
-    llm = ChatOpenAI(model=os.getenv("OPENAI_MODEL", "gpt-4o-mini"), temperature=0.6)
+    level = hint_level(student_struggle_count)
     
-    hint_styles = {
-        1: "very subtle - just nudge their thinking",
-        2: "moderate - point toward the right direction",
-        3: "explicit - nearly give the answer but make them take final step"
-    }
+    if session_id:
+        cached = speculator.take(session_id, ("hint", concept.lower(), level))
+        if cached:
+            return cached
     
-    hint_level = min(student_struggle_count, 3)
-    
-    prompt = f"""Provide a hint about {concept}.
-
-Hint level: {hint_level}/3 ({hint_styles[hint_level]})
-
-Return ONLY the hint, no extra text."""
-
     try:
-        hint = llm.predict(prompt)
-        return hint.strip()
-    except:
+        return progressive_hint_text(concept, level)[0]
+    except Exception:
         return f"Think about what problem {concept} is trying to solve."
 
 
 @tool
+@metered_tool
 def track_learning_progress(session_id: str, concept: str, mastery_level: str) -> dict:
     """
     Tracks what concepts the student has learned.
@@ -289,7 +479,7 @@ def track_learning_progress(session_id: str, concept: str, mastery_level: str) -
     try:
         with open(progress_file, 'r') as f:
             progress = json.load(f)
-    except:
+    except Exception:
         progress = {
             "session_id": session_id,
             "start_time": datetime.now().isoformat(),
@@ -306,6 +496,8 @@ def track_learning_progress(session_id: str, concept: str, mastery_level: str) -
     
     with open(progress_file, 'w') as f:
         json.dump(progress, f, indent=2)
+    # Only the new event is appended; the file is not read back
+    analytics.ingest_progress(progress_file, progress)
     
     return {
         "success": True,
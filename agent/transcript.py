@@ -0,0 +1,158 @@
+"""
+Compact session transcript shared by the API and the agent
+"""
+
+import itertools
+import struct
+import time
+from array import array
+from datetime import datetime
+from typing import List, Optional
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+
+# Roles are stored as one byte each instead of one string per message
+ROLES = ("user", "assistant")
+_ROLE_CODES = {role: code for code, role in enumerate(ROLES)}
+
+# Serialized layout: turn count, then the role, timestamp and
+# content-length columns, then the UTF-8 contents back to back
+_COUNT = struct.Struct("<I")
+
+# Source of generation numbers; seeded from the clock so they are not
+# reused across restarts
+_generations = itertools.count(time.time_ns())
+
+
+class Transcript:
+    """
+    Append-only, column-backed conversation log.
+
+    Each turn costs one byte for the role, eight bytes for the epoch
+    timestamp and a reference to the content string. LangChain message
+    objects are only built for the window sent to the model, and the
+    API's dict shape only for the page being served.
+    """
+
+    __slots__ = ("_roles", "_contents", "_timestamps", "_generation")
+
+    def __init__(self):
+        self._roles = array("B")
+        self._contents: List[str] = []
+        self._timestamps = array("d")
+        self._generation = next(_generations)
+
+    def __len__(self) -> int:
+        return len(self._contents)
+
+    def append(self, role: str, content: str, timestamp: Optional[float] = None):
+        """
+        Adds a turn to the transcript.
+
+        Args:
+            role: "user" or "assistant"
+            content: Message text
+            timestamp: Epoch seconds (defaults to now)
+        """
+        self._roles.append(_ROLE_CODES[role])
+        self._contents.append(content)
+        self._timestamps.append(time.time() if timestamp is None else timestamp)
+        self._generation = next(_generations)
+
+    def clear(self):
+        """Drops every turn."""
+        del self._roles[:]
+        del self._contents[:]
+        del self._timestamps[:]
+        self._generation = next(_generations)
+
+    def truncate(self, length: int):
+        """Drops every turn after the first ``length`` (rolls back a partial turn)."""
+        del self._roles[length:]
+        del self._contents[length:]
+        del self._timestamps[length:]
+        self._generation = next(_generations)
+
+    def to_bytes(self) -> bytes:
+        """Serializes the columns as they are held in memory (see ``from_bytes``)."""
+        encoded = [content.encode("utf-8") for content in self._contents]
+        lengths = array("I", map(len, encoded))
+        return b"".join((
+            _COUNT.pack(len(encoded)),
+            self._roles.tobytes(),
+            self._timestamps.tobytes(),
+            lengths.tobytes(),
+            *encoded,
+        ))
+
+    @classmethod
+    def from_bytes(cls, data) -> "Transcript":
+        """Rebuilds a transcript written by ``to_bytes`` (accepts any buffer)."""
+        view = memoryview(data)
+        (count,) = _COUNT.unpack_from(view)
+        offset = _COUNT.size
+        transcript = cls()
+        transcript._roles.frombytes(view[offset:offset + count])
+        offset += count
+        transcript._timestamps.frombytes(view[offset:offset + 8 * count])
+        offset += 8 * count
+        lengths = array("I")
+        lengths.frombytes(view[offset:offset + 4 * count])
+        offset += 4 * count
+        contents = transcript._contents
+        for length in lengths:
+            contents.append(str(view[offset:offset + length], "utf-8"))
+            offset += length
+        return transcript
+
+    @property
+    def generation(self) -> int:
+        """Changes on every modification, including a rollback to an earlier length."""
+        return self._generation
+
+    @property
+    def last_timestamp(self) -> float:
+        """Epoch time of the latest turn (0.0 when empty)."""
+        return self._timestamps[-1] if self._timestamps else 0.0
+
+    def count(self, role: str) -> int:
+        """Number of turns by ``role``."""
+        return self._roles.count(_ROLE_CODES[role])
+
+    def content(self, index: int) -> str:
+        """Returns the text of one turn (negative indexes count from the end)."""
+        return self._contents[index]
+
+    def page(self, start: int = 0, stop: Optional[int] = None) -> List[dict]:
+        """Returns turns ``start:stop`` in the API's message dict format."""
+        return [
+            {
+                "role": ROLES[role],
+                "content": content,
+                "timestamp": datetime.fromtimestamp(ts).isoformat(),
+            }
+            for role, content, ts in zip(
+                self._roles[start:stop],
+                self._contents[start:stop],
+                self._timestamps[start:stop],
+            )
+        ]
+
+    def to_messages(self, system_prompt: str, start: int = 0) -> List[BaseMessage]:
+        """
+        Builds the LangChain messages for a model call.
+
+        Args:
+            system_prompt: Content of the leading system message
+            start: Index of the first turn to include
+
+        Returns:
+            System message followed by turns ``start:``
+        """
+        messages: List[BaseMessage] = [SystemMessage(content=system_prompt)]
+        for role, content in zip(self._roles[start:], self._contents[start:]):
+            if role == _ROLE_CODES["user"]:
+                messages.append(HumanMessage(content=content))
+            else:
+                messages.append(AIMessage(content=content))
+        return messages
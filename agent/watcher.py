@@ -0,0 +1,393 @@
+"""
+Filesystem watcher for locally mounted repositories in StudyMate
+
+While students edit a repository the agent is pointed at, a watcher
+keeps a change journal for it and updates the structure table, the
+searchable file list and the retrieval index for the changed paths
+only, instead of rescanning the whole tree on every tool call.
+
+Uses inotify (through ``watchfiles``) where available and falls back to
+polling file mtimes.
+
+Environment:
+    STUDYMATE_WATCH           - "1" to watch repositories agents are opened on (off by default)
+    STUDYMATE_WATCH_POLL_S    - polling interval when inotify is unavailable (default 1.0)
+    STUDYMATE_WATCH_DEBOUNCE_S - quiet period that ends a burst of saves (default 0.3)
+"""
+
+import atexit
+import copy
+import os
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from .codegraph import CodeGraph
+from .retrieval import RepoIndex, get_index
+from .search import SKIP_DIRS, GitIgnore, iter_text_files
+
+try:
+    import watchfiles
+except ImportError:
+    watchfiles = None
+
+# Files analyze_repo_structure reports as key files
+README_NAMES = {'readme.md', 'readme.txt'}
+KEY_FILE_NAMES = {'requirements.txt', 'setup.py', 'main.py', 'app.py'}
+
+
+def _visible(rel: str) -> bool:
+    """Same filter as analyze_repo_structure: no hidden or dependency directories."""
+    parts = rel.split(os.sep)
+    return not any(p.startswith('.') for p in parts) and not any(p in SKIP_DIRS for p in parts[:-1])
+
+
+def _walk_visible(root: str) -> Iterator[str]:
+    for current, dirs, files in os.walk(root):
+        dirs[:] = [d for d in dirs if not d.startswith('.') and d not in SKIP_DIRS]
+        for file in files:
+            if not file.startswith('.'):
+                yield os.path.join(current, file)
+
+
+class RepoWatcher:
+    """
+    Change journal plus incrementally maintained views of one repository.
+
+    Every debounced batch of changes bumps the journal sequence number.
+    The structure table and searchable file list are updated as the batch
+    arrives; the retrieval index catches up from the journal the next
+    time it is asked for.
+
+    Args:
+        repo_path: Repository root
+        debounce_s: Quiet period after the last change before a batch is applied
+        poll_interval_s: Polling interval for the fallback backend
+        use_inotify: Force (True) or disable (False) the watchfiles
+            backend; defaults to using it when installed
+    """
+
+    def __init__(self, repo_path: str, debounce_s: float = 0.3, poll_interval_s: float = 1.0,
+                 use_inotify: Optional[bool] = None):
+        self.repo_path = os.path.abspath(repo_path)
+        self.debounce_s = debounce_s
+        self.poll_interval_s = poll_interval_s
+        self.backend = "inotify" if (watchfiles is not None if use_inotify is None else use_inotify) else "polling"
+        if self.backend == "inotify" and watchfiles is None:
+            raise RuntimeError("watchfiles is not installed")
+
+        self.seq = 0
+        self._journal: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.stats = {"batches": 0, "paths_changed": 0, "files_rescanned": 0,
+                      "full_rescans": 0, "index_files_updated": 0, "graph_files_updated": 0}
+
+        # Structure table: relative path -> extension, plus derived counts
+        self._files: Dict[str, str] = {}
+        self._languages: Dict[str, int] = {}
+        self._key_files: Set[str] = set()
+        self._searchable: Set[str] = set()
+        self._ignores: Dict[str, Optional[GitIgnore]] = {}
+        self._index: Optional[RepoIndex] = None
+        self._index_seq = 0
+        self._index_lock = threading.Lock()
+        self._graph: Optional[CodeGraph] = None
+        self._graph_seq = 0
+        self._graph_lock = threading.Lock()
+        for path in _walk_visible(self.repo_path):
+            self._add(os.path.relpath(path, self.repo_path))
+        self._searchable = set(iter_text_files(self.repo_path))
+
+    # -- lifecycle ---------------------------------------------------------
+
+    def start(self) -> "RepoWatcher":
+        """Starts the background thread (idempotent)."""
+        if self._thread is None:
+            target = self._run_inotify if self.backend == "inotify" else self._run_polling
+            self._thread = threading.Thread(target=target, daemon=True, name="repo-watcher")
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+
+    def _run_inotify(self):
+        # watchfiles groups events until nothing changed for `step` ms
+        try:
+            for changes in watchfiles.watch(
+                self.repo_path,
+                watch_filter=None,
+                debounce=int(max(self.debounce_s, 0.05) * 1000 * 4),
+                step=int(max(self.debounce_s, 0.05) * 1000),
+                stop_event=self._stop,
+                raise_interrupt=False,
+            ):
+                self.apply([os.path.relpath(path, self.repo_path) for _, path in changes])
+        except Exception as e:
+            print(f"❌ Watcher error for {self.repo_path}: {str(e)}")
+
+    def _snapshot(self) -> Dict[str, Tuple[int, int]]:
+        snapshot = {}
+        for current, dirs, files in os.walk(self.repo_path):
+            dirs[:] = [d for d in dirs if not d.startswith('.') and d not in SKIP_DIRS]
+            for file in files:
+                if file.startswith('.') and file != '.gitignore':
+                    continue
+                path = os.path.join(current, file)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                snapshot[os.path.relpath(path, self.repo_path)] = (st.st_mtime_ns, st.st_size)
+        return snapshot
+
+    def _run_polling(self):
+        previous = self._snapshot()
+        pending: Set[str] = set()
+        last_change = 0.0
+        while not self._stop.wait(self.poll_interval_s):
+            current = self._snapshot()
+            changed = {rel for rel in previous.keys() | current.keys() if previous.get(rel) != current.get(rel)}
+            previous = current
+            if changed:
+                pending |= changed
+                last_change = time.monotonic()
+            elif pending and time.monotonic() - last_change >= self.debounce_s:
+                self.apply(sorted(pending))
+                pending = set()
+
+    # -- change application ------------------------------------------------
+
+    def _add(self, rel: str):
+        if rel in self._files:
+            return
+        ext = os.path.splitext(rel)[1]
+        self._files[rel] = ext
+        if ext:
+            self._languages[ext] = self._languages.get(ext, 0) + 1
+        name = os.path.basename(rel)
+        if name.lower() in README_NAMES or name in KEY_FILE_NAMES:
+            self._key_files.add(rel)
+
+    def _remove(self, rel: str):
+        ext = self._files.pop(rel, None)
+        if ext is None:
+            return
+        if ext:
+            self._languages[ext] -= 1
+            if not self._languages[ext]:
+                del self._languages[ext]
+        self._key_files.discard(rel)
+
+    def _gitignore(self, directory: str) -> Optional[GitIgnore]:
+        if directory not in self._ignores:
+            self._ignores[directory] = GitIgnore.load(directory)
+        return self._ignores[directory]
+
+    def _is_searchable(self, path: str) -> bool:
+        """Whether iter_text_files would yield ``path``, checking only its ancestors."""
+        rel = os.path.relpath(path, self.repo_path)
+        if not _visible(rel):
+            return False
+        active = []
+        directory = self.repo_path
+        for part in rel.split(os.sep)[:-1]:
+            own = self._gitignore(directory)
+            if own:
+                active.append(own)
+            directory = os.path.join(directory, part)
+            if any(rule.matches(directory, True) for rule in active):
+                return False
+        own = self._gitignore(directory)
+        if own:
+            active.append(own)
+        return not any(rule.matches(path, False) for rule in active)
+
+    def apply(self, rel_paths: List[str]):
+        """
+        Applies one batch of changed paths (files or directories).
+
+        Work is proportional to the number of changed files: each one is
+        stat'ed once and its structure/searchable entries are replaced.
+        A changed .gitignore re-derives the searchable list instead.
+        """
+        with self._lock:
+            affected: Set[str] = set()
+            rescan_ignores = False
+            for rel in set(rel_paths):
+                if rel.startswith('..'):
+                    continue
+                if os.path.basename(rel) == '.gitignore':
+                    rescan_ignores = rescan_ignores or _visible(os.path.dirname(rel))
+                    continue
+                if not _visible(rel):
+                    continue
+                path = os.path.join(self.repo_path, rel)
+                if os.path.isdir(path):
+                    if os.path.basename(rel) in SKIP_DIRS:
+                        continue
+                    # Directory created or moved in
+                    inside = [os.path.relpath(p, self.repo_path) for p in _walk_visible(path)]
+                elif os.path.isfile(path):
+                    inside = [rel]
+                else:
+                    # Deleted: the path itself or everything below a deleted directory
+                    prefix = rel + os.sep
+                    gone = [f for f in self._files if f == rel or f.startswith(prefix)]
+                    for f in gone:
+                        self._remove(f)
+                        self._searchable.discard(os.path.join(self.repo_path, f))
+                    affected.update(gone or [rel])
+                    continue
+                for f in inside:
+                    self._add(f)
+                    full = os.path.join(self.repo_path, f)
+                    if self._is_searchable(full):
+                        self._searchable.add(full)
+                    else:
+                        self._searchable.discard(full)
+                self.stats["files_rescanned"] += len(inside)
+                affected.update(inside)
+
+            if rescan_ignores:
+                self._ignores.clear()
+                before = self._searchable
+                self._searchable = set(iter_text_files(self.repo_path))
+                affected.update(os.path.relpath(p, self.repo_path) for p in before ^ self._searchable)
+                self.stats["full_rescans"] += 1
+
+            if not affected:
+                return
+            self.seq += 1
+            for rel in affected:
+                self._journal[rel] = self.seq
+            self.stats["batches"] += 1
+            self.stats["paths_changed"] += len(affected)
+
+    def changes_since(self, seq: int) -> Tuple[int, List[str]]:
+        """
+        Reads the change journal.
+
+        Returns:
+            (current sequence number, sorted paths changed after ``seq``)
+        """
+        with self._lock:
+            return self.seq, sorted(rel for rel, s in self._journal.items() if s > seq)
+
+    # -- views -------------------------------------------------------------
+
+    def structure(self) -> dict:
+        """File counts per extension and key files, as relative paths."""
+        with self._lock:
+            return {
+                "total_files": len(self._files),
+                "languages": dict(self._languages),
+                "key_files": sorted(self._key_files),
+                "readme_exists": any(os.path.basename(f).lower() in README_NAMES for f in self._key_files),
+            }
+
+    def searchable_files(self) -> List[str]:
+        """Current result of iter_text_files, without walking the tree."""
+        with self._lock:
+            return sorted(self._searchable)
+
+    def _split_searchable(self, rel_paths: List[str]) -> Tuple[List[str], List[str]]:
+        """
+        Splits journal paths into (searchable, not searchable).
+
+        Gitignored files are journaled too, but full builds never include
+        them, so incremental updates only drop them.
+        """
+        with self._lock:
+            searchable = [rel for rel in rel_paths if os.path.join(self.repo_path, rel) in self._searchable]
+        kept = set(searchable)
+        return searchable, [rel for rel in rel_paths if rel not in kept]
+
+    def index(self) -> Optional[RepoIndex]:
+        """
+        Retrieval index with journal changes since its last use applied.
+
+        Updates go into a shallow copy, so callers still holding the
+        previous index never see it half-updated.
+        """
+        with self._index_lock:
+            if self._index is None:
+                seq = self.seq
+                self._index = get_index(self.repo_path)
+                self._index_seq = seq
+            seq, changed = self.changes_since(self._index_seq)
+            if changed and self._index is not None:
+                index = copy.copy(self._index)
+                index.update(*self._split_searchable(changed))
+                self._index = index
+                self.stats["index_files_updated"] += len(changed)
+            self._index_seq = seq
+            return self._index
+
+    def graph(self) -> CodeGraph:
+        """Import/call graph with journal changes since its last use re-parsed."""
+        with self._graph_lock:
+            if self._graph is None:
+                seq = self.seq
+                self._graph = CodeGraph.build(
+                    self.repo_path, [p for p in self.searchable_files() if p.endswith(".py")]
+                )
+                self._graph_seq = seq
+            seq, changed = self.changes_since(self._graph_seq)
+            changed = [rel for rel in changed if rel.endswith(".py")]
+            if changed:
+                self._graph = self._graph.updated(*self._split_searchable(changed))
+                self.stats["graph_files_updated"] += len(changed)
+            self._graph_seq = seq
+            return self._graph
+
+
+# Watchers by absolute repository path
+_watchers: Dict[str, RepoWatcher] = {}
+_watchers_lock = threading.Lock()
+
+
+def watching_enabled() -> bool:
+    return os.getenv("STUDYMATE_WATCH", "0") == "1"
+
+
+def watch(repo_path: str) -> Optional[RepoWatcher]:
+    """Starts (or returns the running) watcher for a local repository."""
+    if not repo_path or not os.path.isdir(repo_path):
+        return None
+    key = os.path.abspath(repo_path)
+    with _watchers_lock:
+        watcher = _watchers.get(key)
+        if watcher is None:
+            watcher = _watchers[key] = RepoWatcher(
+                key,
+                debounce_s=float(os.getenv("STUDYMATE_WATCH_DEBOUNCE_S", "0.3")),
+                poll_interval_s=float(os.getenv("STUDYMATE_WATCH_POLL_S", "1.0")),
+            ).start()
+            print(f"👀 Watching {key} ({watcher.backend})")
+    return watcher
+
+
+def watched(repo_path: str) -> Optional[RepoWatcher]:
+    """The running watcher for a repository, if any."""
+    if not repo_path:
+        return None
+    return _watchers.get(os.path.abspath(repo_path))
+
+
+def unwatch(repo_path: str):
+    """Stops watching a repository."""
+    with _watchers_lock:
+        watcher = _watchers.pop(os.path.abspath(repo_path), None)
+    if watcher is not None:
+        watcher.stop()
+
+
+@atexit.register
+def _unwatch_all():
+    for repo_path in list(_watchers):
+        unwatch(repo_path)
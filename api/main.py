@@ -2,16 +2,30 @@
 FastAPI Backend for StudyMate
 """
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 import os
 from datetime import datetime
-from typing import Optional
+from typing import Dict, Optional
 import uuid
 import os
+import json
+import asyncio
+import hmac
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 
+# orjson is much faster for the large payloads served by polling endpoints;
+# fall back to the stdlib encoder when it is not installed.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # Force load .env
 load_dotenv()
 
@@ -22,6 +36,40 @@ print(f"📱 Model: {os.getenv('OPENAI_MODEL', 'gpt-4o-mini')}")
 import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from agent import StudyMateAgent
+from agent.analytics import analytics
+from agent.budget import BudgetExceeded
+from agent.codegraph import get_graph
+from agent.deadline import CancelScope, TurnCancelled, cancellation_metrics
+from agent.routing import get_router
+from agent.response_cache import response_cache
+from agent.retrieval import get_index
+from agent.speculation import speculator
+from api.profiling import ProfilingMiddleware, profiler
+from api.snapshot import SessionStore
+
+# Sessions survive restarts through a snapshot written on shutdown
+SNAPSHOT_PATH = os.getenv("STUDYMATE_SNAPSHOT_PATH", "data/sessions.snap")
+SNAPSHOT_MAX_IDLE_S = float(os.getenv("STUDYMATE_SNAPSHOT_MAX_IDLE_S", str(7 * 24 * 3600)))
+
+store = SessionStore()
+
+
+@asynccontextmanager
+async def _lifespan(app: FastAPI):
+    """Maps the last snapshot on startup (sessions restore on first use) and writes a new one on shutdown."""
+    if SNAPSHOT_PATH:
+        count = store.open(SNAPSHOT_PATH)
+        if count:
+            print(f"💾 {count} sessions available from {SNAPSHOT_PATH}")
+    yield
+    if SNAPSHOT_PATH:
+        start = time.perf_counter()
+        try:
+            stats = store.save(SNAPSHOT_PATH, SNAPSHOT_MAX_IDLE_S)
+            print(f"💾 Snapshot of {stats['sessions']} sessions written in {time.perf_counter() - start:.2f}s")
+        except OSError as e:
+            print(f"❌ Failed to write session snapshot: {str(e)}")
+
 
 app = FastAPI(
     title="StudyMate API",
@@ -29,6 +77,7 @@ app = FastAPI(
     version="1.0.0",
     docs_url="/docs",
     openapi_url="/openapi.json",
+    lifespan=_lifespan,
 )
 
 # Enable CORS (for Streamlit to connect)
@@ -40,19 +89,68 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# In-memory storage for sessions and agents
-sessions = {}
-agents = {}
+# Counts requests towards on-demand profile captures (pass-through otherwise)
+app.add_middleware(ProfilingMiddleware, profiler=profiler)
+
+# In-memory storage for sessions and agents (restored from the snapshot on first access)
+sessions = store.sessions
+agents = store.agents
+
+# History pagination limits
+HISTORY_DEFAULT_LIMIT = 100
+HISTORY_MAX_LIMIT = 1000
+
+
+# Longest a chat turn may run (clients may ask for less)
+CHAT_DEADLINE_S = float(os.getenv("STUDYMATE_CHAT_DEADLINE_S", "120"))
+
+
+# Frames buffered per WebSocket before the streaming thread has to wait
+WS_SEND_QUEUE = 64
+
+# Give up on a client that has not drained its queue for this long
+WS_SEND_TIMEOUT_S = 30
+
+# Events kept per session while it has no open WebSocket
+WS_EVENT_BACKLOG = 32
+
+# Open WebSocket outboxes per session (for server-pushed events)
+connections: Dict[str, set] = {}
+
+# Events published while a session had no open WebSocket, sent on connect
+pending_events: Dict[str, deque] = {}
+
+_connections_lock = threading.Lock()
+
+# Directory of local checkouts sessions may be opened on (``repo_path`` on
+# /session/create); unset disables it
+REPOS_DIR = os.getenv("STUDYMATE_REPOS_DIR")
+
+def _json_bytes(payload: dict) -> bytes:
+    """Serializes a payload with the fastest available JSON encoder."""
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def _json_response(payload: dict, status_code: int = 200, headers: dict = None) -> Response:
+    return Response(content=_json_bytes(payload), status_code=status_code, media_type="application/json", headers=headers)
+
 
 # Request/Response Models
 class SessionCreate(BaseModel):
     github_url: str
     student_name: Optional[str] = "Student"
     knowledge_level: Optional[str] = "intermediate"
+    repo_path: Optional[str] = None
+    background_greeting: Optional[bool] = False
 
 class ChatMessage(BaseModel):
     session_id: str
     message: str
+    concept: Optional[str] = None
+    understanding_level: Optional[str] = None
+    timeout_s: Optional[float] = None
 
 class SessionResponse(BaseModel):
     session_id: str
@@ -77,38 +175,143 @@ async def root():
 # Health check
 @app.get("/health")
 async def health():
+    prompt_tokens = sum(a.usage["prompt_tokens"] for a in agents.values())
+    cached_tokens = sum(a.usage["cached_tokens"] for a in agents.values())
     return {
         "status": "healthy",
         "active_sessions": len(sessions),
         "agents_initialized": len(agents),
+        "snapshot": store.stats,
         "openai_key_configured": bool(os.getenv("OPENAI_API_KEY")),
+        "prompt_cache": {
+            "prompt_tokens": prompt_tokens,
+            "cached_tokens": cached_tokens,
+            "cached_token_ratio": cached_tokens / prompt_tokens if prompt_tokens else 0.0
+        },
         "timestamp": datetime.now().isoformat()
     }
 
 
+# Model routing metrics
+@app.get("/metrics/routing")
+async def routing_metrics():
+    """Routing decisions per call site and observed latency/errors per model."""
+    return get_router().metrics()
+
+
+# Cancelled work
+@app.get("/metrics/cancellation")
+async def cancellation_stats():
+    """Turns, model calls and searches abandoned on deadline or client disconnect."""
+    return cancellation_metrics()
+
+
+# Speculative pre-generation metrics
+@app.get("/metrics/speculation")
+async def speculation_metrics():
+    """Hit rate and wasted tokens of speculatively pre-generated hints/questions."""
+    return speculator.metrics()
+
+
+# Semantic response cache metrics
+@app.get("/metrics/response-cache")
+async def response_cache_metrics():
+    """Hit rate, evictions and size of the cache of replies to near-duplicate questions."""
+    return response_cache.metrics()
+
+
+def publish(session_id: str, event: dict) -> int:
+    """
+    Pushes an event (ingest progress, background greetings, ...) to every
+    open WebSocket of a session. Safe to call from any thread.
+    
+    Events for a session with no open WebSocket are kept (up to
+    WS_EVENT_BACKLOG) and sent when one connects.
+    
+    Returns:
+        Number of connections the event was queued for
+    """
+    frame = {"type": "event", **event}
+    with _connections_lock:
+        outboxes = list(connections.get(session_id, ()))
+        if not outboxes:
+            backlog = pending_events.get(session_id)
+            if backlog is None:
+                backlog = pending_events[session_id] = deque(maxlen=WS_EVENT_BACKLOG)
+            backlog.append(frame)
+            return 0
+    delivered = 0
+    for outbox in outboxes:
+        if outbox.offer(frame):
+            delivered += 1
+        else:
+            print(f"⚠️ Dropped event for slow WebSocket client in session {session_id}")
+    return delivered
+
+
+def _resolve_repo(repo_path: Optional[str]) -> Optional[str]:
+    """Maps a requested checkout to a directory inside REPOS_DIR."""
+    if not repo_path:
+        return None
+    if not REPOS_DIR:
+        raise HTTPException(status_code=400, detail="Local repositories are not enabled")
+    root = os.path.realpath(REPOS_DIR)
+    path = os.path.realpath(os.path.join(root, repo_path))
+    if os.path.commonpath([root, path]) != root or not os.path.isdir(path):
+        raise HTTPException(status_code=400, detail="Unknown repository")
+    return path
+
+
+def _ingest_repo(session_id: str, repo_path: str):
+    """Builds a session's search index and code graph, publishing progress."""
+    for stage, build in (("index", get_index), ("graph", get_graph)):
+        publish(session_id, {"event": "ingest", "stage": stage, "status": "started"})
+        start = time.perf_counter()
+        try:
+            build(repo_path)
+        except Exception as e:
+            print(f"❌ Ingest ({stage}) failed for session {session_id}: {str(e)}")
+            publish(session_id, {"event": "ingest", "stage": stage, "status": "failed", "detail": str(e)})
+            return
+        publish(session_id, {
+            "event": "ingest",
+            "stage": stage,
+            "status": "done",
+            "seconds": round(time.perf_counter() - start, 3)
+        })
+    publish(session_id, {"event": "ingest", "stage": "ready", "status": "done"})
+
+
+def _push_greeting(agent: StudyMateAgent, greeting_prompt: str, session_id: str):
+    """Generates a session's greeting on a worker thread and publishes it."""
+    greeting = agent.teach(greeting_prompt, session_id=session_id, record_input=False)
+    publish(session_id, {"event": "greeting", "greeting": greeting})
+
+
 # Create session endpoint
 @app.post("/session/create", response_model=SessionResponse)
 async def create_session(session_data: SessionCreate):
     """
     Creates a new learning session with agent.
     """
+    repo_path = _resolve_repo(session_data.repo_path)
     try:
         # Generate session ID
         session_id = str(uuid.uuid4())
         
-        # Initialize agent (without repo for now)
+        # Initialize agent (on a local checkout when one was given)
         print(f"🔧 Initializing agent for session {session_id}...")
-        agent = StudyMateAgent(repo_path=None)
+        agent = StudyMateAgent(repo_path=repo_path, knowledge_level=session_data.knowledge_level)
         agents[session_id] = agent
         
-        # Store session info
+        # Store session info (the transcript is shared with the agent)
         sessions[session_id] = {
             "id": session_id,
             "github_url": session_data.github_url,
             "student_name": session_data.student_name,
             "knowledge_level": session_data.knowledge_level,
             "created_at": datetime.now().isoformat(),
-            "messages": []
+            "messages": agent.transcript
         }
         
         # Generate personalized greeting using the agent
@@ -116,14 +319,18 @@ async def create_session(session_data: SessionCreate):
 
 Generate a warm, personalized greeting and ask them what specific aspect interests them most. Keep it conversational and encouraging."""
         
-        greeting = agent.teach(greeting_prompt, session_id=session_id)
+        loop = asyncio.get_running_loop()
+        if repo_path:
+            # Progress arrives as events on the session's WebSocket
+            loop.run_in_executor(None, _ingest_repo, session_id, repo_path)
         
-        # Store greeting
-        sessions[session_id]["messages"].append({
-            "role": "assistant",
-            "content": greeting,
-            "timestamp": datetime.now().isoformat()
-        })
+        if session_data.background_greeting:
+            # Returned at once; the greeting is pushed when it is ready
+            loop.run_in_executor(None, _push_greeting, agent, greeting_prompt, session_id)
+            greeting = ""
+        else:
+            # Only the greeting itself is recorded, not the instruction
+            greeting = agent.teach(greeting_prompt, session_id=session_id, record_input=False)
         
         print(f"✅ Agent initialized for session {session_id}")
         
@@ -139,10 +346,32 @@ Generate a warm, personalized greeting and ask them what specific aspect interes
 
 
 # Chat endpoint
+def _turn_scope(timeout_s: Optional[float] = None) -> CancelScope:
+    """Deadline for one turn: the client's timeout, capped by the server's."""
+    if isinstance(timeout_s, (int, float)) and timeout_s > 0:
+        return CancelScope(timeout_s=min(timeout_s, CHAT_DEADLINE_S))
+    return CancelScope(timeout_s=CHAT_DEADLINE_S)
+
+
+async def _wait_for_disconnect(request: Request):
+    """Returns once the HTTP client has gone away."""
+    while (await request.receive())["type"] != "http.disconnect":
+        pass
+
+
+def _chat_turn(agent: StudyMateAgent, chat_msg: ChatMessage, scope: CancelScope) -> str:
+    with profiler.session_turn(chat_msg.session_id):
+        return agent.teach(chat_msg.message, session_id=chat_msg.session_id, scope=scope)
+
+
 @app.post("/chat", response_model=ChatResponse)
-async def chat(chat_msg: ChatMessage):
+async def chat(chat_msg: ChatMessage, request: Request):
     """
     Handles student messages using the agent.
+    
+    The turn runs on a worker thread under a deadline; if the client
+    disconnects first, in-flight model and tool work is cancelled and the
+    turn is rolled back out of the history.
     """
     # Validate session
     if chat_msg.session_id not in sessions:
@@ -151,33 +380,38 @@ async def chat(chat_msg: ChatMessage):
     if chat_msg.session_id not in agents:
         raise HTTPException(status_code=404, detail="Agent not initialized for this session")
     
-    session = sessions[chat_msg.session_id]
     agent = agents[chat_msg.session_id]
     
     try:
-        # Store student message
-        session["messages"].append({
-            "role": "user",
-            "content": chat_msg.message,
-            "timestamp": datetime.now().isoformat()
-        })
+        # Concept focus drives speculative hint/question pre-generation
+        if chat_msg.concept:
+            agent.focus(chat_msg.concept, chat_msg.understanding_level)
         
-        # Get agent response
+        # Get agent response (both turns are recorded in the shared transcript)
         print(f"🤖 Agent processing: {chat_msg.message[:50]}...")
-        response = agent.teach(chat_msg.message, session_id=chat_msg.session_id)
-        
-        # Store response
-        session["messages"].append({
-            "role": "assistant",
-            "content": response,
-            "timestamp": datetime.now().isoformat()
-        })
+        scope = _turn_scope(chat_msg.timeout_s)
+        turn = asyncio.get_running_loop().run_in_executor(None, _chat_turn, agent, chat_msg, scope)
+        disconnect = asyncio.ensure_future(_wait_for_disconnect(request))
+        try:
+            await asyncio.wait({turn, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+            if disconnect.done():
+                scope.cancel("client_disconnected")
+            response = await turn
+        finally:
+            disconnect.cancel()
         
         return ChatResponse(
             response=response,
             session_id=chat_msg.session_id
         )
-        
+    
+    except TurnCancelled as e:
+        if e.reason == "client_disconnected":
+            # Nobody is listening; 499 only shows up in access logs
+            return Response(status_code=499)
+        raise HTTPException(status_code=504, detail="Chat deadline exceeded")
+    except BudgetExceeded as e:
+        raise HTTPException(status_code=429, detail=str(e))
     except Exception as e:
         print(f"❌ Error in chat: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Chat error: {str(e)}")
@@ -185,16 +419,301 @@ async def chat(chat_msg: ChatMessage):
 
 # Get session history
 @app.get("/session/{session_id}/history")
-async def get_history(session_id: str):
-    """Returns conversation history for a session."""
+async def get_history(
+    session_id: str,
+    request: Request,
+    cursor: int = 0,
+    limit: Optional[int] = None,
+    since: Optional[int] = None,
+):
+    """
+    Returns a page of conversation history for a session.
+
+    Messages are append-only, so a message's index is a stable cursor.
+    Polling clients pass ``since`` (the number of messages they already
+    have) to receive only new messages, or send the last ``ETag`` in
+    ``If-None-Match`` to get an empty 304 when nothing changed.
+    Without paging parameters the whole history is returned; with them
+    ``limit`` defaults to HISTORY_DEFAULT_LIMIT.
+    """
     if session_id not in sessions:
         raise HTTPException(status_code=404, detail="Session not found")
     
-    return {
-        "session_id": session_id,
-        "messages": sessions[session_id]["messages"],
-        "total_messages": len(sessions[session_id]["messages"])
-    }
+    if cursor < 0 or (since is not None and since < 0):
+        raise HTTPException(status_code=400, detail="cursor and since must be non-negative")
+    if limit is not None and limit < 1:
+        raise HTTPException(status_code=400, detail="limit must be positive")
+    
+    messages = sessions[session_id]["messages"]
+    total = len(messages)
+    if limit is None:
+        limit = total if cursor == 0 and since is None else HISTORY_DEFAULT_LIMIT
+    else:
+        limit = min(limit, HISTORY_MAX_LIMIT)
+    
+    # Identifies this page of this version of the transcript (rollbacks
+    # change the generation even when the length repeats)
+    etag = f'W/"{session_id}:{messages.generation}:{cursor}:{limit}:{since}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    
+    start = max(cursor, since) if since is not None else cursor
+    page = messages.page(start, start + limit)
+    end = start + len(page)
+    
+    return _json_response(
+        {
+            "session_id": session_id,
+            "messages": page,
+            "total_messages": total,
+            "cursor": start,
+            "next_cursor": end if end < total else None,
+        },
+        headers={"ETag": etag},
+    )
+
+
+class _Outbox:
+    """
+    Bounded outgoing frame buffer for one WebSocket.
+    
+    Worker threads enqueue without a round trip to the event loop and
+    only block once WS_SEND_QUEUE frames are waiting to be sent, so a
+    slow client slows the stream down instead of growing server memory.
+    """
+    
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.queue = asyncio.Queue()
+        self.slots = threading.BoundedSemaphore(WS_SEND_QUEUE)
+        self.tokens = []
+        self.tokens_lock = threading.Lock()
+    
+    def put_threadsafe(self, frame: dict):
+        """Called from worker threads; blocks while the buffer is full."""
+        if not self.slots.acquire(timeout=WS_SEND_TIMEOUT_S):
+            raise TimeoutError("WebSocket client stopped reading")
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, frame)
+    
+    def put_token_threadsafe(self, content: str):
+        """
+        Called from worker threads for streamed text.
+        
+        Tokens produced before the loop picks up the last batch join it,
+        so only the first token of a batch takes a slot and wakes the loop.
+        """
+        with self.tokens_lock:
+            self.tokens.append(content)
+            if len(self.tokens) > 1:
+                return
+        if not self.slots.acquire(timeout=WS_SEND_TIMEOUT_S):
+            with self.tokens_lock:
+                self.tokens.clear()
+            raise TimeoutError("WebSocket client stopped reading")
+        self.loop.call_soon_threadsafe(self._flush_tokens)
+    
+    def _flush_tokens(self):
+        with self.tokens_lock:
+            content = ''.join(self.tokens)
+            self.tokens.clear()
+        self.queue.put_nowait({"type": "token", "content": content})
+    
+    def offer(self, frame: dict) -> bool:
+        """Called from any thread; returns False instead of waiting if the buffer is full."""
+        if not self.slots.acquire(blocking=False):
+            return False
+        try:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, frame)
+        except RuntimeError:
+            # The connection's loop has shut down
+            self.slots.release()
+            return False
+        return True
+    
+    def put_nowait(self, frame: dict) -> bool:
+        """Called on the event loop; returns False if the buffer is full."""
+        if not self.slots.acquire(blocking=False):
+            return False
+        self.queue.put_nowait(frame)
+        return True
+    
+    async def put(self, frame: dict):
+        """Called on the event loop for control frames."""
+        while not self.put_nowait(frame):
+            await asyncio.sleep(0.01)
+    
+    async def send_forever(self, websocket: WebSocket):
+        """Drains the buffer, merging queued tokens into one frame."""
+        while True:
+            frame = await self.queue.get()
+            self.slots.release()
+            held = None
+            if frame["type"] == "token":
+                frame = dict(frame)
+                while True:
+                    try:
+                        following = self.queue.get_nowait()
+                    except asyncio.QueueEmpty:
+                        break
+                    self.slots.release()
+                    if following["type"] != "token":
+                        held = following
+                        break
+                    frame["content"] += following["content"]
+            await websocket.send_text(_json_bytes(frame).decode("utf-8"))
+            if held is not None:
+                await websocket.send_text(_json_bytes(held).decode("utf-8"))
+
+
+def _stream_turn(agent: StudyMateAgent, message: str, session_id: str, outbox: _Outbox,
+                 scope: CancelScope) -> str:
+    """
+    Runs one streamed turn on a worker thread, feeding the connection's outbox.
+    
+    Returns:
+        The reply recorded for the turn. If it is not what was streamed
+        (the model failed part way), a ``reset`` frame tells the client
+        to discard the streamed tokens.
+    """
+    streamed = []
+    with profiler.session_turn(session_id):
+        stream = agent.teach_stream(message, session_id=session_id, scope=scope)
+        try:
+            while True:
+                try:
+                    piece = next(stream)
+                except StopIteration as done:
+                    reply = done.value
+                    break
+                streamed.append(piece)
+                outbox.put_token_threadsafe(piece)
+        finally:
+            # Rolls the turn back if it was abandoned part way (e.g. the
+            # client stopped reading)
+            stream.close()
+    if streamed and ''.join(streamed) != reply:
+        outbox.put_threadsafe({"type": "reset"})
+    return reply
+
+
+async def _receive_frame(websocket: WebSocket) -> dict:
+    """
+    Next client frame as a dict.
+    
+    Malformed frames come back as {"type": "invalid"} so they can be
+    answered with an error; only a real disconnect raises.
+    """
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000))
+    data = message.get("text")
+    if data is None:
+        data = message.get("bytes") or b""
+    try:
+        frame = json.loads(data)
+    except ValueError:
+        return {"type": "invalid", "detail": "Frame is not valid JSON"}
+    return frame if isinstance(frame, dict) else {"type": "invalid", "detail": "Frame is not a JSON object"}
+
+
+# Persistent chat connection
+@app.websocket("/ws/session/{session_id}")
+async def session_socket(websocket: WebSocket, session_id: str):
+    """
+    WebSocket chat for one session. The session is validated once when
+    the connection opens, not on every message.
+    
+    Client frames: {"type": "message", "message": ..., "concept": ..., "understanding_level": ...}
+    Server frames: ready, token (streamed text), reset (discard the
+    streamed text; the turn failed part way), done (full response),
+    event (server-pushed, see ``publish``) and error.
+    """
+    agent = agents.get(session_id)
+    if session_id not in sessions or agent is None:
+        await websocket.close(code=4404)
+        return
+    
+    await websocket.accept()
+    loop = asyncio.get_running_loop()
+    outbox = _Outbox(loop)
+    sender = asyncio.create_task(outbox.send_forever(websocket))
+    next_frame = None
+    
+    try:
+        await outbox.put({
+            "type": "ready",
+            "session_id": session_id,
+            "total_messages": len(sessions[session_id]["messages"])
+        })
+        # Registered and caught up in one step so no event is missed or reordered
+        with _connections_lock:
+            connections.setdefault(session_id, set()).add(outbox)
+            for event in pending_events.pop(session_id, ()):
+                outbox.put_nowait(event)
+        while True:
+            frame = await (next_frame or _receive_frame(websocket))
+            next_frame = None
+            if frame.get("type") == "invalid":
+                await outbox.put({"type": "error", "detail": frame["detail"]})
+                continue
+            message = str(frame.get("message", ""))
+            if frame.get("type") != "message" or not message.strip():
+                await outbox.put({"type": "error", "detail": "Expected {\"type\": \"message\", \"message\": ...}"})
+                continue
+            
+            if frame.get("concept"):
+                agent.focus(frame["concept"], frame.get("understanding_level"))
+            
+            # One turn at a time; the next frame is read meanwhile only to
+            # notice a disconnect, and handled once this turn is done
+            scope = _turn_scope(frame.get("timeout_s"))
+            turn = loop.run_in_executor(None, _stream_turn, agent, message, session_id, outbox, scope)
+            next_frame = asyncio.ensure_future(_receive_frame(websocket))
+            await asyncio.wait({turn, next_frame}, return_when=asyncio.FIRST_COMPLETED)
+            if next_frame.done() and next_frame.exception() is not None:
+                scope.cancel("client_disconnected")
+            try:
+                response = await turn
+            except TurnCancelled as e:
+                if e.reason == "client_disconnected":
+                    break
+                await outbox.put({"type": "error", "detail": "Chat deadline exceeded"})
+                continue
+            except BudgetExceeded as e:
+                await outbox.put({"type": "error", "detail": str(e)})
+                continue
+            await outbox.put({"type": "done", "response": response})
+    
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        print(f"❌ WebSocket error: {str(e)}")
+    finally:
+        if next_frame is not None:
+            next_frame.cancel()
+        with _connections_lock:
+            outboxes = connections.get(session_id)
+            if outboxes is not None:
+                outboxes.discard(outbox)
+                if not outboxes:
+                    del connections[session_id]
+        sender.cancel()
+
+
+# Get session usage
+@app.get("/session/{session_id}/usage")
+async def get_usage(session_id: str):
+    """
+    Returns token, model-time and tool-time usage for a session.
+
+    ``budget.level`` shows how far the session has been degraded:
+    normal, reduced (smaller prompts), cheap (fastest model tier) or
+    exhausted (new turns get 429).
+    """
+    agent = agents.get(session_id)
+    if session_id not in sessions or agent is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return {"session_id": session_id, **agent.ledger.snapshot()}
 
 
 # Get session progress
@@ -211,7 +730,6 @@ async def get_progress(session_id: str):
         }
     
     try:
-        import json
         with open(progress_file, 'r') as f:
             progress = json.load(f)
         return progress
@@ -219,6 +737,110 @@ async def get_progress(session_id: str):
         raise HTTPException(status_code=500, detail=f"Error reading progress: {str(e)}")
 
 
+# Cross-session learning analytics
+ANALYTICS_BUCKETS = {"hour": 3600, "day": 86400, "week": 7 * 86400}
+
+
+def _since_epoch(since: Optional[str]) -> Optional[float]:
+    if since is None:
+        return None
+    try:
+        return datetime.fromisoformat(since).timestamp()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="since must be an ISO timestamp")
+
+
+@app.get("/analytics/mastery")
+async def analytics_mastery(latest: bool = True, since: Optional[str] = None):
+    """Mastery distribution per concept across all sessions."""
+    analytics.backfill()
+    return {
+        "events": len(analytics),
+        "sessions": len(analytics.sessions),
+        "concepts": analytics.mastery_distribution(since=_since_epoch(since), latest=latest)
+    }
+
+
+@app.get("/analytics/weak-concepts")
+async def analytics_weak_concepts(limit: int = 10, min_sessions: int = 1, since: Optional[str] = None):
+    """Concepts with the lowest current mastery across sessions."""
+    analytics.backfill()
+    return {
+        "concepts": analytics.weak_concepts(limit=limit, min_sessions=min_sessions, since=_since_epoch(since))
+    }
+
+
+@app.get("/analytics/activity")
+async def analytics_activity(bucket: str = "day", since: Optional[str] = None):
+    """Progress events and active sessions per hour/day/week."""
+    if bucket not in ANALYTICS_BUCKETS:
+        raise HTTPException(status_code=400, detail=f"bucket must be one of {list(ANALYTICS_BUCKETS)}")
+    analytics.backfill()
+    return {
+        "bucket": bucket,
+        "activity": analytics.activity(bucket_s=ANALYTICS_BUCKETS[bucket], since=_since_epoch(since))
+    }
+
+
+# On-demand profiling (admin only, disabled unless STUDYMATE_ADMIN_TOKEN is set)
+def _require_admin(request: Request):
+    token = os.getenv("STUDYMATE_ADMIN_TOKEN")
+    if not token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not hmac.compare_digest(request.headers.get("x-admin-token", ""), token):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
+@app.post("/admin/profile/start")
+async def profile_start(
+    request: Request,
+    mode: str = "sample",
+    seconds: float = 30.0,
+    requests: Optional[int] = None,
+    interval_ms: float = 5.0,
+    memory: bool = False
+):
+    """Profiles the next ``requests`` HTTP requests or ``seconds`` seconds, whichever ends first."""
+    _require_admin(request)
+    if seconds <= 0 or interval_ms <= 0 or (requests is not None and requests < 1):
+        raise HTTPException(status_code=400, detail="seconds, interval_ms and requests must be positive")
+    try:
+        return profiler.start(mode=mode, seconds=seconds, requests=requests,
+                              interval_ms=interval_ms, memory=memory)
+    except ValueError as e:
+        raise HTTPException(status_code=409 if profiler.capture else 400, detail=str(e))
+
+
+@app.post("/admin/profile/stop")
+async def profile_stop(request: Request):
+    """Ends the running capture early."""
+    _require_admin(request)
+    return profiler.stop() or {"running": False}
+
+
+@app.get("/admin/profile")
+async def profile_status(request: Request):
+    """Running capture (with live event-loop lag) or the last result."""
+    _require_admin(request)
+    return profiler.status()
+
+
+@app.get("/admin/profile/download")
+async def profile_download(request: Request, format: str = "folded"):
+    """Last capture as folded stacks (flamegraph.pl, speedscope) or a pstats file."""
+    _require_admin(request)
+    try:
+        data = profiler.download(format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if data is None:
+        raise HTTPException(status_code=404, detail=f"No {format} profile captured yet")
+    if format == "pstats":
+        return Response(content=data, media_type="application/octet-stream",
+                        headers={"Content-Disposition": 'attachment; filename="studymate.pstats"'})
+    return Response(content=data, media_type="text/plain")
+
+
 # Main entry point
 if __name__ == "__main__":
     import uvicorn
@@ -231,6 +853,8 @@ if __name__ == "__main__":
     print("   POST /chat          - Chat with agent")
     print("   GET  /session/{id}/history - Get history")
     print("   GET  /session/{id}/progress - Get progress")
+    print("   WS   /ws/session/{id}  - Streaming chat")
+    print("   GET  /analytics/{mastery,weak-concepts,activity} - Class analytics")
     print()
     
     uvicorn.run(
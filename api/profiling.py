@@ -0,0 +1,385 @@
+"""
+On-demand profiling for the StudyMate API
+
+A capture runs for the next N requests or T seconds and records:
+    - CPU: a stack-sampling thread over every thread (folded stacks for
+      flamegraph.pl / speedscope) or cProfile on the event-loop thread
+      plus every agent turn on its worker thread (one pstats file)
+    - event-loop lag: how late a periodic timer fires
+    - memory (optional): tracemalloc diffs around each agent turn,
+      aggregated per session
+
+Nothing runs between captures; the request hook is a single attribute
+check.
+
+Environment:
+    STUDYMATE_ADMIN_TOKEN - token for the /admin/profile endpoints (sent as
+                            X-Admin-Token); unset disables them entirely
+"""
+
+import asyncio
+import cProfile
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter, deque
+from contextlib import ExitStack, contextmanager, nullcontext
+from typing import Dict, Optional
+
+PROFILE_MODES = ("sample", "cprofile")
+
+# Frames kept per sampled stack
+MAX_SAMPLE_DEPTH = 64
+
+# Event-loop lag probe period
+LAG_INTERVAL_S = 0.05
+
+# Allocation sites kept per session in memory reports
+MEMORY_TOP = 20
+
+_NULL_CONTEXT = nullcontext()
+
+
+class StackSampler:
+    """
+    Samples the Python stack of every thread at a fixed interval.
+
+    Args:
+        interval_s: Seconds between samples
+    """
+
+    def __init__(self, interval_s: float = 0.005):
+        self.interval_s = interval_s
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="profile-sampler")
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join(timeout=5)
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval_s):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < MAX_SAMPLE_DEPTH:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, f"thread-{ident}"))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def folded(self) -> str:
+        """Collapsed stacks, one "frame;frame;... count" line each."""
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common()) + "\n"
+
+    def top(self, limit: int = 20) -> list:
+        """Functions by share of samples on top of a stack (self time)."""
+        leaves = Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        total = sum(leaves.values()) or 1
+        return [{"function": f, "samples": n, "share": round(n / total, 4)} for f, n in leaves.most_common(limit)]
+
+
+class LoopLagMonitor:
+    """Measures how late a periodic asyncio timer fires on the event loop."""
+
+    def __init__(self, interval_s: float = LAG_INTERVAL_S):
+        self.interval_s = interval_s
+        self.lags = deque(maxlen=10_000)
+        self._task = None
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        self._task = loop.create_task(self._run())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval_s)
+            self.lags.append(max(loop.time() - start - self.interval_s, 0.0))
+
+    def stats(self) -> dict:
+        lags = sorted(self.lags)
+        if not lags:
+            return {"samples": 0}
+        return {
+            "samples": len(lags),
+            "mean_ms": round(sum(lags) / len(lags) * 1000, 3),
+            "p99_ms": round(lags[int(0.99 * (len(lags) - 1))] * 1000, 3),
+            "max_ms": round(lags[-1] * 1000, 3),
+        }
+
+
+class MemoryTracker:
+    """
+    tracemalloc diffs around agent turns, summed per session.
+
+    Concurrent turns overlap, so a session's diff can include other
+    sessions' allocations; profile under low concurrency for clean numbers.
+    """
+
+    def __init__(self, nframes: int = 1):
+        self.nframes = nframes
+        self.sessions: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._started = False
+        self._baseline = None
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.nframes)
+            self._started = True
+        self._baseline = tracemalloc.take_snapshot()
+
+    def stop(self) -> dict:
+        """Stops tracing (if this tracker started it) and returns the report."""
+        report = self.report()
+        if self._started:
+            tracemalloc.stop()
+            self._started = False
+        return report
+
+    @contextmanager
+    def turn(self, session_id: str):
+        before = tracemalloc.take_snapshot()
+        try:
+            yield
+        finally:
+            # Skipped if the capture ended during the turn
+            if tracemalloc.is_tracing():
+                diff = tracemalloc.take_snapshot().compare_to(before, "lineno")
+                with self._lock:
+                    entry = self.sessions.setdefault(session_id, {"turns": 0, "sites": Counter()})
+                    entry["turns"] += 1
+                    for stat in diff[:MEMORY_TOP]:
+                        entry["sites"][str(stat.traceback)] += stat.size_diff
+
+    def report(self) -> dict:
+        with self._lock:
+            sessions = {
+                session_id: {
+                    "turns": entry["turns"],
+                    "net_bytes": sum(entry["sites"].values()),
+                    "top_sites": [
+                        {"site": site, "bytes": size}
+                        for site, size in entry["sites"].most_common(MEMORY_TOP)
+                    ],
+                }
+                for session_id, entry in self.sessions.items()
+            }
+        process = []
+        if self._baseline is not None and tracemalloc.is_tracing():
+            for stat in tracemalloc.take_snapshot().compare_to(self._baseline, "lineno")[:MEMORY_TOP]:
+                process.append({"site": str(stat.traceback), "bytes": stat.size_diff})
+        return {"sessions": sessions, "since_start": process}
+
+
+class Profiler:
+    """
+    Coordinates one capture at a time.
+
+    Start and stop must run on the event-loop thread: cProfile only
+    profiles the thread that enabled it. Agent turns run on worker
+    threads, so each turn gets a profiler of its own, merged into the
+    capture's stats on stop. Python 3.12+ allows one active profiler per
+    process; there turns cannot be profiled while the event-loop
+    profiler runs and are counted as ``turns_unprofiled`` instead.
+    """
+
+    def __init__(self):
+        self.capture: Optional[dict] = None
+        self.result: Optional[dict] = None
+        self._sampler: Optional[StackSampler] = None
+        self._cprofile: Optional[cProfile.Profile] = None
+        self._turn_profiles = []
+        self._turn_counts = {"turns_profiled": 0, "turns_unprofiled": 0}
+        self._turn_lock = threading.Lock()
+        self._lag: Optional[LoopLagMonitor] = None
+        self._memory: Optional[MemoryTracker] = None
+        self._timer = None
+        self._folded = ""
+        self._pstats = b""
+
+    def start(self, mode: str = "sample", seconds: float = 30.0, requests: Optional[int] = None,
+              interval_ms: float = 5.0, memory: bool = False) -> dict:
+        """
+        Starts a capture that ends after ``seconds`` or ``requests`` HTTP requests.
+
+        Raises:
+            ValueError: Unknown mode or a capture is already running
+        """
+        if mode not in PROFILE_MODES:
+            raise ValueError(f"mode must be one of {list(PROFILE_MODES)}")
+        if self.capture is not None:
+            raise ValueError("A profile capture is already running")
+        loop = asyncio.get_running_loop()
+
+        if mode == "sample":
+            self._sampler = StackSampler(interval_ms / 1000)
+            self._sampler.start()
+        else:
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+            self._turn_profiles = []
+            self._turn_counts = {"turns_profiled": 0, "turns_unprofiled": 0}
+        self._lag = LoopLagMonitor()
+        self._lag.start(loop)
+        if memory:
+            self._memory = MemoryTracker()
+            self._memory.start()
+        self._timer = loop.call_later(seconds, self.stop)
+
+        self.capture = {
+            "mode": mode,
+            "started_at": time.time(),
+            "seconds": seconds,
+            "requests_left": requests,
+            "requests_seen": 0,
+            "memory": memory,
+        }
+        return dict(self.capture)
+
+    def request_done(self):
+        """Counts a finished request towards the capture's request limit."""
+        capture = self.capture
+        if capture is None:
+            return
+        capture["requests_seen"] += 1
+        if capture["requests_left"] is not None:
+            capture["requests_left"] -= 1
+            if capture["requests_left"] <= 0:
+                self.stop()
+
+    def stop(self) -> Optional[dict]:
+        """Ends the running capture and keeps its results for download."""
+        capture, self.capture = self.capture, None
+        if capture is None:
+            return self.result
+        self._timer.cancel()
+        result = dict(capture, duration_s=round(time.time() - capture["started_at"], 3))
+
+        if self._sampler is not None:
+            self._sampler.stop()
+            self._folded = self._sampler.folded()
+            result["samples"] = self._sampler.samples
+            result["top"] = self._sampler.top()
+            self._pstats = b""
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            with self._turn_lock:
+                turn_profiles, self._turn_profiles = self._turn_profiles, []
+                result.update(self._turn_counts)
+            stats = pstats.Stats(self._cprofile)
+            for turn_profile in turn_profiles:
+                stats.add(turn_profile)
+            self._pstats = marshal.dumps(stats.stats)
+            result["top"] = [
+                {"function": pstats.func_std_string(func), "calls": nc, "cumulative_s": round(ct, 6)}
+                for func, (cc, nc, tt, ct, callers) in sorted(
+                    stats.stats.items(), key=lambda item: -item[1][3]
+                )[:20]
+            ]
+            self._folded = ""
+        self._lag.stop()
+        result["loop_lag"] = self._lag.stats()
+        if self._memory is not None:
+            result["memory"] = self._memory.stop()
+
+        self._sampler = self._cprofile = self._lag = self._memory = None
+        result.pop("requests_left", None)
+        self.result = result
+        return result
+
+    def status(self) -> dict:
+        """The running capture (with live loop lag) or the last result."""
+        if self.capture is not None:
+            status = dict(self.capture, running=True, loop_lag=self._lag.stats())
+            if self._memory is not None:
+                status["memory"] = self._memory.report()
+            return status
+        return {"running": False, "result": self.result}
+
+    def download(self, fmt: str) -> Optional[bytes]:
+        """Last capture as "pstats" (marshal, for pstats.Stats) or "folded" text."""
+        if fmt == "pstats":
+            return self._pstats or None
+        if fmt == "folded":
+            return self._folded.encode("utf-8") if self._folded else None
+        raise ValueError("format must be 'pstats' or 'folded'")
+
+    def session_turn(self, session_id: str):
+        """Context manager around an agent turn; a no-op unless memory or cProfile is capturing."""
+        memory, profiling = self._memory, self._cprofile is not None
+        if memory is None and not profiling:
+            return _NULL_CONTEXT
+        return self._turn(session_id, memory, profiling)
+
+    @contextmanager
+    def _turn(self, session_id: str, memory: Optional[MemoryTracker], profiling: bool):
+        with ExitStack() as stack:
+            if memory is not None:
+                stack.enter_context(memory.turn(session_id))
+            if profiling:
+                stack.enter_context(self._profile_turn())
+            yield
+
+    @contextmanager
+    def _profile_turn(self):
+        """cProfile for one turn on the calling (worker) thread."""
+        turn_profile = cProfile.Profile()
+        try:
+            turn_profile.enable()
+        except ValueError:
+            # Another profiler is active (Python 3.12+)
+            turn_profile = None
+        try:
+            yield
+        finally:
+            if turn_profile is not None:
+                turn_profile.disable()
+            with self._turn_lock:
+                # Dropped if the capture ended during the turn
+                if self._cprofile is not None:
+                    if turn_profile is None:
+                        self._turn_counts["turns_unprofiled"] += 1
+                    else:
+                        self._turn_profiles.append(turn_profile)
+                        self._turn_counts["turns_profiled"] += 1
+
+
+class ProfilingMiddleware:
+    """ASGI middleware counting finished HTTP requests during a capture."""
+
+    def __init__(self, app, profiler: Profiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if self.profiler.capture is None or scope["type"] != "http" or scope["path"].startswith("/admin/"):
+            return await self.app(scope, receive, send)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.profiler.request_done()
+
+
+profiler = Profiler()
@@ -0,0 +1,298 @@
+"""
+Session snapshots for warm restarts of the StudyMate API
+
+On shutdown every live session (its record, transcript and agent state)
+is written to one binary file. On startup the file is memory-mapped and
+only its header is read; a session is decoded the first time a request
+asks for it, so startup time does not depend on how many sessions the
+file holds. Sessions nobody asked for are copied forward byte-for-byte
+into the next snapshot.
+
+File layout (little-endian):
+    header  - magic, version, session count, index offset
+    records - per session: meta length, transcript length, JSON meta,
+              Transcript.to_bytes() columns
+    index   - per session, sorted by key: 16-byte SHA-1 prefix of the
+              session id, record offset, record length, last activity
+
+Environment:
+    STUDYMATE_SNAPSHOT_PATH     - snapshot file ("" disables, default data/sessions.snap)
+    STUDYMATE_SNAPSHOT_MAX_IDLE_S - sessions idle longer are not carried forward (default 7 days)
+"""
+
+import bisect
+import hashlib
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from typing import Callable, Dict, Optional, Tuple
+
+from agent import StudyMateAgent
+from agent.transcript import Transcript
+
+MAGIC = b"SMSNAP\0\0"
+VERSION = 1
+
+_HEADER = struct.Struct("<8sIIQ")
+_ENTRY = struct.Struct("<16sQId")
+_RECORD = struct.Struct("<II")
+
+# Session fields that are not part of the JSON meta
+_TRANSCRIPT_FIELD = "messages"
+
+
+def _key(session_id: str) -> bytes:
+    return hashlib.sha1(session_id.encode("utf-8")).digest()[:16]
+
+
+def encode_session(session: dict, agent: Optional[StudyMateAgent]) -> bytes:
+    """One session record: JSON meta (session fields + agent state) and the transcript columns."""
+    transcript = session[_TRANSCRIPT_FIELD]
+    meta = {k: v for k, v in session.items() if k != _TRANSCRIPT_FIELD}
+    if agent is not None:
+        meta["agent"] = {
+            "repo_path": agent.repo_path,
+            "knowledge_level": agent.knowledge_level,
+            "session_id": agent.session_id,
+            "active_concept": agent.active_concept,
+            "struggle_count": agent.struggle_count,
+            "usage": agent.usage,
+            "ledger": {
+                "totals": agent.ledger.totals,
+                "by_site": agent.ledger.by_site,
+                "by_tool": agent.ledger.by_tool,
+            },
+        }
+    meta_bytes = json.dumps(meta, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    transcript_bytes = transcript.to_bytes()
+    return b"".join((_RECORD.pack(len(meta_bytes), len(transcript_bytes)), meta_bytes, transcript_bytes))
+
+
+def decode_session(data) -> Tuple[dict, Optional[StudyMateAgent]]:
+    """Rebuilds the session record and its agent from ``encode_session`` output."""
+    view = memoryview(data)
+    meta_len, transcript_len = _RECORD.unpack_from(view)
+    offset = _RECORD.size
+    meta = json.loads(bytes(view[offset:offset + meta_len]))
+    transcript = Transcript.from_bytes(view[offset + meta_len:offset + meta_len + transcript_len])
+
+    state = meta.pop("agent", None)
+    session = dict(meta, **{_TRANSCRIPT_FIELD: transcript})
+    if state is None:
+        return session, None
+    agent = StudyMateAgent(
+        repo_path=state["repo_path"], transcript=transcript, knowledge_level=state["knowledge_level"]
+    )
+    agent.session_id = state["session_id"]
+    agent.active_concept = state["active_concept"]
+    agent.struggle_count = state["struggle_count"]
+    agent.usage.update(state["usage"])
+    # Budgets come from the current configuration; only the counters are restored
+    agent.ledger.totals.update(state["ledger"]["totals"])
+    agent.ledger.by_site.update(state["ledger"]["by_site"])
+    agent.ledger.by_tool.update(state["ledger"]["by_tool"])
+    return session, agent
+
+
+class _Keys:
+    """Sequence view of the index keys for bisect, read straight from the map."""
+
+    def __init__(self, snapshot: "SessionSnapshot"):
+        self.snapshot = snapshot
+
+    def __len__(self) -> int:
+        return self.snapshot.count
+
+    def __getitem__(self, i: int) -> bytes:
+        start = self.snapshot.index_offset + i * _ENTRY.size
+        return self.snapshot.map[start:start + 16]
+
+
+class SessionSnapshot:
+    """
+    Read-only, memory-mapped snapshot file.
+
+    Args:
+        path: Snapshot written by ``write_snapshot``
+
+    Raises:
+        ValueError: Not a snapshot file or an unsupported version
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.count, self.index_offset = _HEADER.unpack_from(self.map)
+        if magic != MAGIC or version != VERSION:
+            self.map.close()
+            raise ValueError(f"{path} is not a version {VERSION} session snapshot")
+        self._keys = _Keys(self)
+
+    def entry(self, i: int) -> Tuple[bytes, int, int, float]:
+        """(key, record offset, record length, last activity) of index entry ``i``."""
+        return _ENTRY.unpack_from(self.map, self.index_offset + i * _ENTRY.size)
+
+    def find(self, session_id: str) -> Optional[int]:
+        """Index entry for a session id (binary search over the mapped index)."""
+        key = _key(session_id)
+        i = bisect.bisect_left(self._keys, key)
+        if i < self.count and self._keys[i] == key:
+            return i
+        return None
+
+    def record(self, i: int) -> memoryview:
+        _, offset, length, _ = self.entry(i)
+        return memoryview(self.map)[offset:offset + length]
+
+    def close(self):
+        self.map.close()
+
+
+def write_snapshot(path: str, records, carried: Optional[SessionSnapshot] = None,
+                   skip: frozenset = frozenset(), max_idle_s: Optional[float] = None) -> dict:
+    """
+    Writes a snapshot atomically (temporary file + rename).
+
+    Args:
+        path: Destination file
+        records: Iterable of (session id, encoded record, last activity)
+        carried: Previous snapshot whose entries are copied over unchanged
+        skip: Index entries of ``carried`` not to copy (restored or replaced)
+        max_idle_s: Drop carried sessions idle for longer than this
+
+    Returns:
+        {"sessions": written, "carried": copied from ``carried``, "bytes": file size}
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.tmp"
+    index = []
+    copied = 0
+    cutoff = time.time() - max_idle_s if max_idle_s else None
+    with open(tmp, "wb") as f:
+        f.write(b"\0" * _HEADER.size)
+        offset = _HEADER.size
+        for session_id, data, last_active in records:
+            f.write(data)
+            index.append((_key(session_id), offset, len(data), last_active))
+            offset += len(data)
+        if carried is not None:
+            for i in range(carried.count):
+                key, start, length, last_active = carried.entry(i)
+                if i in skip or (cutoff is not None and last_active < cutoff):
+                    continue
+                f.write(carried.map[start:start + length])
+                index.append((key, offset, length, last_active))
+                offset += length
+                copied += 1
+        index.sort()
+        f.write(b"".join(_ENTRY.pack(*entry) for entry in index))
+        f.seek(0)
+        f.write(_HEADER.pack(MAGIC, VERSION, len(index), offset))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return {"sessions": len(index), "carried": copied, "bytes": os.path.getsize(path)}
+
+
+class RestoringDict(dict):
+    """
+    dict that asks ``restore`` for keys it does not hold yet.
+
+    ``in``, ``[]`` and ``get`` restore on a miss; iteration and ``len``
+    only see what is live.
+    """
+
+    def __init__(self, restore: Callable[[str], bool]):
+        super().__init__()
+        self._restore = restore
+
+    def __missing__(self, key):
+        if isinstance(key, str) and self._restore(key) and dict.__contains__(self, key):
+            return dict.__getitem__(self, key)
+        raise KeyError(key)
+
+    def __contains__(self, key) -> bool:
+        return dict.__contains__(self, key) or (
+            isinstance(key, str) and self._restore(key) and dict.__contains__(self, key)
+        )
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+
+class SessionStore:
+    """
+    The API's ``sessions`` and ``agents`` maps plus their snapshot.
+
+    A session restored from the snapshot appears in both maps at once,
+    sharing one transcript, exactly as ``/session/create`` stores it.
+    """
+
+    def __init__(self):
+        self.sessions: Dict[str, dict] = RestoringDict(self.restore)
+        self.agents: Dict[str, StudyMateAgent] = RestoringDict(self.restore)
+        self.snapshot: Optional[SessionSnapshot] = None
+        self.stats = {"available": 0, "restored": 0}
+        self._restored = set()
+        self._lock = threading.Lock()
+
+    def open(self, path: str) -> int:
+        """Maps a snapshot for lazy restores; returns how many sessions it holds."""
+        if not path or not os.path.exists(path):
+            return 0
+        try:
+            snapshot = SessionSnapshot(path)
+        except (OSError, ValueError) as e:
+            print(f"❌ Ignoring session snapshot {path}: {str(e)}")
+            return 0
+        with self._lock:
+            if self.snapshot is not None:
+                self.snapshot.close()
+            self.snapshot = snapshot
+            self._restored = set()
+            self.stats = {"available": snapshot.count, "restored": 0}
+        return snapshot.count
+
+    def restore(self, session_id: str) -> bool:
+        """Decodes one session from the snapshot into the live maps."""
+        snapshot = self.snapshot
+        if snapshot is None:
+            return False
+        with self._lock:
+            if dict.__contains__(self.sessions, session_id):
+                return True
+            i = snapshot.find(session_id)
+            if i is None or i in self._restored:
+                return False
+            session, agent = decode_session(snapshot.record(i))
+            if session.get("id", session_id) != session_id:
+                # SHA-1 prefix collision
+                return False
+            self._restored.add(i)
+            dict.__setitem__(self.sessions, session_id, session)
+            if agent is not None:
+                dict.__setitem__(self.agents, session_id, agent)
+            self.stats["restored"] += 1
+        return True
+
+    def save(self, path: str, max_idle_s: Optional[float] = None) -> dict:
+        """Snapshots live sessions plus every not-yet-restored one from the mapped file."""
+        with self._lock:
+            live = list(dict.items(self.sessions))
+            skip = set(self._restored)
+            if self.snapshot is not None:
+                # Live sessions replace their snapshot entries
+                for session_id, _ in live:
+                    i = self.snapshot.find(session_id)
+                    if i is not None:
+                        skip.add(i)
+            records = (
+                (session_id, encode_session(session, dict.get(self.agents, session_id)),
+                 session["messages"].last_timestamp)
+                for session_id, session in live
+            )
+            return write_snapshot(path, records, self.snapshot, frozenset(skip), max_idle_s)
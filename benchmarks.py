@@ -0,0 +1,767 @@
+"""
+Benchmark script for StudyMate
+
+Runs offline - no OpenAI calls are made.
+
+Usage:
+    python benchmarks.py            # run every benchmark
+    python benchmarks.py history    # run a single benchmark
+    python benchmarks.py tools --sizes 100,1000 --out tools.json
+    python benchmarks.py tools --languages py=0.8,md=0.2
+    python benchmarks.py --compare before.json after.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+# The agent module builds an OpenAI client at import time
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+
+# The API writes a session snapshot on shutdown; keep benchmark sessions
+# out of the real one (and the real one out of the benchmarks)
+_snapshot_dir = tempfile.TemporaryDirectory()
+os.environ["STUDYMATE_SNAPSHOT_PATH"] = os.path.join(_snapshot_dir.name, "sessions.snap")
+
+
+def _timeit(fn, repeat: int = 20) -> float:
+    """Returns the median wall time of ``fn`` in milliseconds."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return samples[len(samples) // 2]
+
+
+def bench_history(n_messages: int = 10_000):
+    """Full history dump vs. paginated and delta history queries."""
+    from fastapi.testclient import TestClient
+    from api.main import app, sessions
+    from agent.transcript import Transcript
+
+    print("=" * 60)
+    print(f"HISTORY: {n_messages:,} message session")
+    print("=" * 60)
+
+    session_id = "bench-history"
+    transcript = Transcript()
+    for i in range(n_messages):
+        transcript.append(
+            "user" if i % 2 else "assistant",
+            f"Message {i}: " + "lorem ipsum dolor sit amet " * 8,
+        )
+    sessions[session_id] = {"id": session_id, "messages": transcript}
+    client = TestClient(app)
+    url = f"/session/{session_id}/history"
+
+    # Previous behaviour: the whole transcript through the stdlib encoder
+    messages = transcript.page()
+    legacy = lambda: json.dumps({"session_id": session_id, "messages": messages}).encode()
+    print(f"   {'legacy full dump':<20} {len(legacy()):>10,} bytes   {_timeit(legacy):8.2f} ms (encode only)")
+
+    etag = client.get(url).headers["etag"]
+    cases = {
+        "page (limit=1000)": lambda: client.get(url, params={"limit": 1000}),
+        "page (limit=100)": lambda: client.get(url, params={"cursor": 5_000}),
+        "delta (since=n-2)": lambda: client.get(url, params={"since": n_messages - 2}),
+        "not modified (304)": lambda: client.get(url, headers={"If-None-Match": etag}),
+    }
+
+    for name, call in cases.items():
+        size = len(call().content)
+        latency = _timeit(call)
+        print(f"   {name:<20} {size:>10,} bytes   {latency:8.2f} ms")
+
+    del sessions[session_id]
+    print()
+
+
+def bench_transcript(n_sessions: int = 100_000, turns: int = 20):
+    """Per-turn dicts + LangChain messages vs. the shared Transcript."""
+    import tracemalloc
+    from langchain_core.messages import AIMessage, HumanMessage
+    from agent.transcript import Transcript
+
+    print("=" * 60)
+    print(f"TRANSCRIPT MEMORY: {n_sessions:,} sessions x {turns} turns")
+    print("=" * 60)
+
+    # Message text is identical in both layouts, so allocate it up front
+    contents = [f"turn {i} " + "x" * 80 for i in range(turns)]
+    roles = ["user" if i % 2 == 0 else "assistant" for i in range(turns)]
+
+    def legacy():
+        sessions = []
+        for _ in range(n_sessions):
+            messages, history = [], []
+            for role, content in zip(roles, contents):
+                messages.append({"role": role, "content": content, "timestamp": datetime.now().isoformat()})
+                history.append(HumanMessage(content=content) if role == "user" else AIMessage(content=content))
+            sessions.append((messages, history))
+        return sessions
+
+    def compact():
+        sessions = []
+        for _ in range(n_sessions):
+            transcript = Transcript()
+            for role, content in zip(roles, contents):
+                transcript.append(role, content)
+            sessions.append(transcript)
+        return sessions
+
+    for name, build in (("dicts + messages", legacy), ("Transcript", compact)):
+        tracemalloc.start()
+        start = time.perf_counter()
+        data = build()
+        elapsed = time.perf_counter() - start
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        per_turn = current / (n_sessions * turns)
+        print(f"   {name:<18} {current / 2**20:10.1f} MiB   {per_turn:6.1f} B/turn   {elapsed:6.2f} s")
+        del data
+    print()
+
+
+# Language mix of generated repositories: extension -> share of files
+DEFAULT_LANGUAGES = {".py": 0.5, ".js": 0.3, ".md": 0.2}
+
+# Concept planted in roughly one file in 50 of a generated repository
+SYNTHETIC_CONCEPT = "gradient_descent"
+
+
+def _synthetic_line(rng: random.Random, ext: str, i: int) -> str:
+    name = f"value_{rng.randrange(10_000)}"
+    if ext == ".py":
+        return f"    {name} = compute({name}, step={i})\n" if i % 8 else f"def handler_{i}(data):\n"
+    if ext == ".js":
+        return f"  const {name} = compute({name}, {i});\n" if i % 8 else f"function handler{i}(data) {{\n"
+    return f"Notes on {name}: step {i} of the pipeline.\n" if i % 8 else f"## Section {i}\n"
+
+
+def _make_repo(root: str, n_files: int = 2_000, file_lines: int = 200, languages: dict = None,
+               depth: int = 3, imports: int = 0, seed: int = 0) -> dict:
+    """
+    Writes a deterministic synthetic repository.
+
+    The same arguments always produce byte-identical files, so runs on
+    different machines or commits are comparable.
+
+    Args:
+        root: Directory to write into
+        n_files: Number of source files (a README and requirements.txt are added)
+        file_lines: Mean lines per file (actual sizes vary +-50%)
+        languages: Extension -> share of files (defaults to DEFAULT_LANGUAGES)
+        depth: Directory nesting below the root
+        imports: Python files import up to this many earlier Python files
+            and call into them (for the code graph)
+        seed: Random seed
+
+    Returns:
+        {"files", "bytes", "concept_files", "sample_file", "modules"} for
+        the generated tree, ``modules`` being the Python module names in
+        the order they were written
+    """
+    rng = random.Random(seed)
+    # Separate stream so adding imports leaves the rest of the tree unchanged
+    deps_rng = random.Random(seed + 1)
+    languages = languages or DEFAULT_LANGUAGES
+    exts, weights = list(languages), list(languages.values())
+    fanout = max(int(round(n_files ** (1 / max(depth, 1)) / 2)), 2)
+    written = concept_files = 0
+    sample = None
+    modules = []
+
+    for i in range(n_files):
+        parts = [f"d{rng.randrange(fanout)}" for _ in range(depth)]
+        directory = os.path.join(root, *parts)
+        os.makedirs(directory, exist_ok=True)
+        ext = rng.choices(exts, weights)[0]
+        n_lines = max(int(file_lines * rng.uniform(0.5, 1.5)), 1)
+        body = "".join(_synthetic_line(rng, ext, j) for j in range(n_lines))
+        if ext == ".py" and n_lines % 8 == 1:
+            # Never end on a function without a body
+            body += "    return data\n"
+        if rng.random() < 0.02:
+            body += f"def {SYNTHETIC_CONCEPT}(params, lr):\n    return params\n"
+            concept_files += 1
+        if ext == ".py":
+            deps = sorted(set(deps_rng.randrange(len(modules)) for _ in range(imports))) if modules else []
+            body = "".join(f"import {modules[d]} as dep{d}\n" for d in deps) + body
+            body += "".join(f"def use_{k}(data):\n    return dep{d}.handler_0(data)\n" for k, d in enumerate(deps))
+            modules.append(".".join(parts + [f"file{i}"]))
+        path = os.path.join(directory, f"file{i}{ext}")
+        with open(path, "w") as f:
+            f.write(body)
+        written += len(body)
+        if sample is None and n_lines >= 40:
+            sample = path
+
+    for name, body in (("README.md", "# Synthetic repository\n"), ("requirements.txt", "numpy\n")):
+        with open(os.path.join(root, name), "w") as f:
+            f.write(body)
+    return {"files": n_files + 2, "bytes": written, "concept_files": concept_files, "sample_file": sample,
+            "modules": modules}
+
+
+def _parse_languages(spec: str) -> dict:
+    """Parses "py=0.5,js=0.3,md=0.2" into an extension -> share mapping."""
+    languages = {}
+    for item in spec.split(","):
+        ext, _, share = item.partition("=")
+        languages["." + ext.strip().lstrip(".")] = float(share or 1)
+    return languages
+
+
+def _legacy_search(query: str, repo_path: str) -> list:
+    """The original search_repo_concept loop (read whole .py files, stop at 3)."""
+    results = []
+    query_lower = query.lower()
+    for root, dirs, files in os.walk(repo_path):
+        dirs[:] = [d for d in dirs if not d.startswith('.')]
+        for file in files:
+            if file.endswith('.py'):
+                file_path = os.path.join(root, file)
+                try:
+                    with open(file_path, 'r', encoding='utf-8') as f:
+                        content = f.read()
+                        if query_lower in content.lower():
+                            lines = content.split('\n')
+                            for i, line in enumerate(lines):
+                                if query_lower in line.lower():
+                                    results.append({"file": file_path, "line": i + 1})
+                                    break
+                except:
+                    continue
+        if len(results) >= 3:
+            break
+    return results
+
+
+def bench_search(n_files: int = 2_000):
+    """
+    Original search loop vs. the streaming search engine.
+
+    The original loop only reads .py files, so the repository holds
+    nothing else and both engines scan the same files.
+    """
+    import tempfile
+    from agent.search import search_repo
+
+    print("=" * 60)
+    print(f"SEARCH: {n_files:,} file synthetic repo")
+    print("=" * 60)
+
+    with tempfile.TemporaryDirectory() as root:
+        _make_repo(root, n_files, languages={".py": 1.0})
+        cases = {
+            "legacy, first 3": lambda: _legacy_search("gradient_descent", root),
+            "stream, first 3": lambda: list(search_repo(root, "gradient_descent", max_results=3)),
+            "stream, all hits": lambda: list(search_repo(root, "gradient_descent", max_results=10**6)),
+            "stream, regex": lambda: list(search_repo(root, r"def \w+_descent", "regex", max_results=10**6)),
+            "legacy, no match": lambda: _legacy_search("not_in_repo", root),
+            "stream, no match": lambda: list(search_repo(root, "not_in_repo")),
+            # Every letter of the term occurs in every file: no file is ruled out early
+            "legacy, near miss": lambda: _legacy_search("compute_value", root),
+            "stream, near miss": lambda: list(search_repo(root, "compute_value")),
+        }
+        for name, call in cases.items():
+            hits = len(call())
+            print(f"   {name:<18} {hits:>5} hits   {_timeit(call, repeat=5):8.2f} ms")
+    print()
+
+
+def bench_retrieval(n_files: int = 2_000):
+    """Index build, query latency and injected prompt size."""
+    import tempfile
+    from agent import retrieval
+
+    print("=" * 60)
+    print(f"RETRIEVAL: {n_files:,} file synthetic repo")
+    print("=" * 60)
+
+    with tempfile.TemporaryDirectory() as root:
+        _make_repo(root, n_files)
+        start = time.perf_counter()
+        index = retrieval.RepoIndex.build(root)
+        build_s = time.perf_counter() - start
+        print(f"   build              {len(index):>7,} chunks   {build_s:8.2f} s")
+
+        index_file = os.path.join(root, "index.npz")
+        index.save(index_file)
+        load_ms = _timeit(lambda: retrieval.RepoIndex.load(index_file), repeat=5)
+        print(f"   load               {os.path.getsize(index_file) / 2**20:7.1f} MiB   {load_ms:8.2f} ms")
+
+        question = "how does gradient descent update the params?"
+        query_ms = _timeit(lambda: index.query(question, k=8))
+        print(f"   query (k=8)                       {query_ms:8.2f} ms")
+
+        context = index.context_for(question, token_budget=1500)
+        hit_files = {hit["file"] for hit in index.query(question, k=8)}
+        pasted = sum(os.path.getsize(os.path.join(root, f)) for f in hit_files)
+        print(f"   prompt context     {len(context) // retrieval.CHARS_PER_TOKEN:>7,} tokens (budget 1500)")
+        print(f"   pasting hit files  {pasted // retrieval.CHARS_PER_TOKEN:>7,} tokens")
+    print()
+
+
+def bench_transport(turns: int = 300):
+    """
+    Per-turn overhead of POST /chat vs. the session WebSocket over a real socket.
+
+    /chat runs ``teach`` and the WebSocket ``teach_stream``, so each
+    transport's overhead is its time per turn minus the same agent call
+    made in-process.
+    """
+    import itertools
+    import threading
+    import httpx
+    import uvicorn
+    from websockets.sync.client import connect
+    from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+    from langchain_core.messages import AIMessage
+    from api.main import app, sessions, agents
+    from agent import StudyMateAgent
+
+    print("=" * 60)
+    print(f"TRANSPORT: {turns} turns, stub model streaming ~12 tokens")
+    print("=" * 60)
+
+    reply = "Good question! What do you think happens when that function returns?"
+    session_id = "bench-transport"
+    agent = StudyMateAgent(repo_path=None)
+    agent.llm = GenericFakeChatModel(messages=itertools.cycle([AIMessage(content=reply)]))
+    agents[session_id] = agent
+    sessions[session_id] = {"id": session_id, "messages": agent.transcript}
+
+    def in_process(call) -> float:
+        start = time.perf_counter()
+        for i in range(turns):
+            call(f"question {i}")
+        return (time.perf_counter() - start) / turns
+
+    teach_s = in_process(lambda message: agent.teach(message, session_id=session_id))
+    stream_s = in_process(lambda message: list(agent.teach_stream(message, session_id=session_id)))
+
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=0, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    port = server.servers[0].sockets[0].getsockname()[1]
+
+    with httpx.Client(base_url=f"http://127.0.0.1:{port}") as http:
+        start = time.perf_counter()
+        for i in range(turns):
+            http.post("/chat", json={"session_id": session_id, "message": f"question {i}"})
+        http_s = (time.perf_counter() - start) / turns
+
+    frames = 0
+    with connect(f"ws://127.0.0.1:{port}/ws/session/{session_id}") as ws:
+        ws.recv()
+        start = time.perf_counter()
+        for i in range(turns):
+            ws.send(json.dumps({"type": "message", "message": f"question {i}"}))
+            while True:
+                frames += 1
+                if json.loads(ws.recv())["type"] == "done":
+                    break
+        ws_s = (time.perf_counter() - start) / turns
+
+    server.should_exit = True
+    thread.join()
+
+    rows = (("HTTP POST /chat", http_s, teach_s), ("WebSocket", ws_s, stream_s))
+    for name, per_turn, agent_s in rows:
+        print(f"   {name:<18} {1 / per_turn:8.1f} msg/s   {per_turn * 1000:7.2f} ms/turn"
+              f"   overhead {(per_turn - agent_s) * 1000:6.2f} ms (agent {agent_s * 1000:.2f} ms)")
+    difference = (ws_s - stream_s) - (http_s - teach_s)
+    print(f"   {'WebSocket - HTTP':<18} {difference * 1000:+8.2f} ms/turn overhead")
+    print(f"   WebSocket frames   {frames / turns:8.1f} per turn (tokens + done)")
+
+    del agents[session_id], sessions[session_id]
+    print()
+
+
+def bench_analytics(n_events: int = 1_000_000, n_sessions: int = 20_000, n_concepts: int = 200):
+    """Columnar analytics store vs. aggregating the per-session progress dicts."""
+    import random
+    from agent.analytics import AnalyticsStore, MASTERY_LEVELS
+
+    print("=" * 60)
+    print(f"ANALYTICS: {n_events:,} events, {n_sessions:,} sessions, {n_concepts} concepts")
+    print("=" * 60)
+
+    rng = random.Random(0)
+    start_ts = time.time() - 30 * 86400
+    events = [
+        (f"session-{rng.randrange(n_sessions)}", f"Concept {rng.randrange(n_concepts)}",
+         MASTERY_LEVELS[rng.randrange(4)], start_ts + i * 2.5)
+        for i in range(n_events)
+    ]
+
+    store = AnalyticsStore()
+    start = time.perf_counter()
+    for i in range(0, n_events, 10_000):
+        batch = events[i:i + 10_000]
+        store.extend(*(list(column) for column in zip(*batch)))
+    print(f"   {'ingest':<24} {time.perf_counter() - start:8.2f} s")
+
+    # Previous approach: walk every session's concepts_covered list
+    progress = {}
+    for session_id, concept, mastery, ts in events:
+        progress.setdefault(session_id, []).append({"concept": concept, "mastery": mastery, "timestamp": ts})
+
+    def legacy_mastery():
+        counts = {}
+        for covered in progress.values():
+            for event in covered:
+                by_level = counts.setdefault(event["concept"].lower(), dict.fromkeys(MASTERY_LEVELS, 0))
+                by_level[event["mastery"]] += 1
+        return counts
+
+    cases = {
+        "legacy mastery (dicts)": legacy_mastery,
+        "mastery (all events)": lambda: store.mastery_distribution(latest=False),
+        "mastery (latest)": lambda: store.mastery_distribution(latest=True),
+        "weak concepts": lambda: store.weak_concepts(limit=10),
+        "activity (day)": lambda: store.activity(bucket_s=86400),
+    }
+    for name, call in cases.items():
+        print(f"   {name:<24} {_timeit(call, repeat=5):8.2f} ms")
+    columns = sum(a.nbytes for a in (store._session, store._concept, store._mastery, store._ts))
+    print(f"   {'column memory':<24} {columns / 2**20:8.1f} MiB (capacity {len(store._ts):,})")
+    print()
+
+
+def bench_snapshot(n_sessions: int = 50_000, turns: int = 20):
+    """Shutdown snapshot and lazy startup restore vs. eagerly decoding every session."""
+    import tempfile
+    from agent import StudyMateAgent
+    from agent.transcript import Transcript
+    from api.snapshot import SessionSnapshot, SessionStore, decode_session
+
+    print("=" * 60)
+    print(f"SNAPSHOT: {n_sessions:,} sessions x {turns} turns")
+    print("=" * 60)
+
+    store = SessionStore()
+    for i in range(n_sessions):
+        session_id = f"session-{i:06d}"
+        transcript = Transcript()
+        for turn in range(turns):
+            transcript.append("user" if turn % 2 == 0 else "assistant",
+                              f"Turn {turn} of {session_id}: " + "explain the training loop " * 6)
+        agent = StudyMateAgent(repo_path=None, transcript=transcript)
+        agent.session_id = session_id
+        agent.active_concept = f"Concept {i % 200}"
+        dict.__setitem__(store.agents, session_id, agent)
+        dict.__setitem__(store.sessions, session_id, {
+            "id": session_id, "github_url": "https://github.com/example/repo",
+            "student_name": "Student", "knowledge_level": "intermediate",
+            "created_at": "2026-01-01T00:00:00", "messages": transcript,
+        })
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "sessions.snap")
+        start = time.perf_counter()
+        stats = store.save(path)
+        print(f"   {'shutdown (write)':<24} {time.perf_counter() - start:8.2f} s   {stats['bytes'] / 2**20:.1f} MiB")
+
+        start = time.perf_counter()
+        restored = SessionStore()
+        restored.open(path)
+        print(f"   {'startup (lazy open)':<24} {(time.perf_counter() - start) * 1000:8.2f} ms")
+
+        ids = [f"session-{i:06d}" for i in range(0, n_sessions, max(n_sessions // 1000, 1))]
+        start = time.perf_counter()
+        for session_id in ids:
+            assert session_id in restored.agents
+        print(f"   {'first access':<24} {(time.perf_counter() - start) / len(ids) * 1e6:8.1f} us/session")
+
+        start = time.perf_counter()
+        restored.save(path)
+        print(f"   {'shutdown after restart':<24} {time.perf_counter() - start:8.2f} s   "
+              f"({len(ids):,} restored, rest copied raw)")
+        restored.snapshot.close()
+
+        # Eager alternative: decode every session before serving
+        snapshot = SessionSnapshot(path)
+        start = time.perf_counter()
+        for i in range(snapshot.count):
+            decode_session(snapshot.record(i))
+        print(f"   {'startup (eager decode)':<24} {time.perf_counter() - start:8.2f} s")
+        snapshot.close()
+    print()
+
+
+# Audit events that stand for a file-system syscall (open, directory listing)
+_AUDITED_EVENTS = {"open", "os.scandir", "os.listdir"}
+_audit_counts = {"events": 0, "enabled": False}
+
+
+def _audit_hook(event, args):
+    if _audit_counts["enabled"] and event in _AUDITED_EVENTS:
+        _audit_counts["events"] += 1
+
+
+def _proc_syscalls() -> int:
+    """Read + write syscalls of this process so far (0 where /proc/self/io is missing)."""
+    try:
+        with open("/proc/self/io") as f:
+            fields = dict(line.split(": ") for line in f.read().splitlines())
+        return int(fields["syscr"]) + int(fields["syscw"])
+    except (OSError, KeyError, ValueError):
+        return 0
+
+
+def _measure_tool(call, repeat: int) -> dict:
+    """Median/p95 time, tracemalloc peak and syscalls for one tool call."""
+    import tracemalloc
+
+    call()  # warm-up: imports, page cache
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        call()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+
+    tracemalloc.start()
+    call()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    # Reading /proc/self/io costs syscalls of its own; measure that and subtract
+    probe = _proc_syscalls()
+    probe = _proc_syscalls() - probe
+    _audit_counts["events"] = 0
+    before = _proc_syscalls()
+    # Audited only around the call: the probes' own opens are not counted
+    _audit_counts["enabled"] = True
+    call()
+    _audit_counts["enabled"] = False
+    io = max(_proc_syscalls() - before - probe, 0)
+
+    return {
+        "time_ms": round(statistics.median(samples), 4),
+        "p95_ms": round(samples[int(0.95 * (len(samples) - 1))], 4),
+        "peak_kib": round(peak / 1024, 1),
+        "syscalls": io + _audit_counts["events"],
+    }
+
+
+def bench_tools(sizes=(100, 1_000, 5_000), depth: int = 3, file_lines: int = 200, languages: dict = None,
+                repeat: int = 20, out: str = None, seed: int = 0) -> dict:
+    """
+    Agent tools on generated repositories of increasing size.
+
+    Calls each tool's underlying function (``.func``) directly, so the
+    numbers exclude LangChain's argument validation. Syscalls are the
+    process's read/write syscalls (/proc/self/io) plus audited opens and
+    directory listings; stat calls are not counted.
+    """
+    import tempfile
+    import agent.tools as tools
+
+    print("=" * 60)
+    languages = languages or DEFAULT_LANGUAGES
+    mix = ", ".join(f"{ext} {share:g}" for ext, share in languages.items())
+    print(f"TOOLS: sizes {', '.join(f'{n:,}' for n in sizes)} files, depth {depth}, {mix}")
+    print("=" * 60)
+
+    sys.addaudithook(_audit_hook)
+    results = []
+    cwd = os.getcwd()
+    for n_files in sizes:
+        with tempfile.TemporaryDirectory() as root, tempfile.TemporaryDirectory() as workdir:
+            repo = _make_repo(root, n_files, file_lines, languages, depth, seed=seed)
+            # track_learning_progress writes under ./data/progress
+            os.chdir(workdir)
+            try:
+                cases = {
+                    "analyze_repo_structure": lambda: tools.analyze_repo_structure.func(root),
+                    "search_repo_concept (hit)": lambda: tools.search_repo_concept.func(SYNTHETIC_CONCEPT, root),
+                    "search_repo_concept (miss)": lambda: tools.search_repo_concept.func("not_in_repo", root),
+                    "extract_code_snippet": lambda: tools.extract_code_snippet.func(repo["sample_file"], 10, 40),
+                    "track_learning_progress": lambda: tools.track_learning_progress.func(
+                        f"bench-{n_files}", "recursion", "good"),
+                }
+                for name, call in cases.items():
+                    row = {"tool": name, "files": n_files, "repo_bytes": repo["bytes"], **_measure_tool(call, repeat)}
+                    results.append(row)
+                    print(f"   {name:<28} {n_files:>6,} files   {row['time_ms']:9.3f} ms   "
+                          f"{row['peak_kib']:9.1f} KiB   {row['syscalls']:>7,} syscalls")
+            finally:
+                os.chdir(cwd)
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "depth": depth, "file_lines": file_lines, "languages": languages, "repeat": repeat, "seed": seed,
+        },
+        "results": results,
+    }
+    if out:
+        with open(out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"   results written to {out}")
+    print()
+    return report
+
+
+def compare_results(base_path: str, new_path: str, threshold: float = 0.10):
+    """
+    Prints per tool/size changes between two ``bench_tools`` result files.
+
+    Rows whose peak memory or syscalls grew by more than ``threshold``
+    are flagged; time only when the new median is above the base run's
+    p95 by more than ``threshold``, so timer noise is not reported.
+    """
+    with open(base_path) as f:
+        base = {(r["tool"], r["files"]): r for r in json.load(f)["results"]}
+    with open(new_path) as f:
+        new = {(r["tool"], r["files"]): r for r in json.load(f)["results"]}
+
+    print("=" * 60)
+    print(f"COMPARE: {base_path} -> {new_path}")
+    print("=" * 60)
+    regressions = 0
+    for key in sorted(base.keys() & new.keys(), key=lambda k: (k[0], k[1])):
+        old, cur = base[key], new[key]
+        changes, flagged = [], False
+        for metric in ("time_ms", "peak_kib", "syscalls"):
+            ratio = cur[metric] / old[metric] if old[metric] else (1.0 if not cur[metric] else float("inf"))
+            changes.append(f"{metric} x{ratio:5.2f}")
+            limit = old["p95_ms"] if metric == "time_ms" else old[metric]
+            flagged = flagged or cur[metric] > limit * (1 + threshold)
+        regressions += flagged
+        print(f"   {'!' if flagged else ' '} {key[0]:<28} {key[1]:>6,}   " + "   ".join(changes))
+    for key in sorted(base.keys() ^ new.keys()):
+        print(f"     {key[0]:<28} {key[1]:>6,}   only in {'base' if key in base else 'new'}")
+    print(f"   {regressions} regression(s) above {threshold:.0%}")
+    print()
+    return regressions
+
+
+def bench_codegraph(n_modules: int = 2_000, file_lines: int = 80):
+    """
+    Call/import graph build, incremental update and queries vs. substring search.
+
+    The graph tools are also timed end to end (``.func``, including
+    get_graph), once with the graph re-checked against the files on every
+    call and once within INDEX_CHECK_S of the last check.
+    """
+    import tempfile
+    from agent import codegraph, retrieval, tools
+    from agent.codegraph import CodeGraph
+    from agent.tools import search_repo_concept
+
+    print("=" * 60)
+    print(f"CODE GRAPH: {n_modules:,} modules x ~{file_lines // 8} functions")
+    print("=" * 60)
+
+    with tempfile.TemporaryDirectory() as root:
+        modules = _make_repo(root, n_modules, file_lines, languages={".py": 1.0}, imports=3)["modules"]
+
+        start = time.perf_counter()
+        graph = CodeGraph.build(root)
+        print(f"   {'build':<28} {time.perf_counter() - start:8.2f} s   "
+              f"{len(graph):,} nodes, {graph.edge_counts['calls']:,} call edges")
+        arrays = sum(a.nbytes for g in (graph.imports, graph.imported_by, graph.calls, graph.called_by) for a in g)
+        print(f"   {'adjacency arrays':<28} {arrays / 2**20:8.2f} MiB")
+
+        changed = modules[n_modules // 2].replace(".", os.sep) + ".py"
+        path = os.path.join(root, changed)
+        edits = {
+            "update (body edit)": lambda text: text.replace("= compute(", "= handler_0(", 1),
+            "update (new function)": lambda text: text + "def added(data):\n    return handler_0(data)\n",
+        }
+        for name, edit in edits.items():
+            with open(path) as fh:
+                text = fh.read()
+            with open(path, "w") as fh:
+                fh.write(edit(text))
+            start = time.perf_counter()
+            graph = graph.updated([changed])
+            print(f"   {name:<28} {(time.perf_counter() - start) * 1000:8.2f} ms")
+
+        target = modules[n_modules // 3]
+        cases = {
+            "callers": lambda: graph.callers(f"{target}.handler_0"),
+            "callees": lambda: graph.callees(f"{modules[-1]}.use_0"),
+            "importers": lambda: graph.dependencies(target, reverse=True),
+            "import path": lambda: graph.path(modules[-1], modules[0]),
+            "substring search (legacy)": lambda: search_repo_concept.func(target, root),
+        }
+        for name, call in cases.items():
+            print(f"   {name:<28} {_timeit(call, repeat=5):8.3f} ms")
+
+        start = time.perf_counter()
+        codegraph.get_graph(root)
+        print(f"   {'get_graph (first call)':<28} {time.perf_counter() - start:8.2f} s")
+        tool_cases = {
+            "find_callers": lambda: tools.find_callers.func(f"{target}.handler_0", root),
+            "find_callees": lambda: tools.find_callees.func(f"{modules[-1]}.use_0", root),
+            "module_dependencies": lambda: tools.module_dependencies.func(target, root),
+            "find_dependency_path": lambda: tools.find_dependency_path.func(modules[-1], modules[0], root),
+        }
+        saved = retrieval.INDEX_CHECK_S
+        try:
+            for label, check_s in (("re-checked", 0), ("throttled", 3600)):
+                retrieval.INDEX_CHECK_S = check_s
+                for name, call in tool_cases.items():
+                    print(f"   {f'{name} ({label})':<34} {_timeit(call, repeat=5):8.3f} ms")
+        finally:
+            retrieval.INDEX_CHECK_S = saved
+            codegraph._graphs.pop(os.path.abspath(root), None)
+    print()
+
+
+BENCHMARKS = {
+    "history": bench_history,
+    "transcript": bench_transcript,
+    "search": bench_search,
+    "retrieval": bench_retrieval,
+    "transport": bench_transport,
+    "analytics": bench_analytics,
+    "snapshot": bench_snapshot,
+    "tools": bench_tools,
+    "codegraph": bench_codegraph,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="StudyMate benchmarks")
+    parser.add_argument("names", nargs="*", metavar="name",
+                        help=f"benchmarks to run (default: all of {', '.join(BENCHMARKS)})")
+    parser.add_argument("--sizes", default="100,1000,5000", help="tools: comma-separated file counts")
+    parser.add_argument("--depth", type=int, default=3, help="tools: directory depth")
+    parser.add_argument("--file-lines", type=int, default=200, help="tools: mean lines per file")
+    parser.add_argument("--languages", type=_parse_languages, default=None,
+                        help="tools: extension shares, e.g. py=0.5,js=0.3,md=0.2")
+    parser.add_argument("--out", help="tools: JSON results file")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"), help="compare two tools result files")
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare_results(*args.compare) else 0)
+    unknown = set(args.names) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmark(s): {', '.join(sorted(unknown))}")
+    for name in args.names or list(BENCHMARKS):
+        if name == "tools":
+            sizes = tuple(int(n) for n in args.sizes.split(","))
+            bench_tools(sizes, depth=args.depth, file_lines=args.file_lines, languages=args.languages,
+                        out=args.out)
+        else:
+            BENCHMARKS[name]()
@@ -5,21 +5,35 @@ Test script for StudyMates Agent
 from agent import StudyMateAgent
 from dotenv import load_dotenv
 import os
+import json
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 
 # Load environment variables
 load_dotenv()
 
+# The API writes a session snapshot on shutdown; keep test sessions out of
+# the real one (and the real one out of the tests)
+_snapshot_dir = tempfile.TemporaryDirectory()
+os.environ["STUDYMATE_SNAPSHOT_PATH"] = os.path.join(_snapshot_dir.name, "sessions.snap")
+
 def test_agent():
     """Test the agent with a simple conversation."""
     
     print("🧪 Testing StudyMates Agent...\n")
     
-    # Check OpenAI key is set
-    if not os.getenv("OPENAI_API_KEY"):
+    # Check OpenAI key is set (a cassette replays recorded calls without one)
+    if not os.getenv("OPENAI_API_KEY") and not os.getenv("STUDYMATE_CASSETTE"):
         print("❌ Error: OPENAI_API_KEY not set in .env file!")
         return
     
-    print("✅ OpenAI key found")
+    if os.getenv("STUDYMATE_CASSETTE"):
+        print(f"📼 Using cassette {os.getenv('STUDYMATE_CASSETTE')} "
+              f"({os.getenv('STUDYMATE_CASSETTE_MODE', 'replay')})")
+    else:
+        print("✅ OpenAI key found")
     
     # Initialize agent (without repo for now)
     print("🔧 Initializing agent...")
@@ -50,5 +64,1265 @@ def test_agent():
     
     print("✅ Agent test complete!")
 
+class StubModel:
+    """Stands in for ChatOpenAI: counts calls and echoes the subject line of the prompt."""
+    
+    def __init__(self):
+        self.calls = 0
+    
+    def invoke(self, prompt):
+        self.calls += 1
+        return f"{prompt.splitlines()[2]} (call {self.calls})"
+
+
+def test_summaries_with_stub_model():
+    """Summaries are built bottom-up and only changed files are resummarized."""
+    from agent import summaries
+    from agent.watcher import unwatch
+    
+    default_dir = summaries.SUMMARY_DIR
+    # Found wherever the CLI or the API is started from
+    assert os.path.isabs(default_dir)
+    with tempfile.TemporaryDirectory() as repo, tempfile.TemporaryDirectory() as cache:
+        summaries.SUMMARY_DIR = cache
+        try:
+            os.makedirs(os.path.join(repo, "pkg", "sub"))
+            for rel in ["main.py", "pkg/a.py", "pkg/sub/b.py", "pkg/sub/c.py"]:
+                with open(os.path.join(repo, rel), "w") as f:
+                    f.write(f"# {rel}\n")
+            
+            model = StubModel()
+            result = summaries.build_summaries(repo, llm=model)
+            # 4 files + pkg/sub + pkg + root
+            assert model.calls == 7
+            assert set(result["dirs"]) == {"", "pkg", "pkg/sub"}
+            
+            model.calls = 0
+            summaries.build_summaries(repo, llm=model)
+            assert model.calls == 0
+            
+            with open(os.path.join(repo, "pkg", "sub", "b.py"), "w") as f:
+                f.write("# changed\n")
+            summaries.build_summaries(repo, llm=model)
+            # b.py + its three ancestor directories
+            assert model.calls == 4
+            
+            # Served from the cache, no model involved
+            assert summaries.get_summary(repo, "pkg/a.py").startswith("File: pkg/a.py")
+            with StubOpenAIServer() as server:
+                agent = StudyMateAgent(repo_path=repo)
+                described = agent.describe("what does pkg/a.py do?")
+                assert "Repository overview" in described and "\npkg/a.py: " in described
+                assert "\npkg: " not in described
+                # Whole path words only, with punctuation and ./ prefixes ignored
+                assert "main.py: " not in agent.describe("what does domain.py do?")
+                described = agent.describe("Open ./pkg/sub/, then main.py.")
+                assert "\npkg/sub: " in described and "\nmain.py: " in described
+            assert not server.requests
+        finally:
+            summaries.SUMMARY_DIR = default_dir
+            unwatch(repo)
+    print("✅ Summary cache test passed")
+
+
+class StubOpenAIServer:
+    """
+    Local stand-in for the OpenAI chat completions API.
+    
+    Records every request body and reports a prompt cache hit for the
+    longest prefix shared with an earlier request (4 chars ~ 1 token).
+    ``delays`` maps model names to simulated response times in seconds.
+    Streamed requests send ``stream_chunks`` chunks ``stream_delay``
+    seconds apart and count clients that hang up early in ``aborted``.
+    """
+    
+    def __init__(self, delays: dict = None, stream_chunks: int = 3, stream_delay: float = 0.0):
+        self.requests = []
+        self.aborted = 0
+        server = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            def stream(self, body, reply, usage):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.end_headers()
+                chunk = {"id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": 0, "model": body["model"]}
+                events = [dict(chunk, choices=[{"index": 0, "delta": {"content": f"{reply} part {i}. "},
+                                                "finish_reason": None}]) for i in range(stream_chunks)]
+                events.append(dict(chunk, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}]))
+                if (body.get("stream_options") or {}).get("include_usage"):
+                    events.append(dict(chunk, choices=[], usage=usage))
+                try:
+                    for event in events:
+                        self.wfile.write(f"data: {json.dumps(event)}\n\n".encode())
+                        self.wfile.flush()
+                        time.sleep(stream_delay)
+                    self.wfile.write(b"data: [DONE]\n\n")
+                except (BrokenPipeError, ConnectionResetError):
+                    server.aborted += 1
+            
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                time.sleep((delays or {}).get(body["model"], 0))
+                prompt = json.dumps(body["messages"])
+                cached = max((len(os.path.commonprefix([prompt, json.dumps(r["messages"])]))
+                              for r in server.requests), default=0)
+                server.requests.append(body)
+                reply = f"Stub reply {len(server.requests)}"
+                usage = {
+                    "prompt_tokens": len(prompt) // 4,
+                    "completion_tokens": len(reply) // 4,
+                    "total_tokens": (len(prompt) + len(reply)) // 4,
+                    "prompt_tokens_details": {"cached_tokens": cached // 4},
+                }
+                if body.get("stream"):
+                    return self.stream(body, reply, usage)
+                payload = json.dumps({
+                    "id": "chatcmpl-stub",
+                    "object": "chat.completion",
+                    "created": 0,
+                    "model": body["model"],
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": reply}}],
+                    "usage": usage,
+                }).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+            
+            def log_message(self, *args):
+                pass
+        
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}/v1"
+    
+    def __enter__(self):
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        # The stub accepts any key
+        self._saved = {k: os.environ.get(k) for k in ("OPENAI_BASE_URL", "OPENAI_API_KEY")}
+        os.environ["OPENAI_BASE_URL"] = self.url
+        os.environ.setdefault("OPENAI_API_KEY", "sk-stub")
+        return self
+    
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        for key, value in self._saved.items():
+            if value is None:
+                os.environ.pop(key, None)
+            else:
+                os.environ[key] = value
+
+
+def test_prompt_prefix_is_stable():
+    """Consecutive turns and sessions on the same repo share a byte-identical prefix."""
+    from agent import retrieval
+    from agent.core import history_start
+    from agent.watcher import unwatch
+    
+    default_dir = retrieval.INDEX_DIR
+    with tempfile.TemporaryDirectory() as repo, tempfile.TemporaryDirectory() as cache, StubOpenAIServer() as server:
+        retrieval.INDEX_DIR = cache
+        try:
+            with open(os.path.join(repo, "train.py"), "w") as f:
+                f.write("def train(model, data):\n    return model.fit(data)\n")
+            
+            agent = StudyMateAgent(repo_path=repo)
+            agent.teach("Greet the student", record_input=False)
+            for i in range(20):
+                agent.teach(f"Question {i} about train")
+            
+            for turn in range(1, len(server.requests)):
+                previous, current = server.requests[turn - 1]["messages"], server.requests[turn]["messages"]
+                # The request's transcript length before the new input was appended
+                if history_start(2 * turn) == history_start(2 * turn - 2):
+                    assert current[:len(previous) - 1] == previous[:-1], f"prefix changed at turn {turn}"
+            
+            other = StudyMateAgent(repo_path=repo)
+            other.teach("Greet the student", record_input=False)
+            assert server.requests[-1]["messages"][0] == server.requests[0]["messages"][0]
+            
+            assert agent.cached_token_ratio > 0.5
+        finally:
+            retrieval.INDEX_DIR = default_dir
+            unwatch(repo)
+        print(f"✅ Prompt prefix test passed (cached ratio {agent.cached_token_ratio:.0%})")
+
+
+def test_cassette_record_then_replay():
+    """Calls recorded against a server replay identically once it is gone."""
+    from agent import llm
+    from agent.tools import provide_progressive_hint
+    
+    def conversation():
+        agent = StudyMateAgent(repo_path=None)
+        replies = [agent.teach("Greet the student", record_input=False)]
+        replies += [agent.teach(q) for q in ("What is a function?", "A reusable block?")]
+        replies.append(provide_progressive_hint.func("functions", 1))
+        return replies
+    
+    saved = {k: os.environ.get(k) for k in ("STUDYMATE_CASSETTE", "STUDYMATE_CASSETTE_MODE")}
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["STUDYMATE_CASSETTE"] = os.path.join(tmp, "cassette.jsonl")
+        try:
+            os.environ["STUDYMATE_CASSETTE_MODE"] = "record"
+            with StubOpenAIServer() as server:
+                recorded = conversation()
+            assert len(server.requests) == 4
+            
+            # Server is down: every reply must come from the cassette
+            os.environ["STUDYMATE_CASSETTE_MODE"] = "replay"
+            assert conversation() == recorded
+            
+            # Anything not recorded fails instead of reaching the network
+            agent = StudyMateAgent(repo_path=None)
+            assert agent.teach("Something new") == "I encountered an issue. Could you rephrase your question?"
+        finally:
+            llm._transports.clear()
+            for key, value in saved.items():
+                if value is None:
+                    os.environ.pop(key, None)
+                else:
+                    os.environ[key] = value
+    print("✅ Cassette record/replay test passed")
+
+
+def test_router_fails_over_from_slow_model():
+    """A tier breaching its p95 SLO is skipped until its cooldown ends."""
+    from agent.deadline import CancelScope, TurnCancelled, cancel_scope
+    from agent.routing import ModelRouter, RoutedChatModel
+    
+    with StubOpenAIServer(delays={"slow-model": 0.3}) as server:
+        router = ModelRouter(
+            {"quality": "slow-model", "fast": "fast-model"},
+            {"teach": "quality", "assessment": "fast"},
+            p95_slo_s=0.2,
+            cooldown_s=1.0,
+        )
+        teach = RoutedChatModel("teach", 0.7, router=router)
+        for _ in range(8):
+            teach.invoke("hi")
+        RoutedChatModel("assessment", 0.3, router=router).invoke("json please")
+        
+        models = [r["model"] for r in server.requests]
+        # 5 samples are needed before the SLO is judged
+        assert models == ["slow-model"] * 5 + ["fast-model"] * 4
+        metrics = router.metrics()
+        assert metrics["decisions"]["teach"]["fast-model"]["slo_failover"] == 3
+        assert metrics["decisions"]["assessment"]["fast-model"]["preferred"] == 1
+        assert metrics["models"]["slow-model"]["degraded"]
+        
+        # After the cooldown the preferred tier gets another chance
+        time.sleep(1.1)
+        teach.invoke("hi again")
+        assert server.requests[-1]["model"] == "slow-model"
+        
+        # Time a slow consumer spends between chunks is not model latency
+        reader = ModelRouter({"quality": "fast-model"}, p95_slo_s=0.2)
+        for _ in range(5):
+            for _chunk in RoutedChatModel("teach", 0.7, router=reader).stream("hi"):
+                time.sleep(0.1)
+        assert reader.metrics()["models"]["fast-model"]["p95_s"] < 0.2
+        
+        # Our own deadline ending a call is not a model error
+        timed = ModelRouter({"quality": "slow-model"})
+        try:
+            with cancel_scope(CancelScope(timeout_s=0.1)):
+                RoutedChatModel("teach", 0.7, router=timed).invoke("hi")
+            raise AssertionError("call should have hit the deadline")
+        except TurnCancelled:
+            pass
+        assert "slow-model" not in timed.metrics()["models"]
+    print("✅ Model routing test passed")
+
+
+def test_speculative_hint_is_served_from_cache():
+    """Assessed /chat turns use the pre-generated hint; topic changes discard it; stores expire old entries."""
+    from fastapi.testclient import TestClient
+    from agent.speculation import SpeculationCache, speculator
+    from api.main import agents, app, sessions
+    
+    def settle():
+        for _ in range(100):
+            if not speculator.metrics()["pending"]:
+                return
+            time.sleep(0.05)
+    
+    saved = os.environ.get("STUDYMATE_SPECULATE")
+    os.environ["STUDYMATE_SPECULATE"] = "1"
+    session_id = None
+    try:
+        with StubOpenAIServer() as server:
+            client = TestClient(app)
+            before = speculator.metrics()
+            session_id = client.post("/session/create", json={"github_url": "https://github.com/o/r"}).json()["session_id"]
+            
+            def chat(message, **focus):
+                reply = client.post("/chat", json={"session_id": session_id, "message": message, **focus})
+                assert reply.status_code == 200
+                settle()
+                return server.requests
+            
+            # No concept yet: nothing to speculate about
+            chat("What is recursion?")
+            assert len(server.requests) == 2 and speculator.metrics()["scheduled"] == before["scheduled"]
+            
+            # First struggle: the level 1 hint is generated in the turn, then hint 2 and a question ahead of time
+            requests = chat("Is it a function calling itself?", concept="recursion", understanding_level="poor")
+            assert len(requests) == 6 and "Hint level: 1/3" in requests[2]["messages"][-1]["content"]
+            assert requests[3]["messages"][-1]["content"].startswith("The student is struggling with recursion. "
+                                                                     "Hint to build on: Stub reply 3")
+            prompts = [r["messages"][-1]["content"] for r in requests]
+            pregenerated = f"Stub reply {next(i for i in (4, 5) if 'Hint level: 2/3' in prompts[i]) + 1}"
+            
+            # Second struggle: the pre-generated level 2 hint is used without a model call
+            requests = chat("Something about a base case?", concept="recursion", understanding_level="poor")
+            assert speculator.metrics()["hits"] - before["hits"] == 1
+            # The turn, then only the level 3 hint ahead of time (the question is still cached)
+            assert len(requests) == 8 and "Hint level: 3/3" in requests[7]["messages"][-1]["content"]
+            assert f"Hint to build on: {pregenerated}\n" in requests[6]["messages"][-1]["content"]
+            
+            # New topic: the unused recursion question is thrown away
+            chat("On to loops", concept="loops")
+            after = speculator.metrics()
+            assert after["tokens_wasted"] > before["tokens_wasted"]
+    finally:
+        sessions.pop(session_id, None)
+        agents.pop(session_id, None)
+        speculator.discard(session_id)
+        if saved is None:
+            os.environ.pop("STUDYMATE_SPECULATE", None)
+        else:
+            os.environ["STUDYMATE_SPECULATE"] = saved
+    
+    # Entries of a session that never comes back expire when anything is stored
+    cache = SpeculationCache(ttl_s=0.2)
+    cache.schedule("gone", ("hint", "recursion", 2), lambda: ("Think smaller", 5))
+    for _ in range(100):
+        if cache.metrics()["cached"]:
+            break
+        time.sleep(0.01)
+    time.sleep(0.3)
+    cache.schedule("active", ("hint", "loops", 1), lambda: ("Count the steps", 7))
+    for _ in range(100):
+        if cache.metrics()["generated"] == 2:
+            break
+        time.sleep(0.01)
+    metrics = cache.metrics()
+    assert metrics["cached"] == 1 and metrics["expired"] == 1 and metrics["tokens_wasted"] == 5
+    print("✅ Speculative hint test passed")
+
+
+def test_analytics_matches_progress_files():
+    """Columnar aggregates agree with a direct scan and ingest is incremental."""
+    import random
+    from datetime import datetime
+    from agent import analytics as analytics_module
+    from agent.analytics import AnalyticsStore, MASTERY_LEVELS
+    
+    rng = random.Random(7)
+    with tempfile.TemporaryDirectory() as progress_dir:
+        files = {}
+        for s in range(30):
+            events = [
+                {
+                    "concept": rng.choice(["Recursion", "loops", "Closures"]),
+                    "mastery": rng.choice(MASTERY_LEVELS + ("unknown",)),
+                    "timestamp": datetime.fromtimestamp(1_700_000_000 + rng.randrange(86400 * 3)).isoformat()
+                }
+                for _ in range(rng.randrange(1, 12))
+            ]
+            files[f"s{s}"] = os.path.join(progress_dir, f"progress_s{s}.json")
+            with open(files[f"s{s}"], 'w') as f:
+                json.dump({"session_id": f"s{s}", "concepts_covered": events}, f)
+        
+        # Expected: each session's latest known mastery per concept
+        latest = {}
+        for session_id, path in files.items():
+            with open(path) as f:
+                events = json.load(f)["concepts_covered"]
+            for e in sorted(events, key=lambda e: e["timestamp"]):
+                if e["mastery"] in MASTERY_LEVELS:
+                    latest[(session_id, e["concept"].lower())] = e["mastery"]
+        expected = {}
+        for (_, concept), mastery in latest.items():
+            expected.setdefault(concept, dict.fromkeys(MASTERY_LEVELS, 0))[mastery] += 1
+        
+        store = AnalyticsStore()
+        store.backfill(progress_dir)
+        store.ingest_progress_file(files["s0"])
+        known = sum(1 for path in files.values() for e in json.load(open(path))["concepts_covered"]
+                    if e["mastery"] in MASTERY_LEVELS)
+        assert len(store) == known
+        
+        saved = analytics_module.DENSE_KEY_LIMIT
+        try:
+            for limit in (saved, 0):
+                analytics_module.DENSE_KEY_LIMIT = limit
+                dist = store.mastery_distribution()
+                assert {c: {m: d[m] for m in MASTERY_LEVELS} for c, d in dist.items()} == expected
+                activity = store.activity(bucket_s=86400)
+                assert sum(b["events"] for b in activity) == known
+        finally:
+            analytics_module.DENSE_KEY_LIMIT = saved
+        
+        weakest = store.weak_concepts(limit=1)[0]
+        assert weakest["mean"] == min(d["mean"] for d in dist.values())
+        
+        # A writer passes on the progress it holds; only its new event is appended
+        with open(files["s1"]) as f:
+            progress = json.load(f)
+        progress["concepts_covered"].append({"concept": "Loops", "mastery": "excellent",
+                                             "timestamp": datetime.now().isoformat()})
+        store.ingest_progress(files["s1"], progress)
+        assert len(store) == known + 1
+        store.ingest_progress(files["s1"], progress)
+        assert len(store) == known + 1
+    print("✅ Analytics test passed")
+
+
+def test_watcher_updates_only_changed_files():
+    """Bursts of saves are debounced and updates touch only the changed files."""
+    from agent import retrieval
+    from agent.search import iter_text_files, search_repo
+    from agent.watcher import RepoWatcher
+    
+    def wait_for(watcher, seq):
+        for _ in range(100):
+            if watcher.seq >= seq:
+                return
+            time.sleep(0.05)
+        raise AssertionError(f"watcher stuck at batch {watcher.seq}")
+    
+    default_dir = retrieval.INDEX_DIR
+    with tempfile.TemporaryDirectory() as repo, tempfile.TemporaryDirectory() as cache:
+        for i in range(200):
+            os.makedirs(os.path.join(repo, f"pkg{i % 10}"), exist_ok=True)
+            with open(os.path.join(repo, f"pkg{i % 10}", f"mod{i}.py"), 'w') as f:
+                f.write(f"def handler_{i}(event):\n    return event\n")
+        
+        retrieval.INDEX_DIR = cache
+        watcher = RepoWatcher(repo, debounce_s=0.2, poll_interval_s=0.05, use_inotify=False).start()
+        try:
+            watcher.index()
+            
+            # A burst of saves to one file is a single batch touching one file
+            target = os.path.join(repo, "pkg3", "mod3.py")
+            for n in range(5):
+                with open(target, 'w') as f:
+                    f.write("def zebrafish_handler(event):\n" + "    pass\n" * (n + 1))
+                time.sleep(0.01)
+            wait_for(watcher, 1)
+            time.sleep(0.3)
+            assert watcher.seq == 1
+            assert watcher.stats["files_rescanned"] == 1
+            assert watcher.index().query("zebrafish handler", k=1)[0]["file"] == os.path.join("pkg3", "mod3.py")
+            assert watcher.stats["index_files_updated"] == 1
+            
+            # 10 edits + 1 new file + 1 deletion: cost follows the change count
+            for i in range(10, 20):
+                with open(os.path.join(repo, f"pkg{i % 10}", f"mod{i}.py"), 'a') as f:
+                    f.write("# edited\n")
+            with open(os.path.join(repo, "pkg0", "new_module.py"), 'w') as f:
+                f.write("def brand_new():\n    pass\n")
+            os.remove(os.path.join(repo, "pkg1", "mod1.py"))
+            wait_for(watcher, 2)
+            assert watcher.stats["paths_changed"] == 1 + 12
+            assert watcher.stats["files_rescanned"] == 1 + 11
+            watcher.index()
+            assert watcher.stats["index_files_updated"] == 1 + 12
+            
+            # Views match a full rescan
+            assert watcher.structure()["total_files"] == 200
+            assert watcher.searchable_files() == sorted(iter_text_files(repo))
+            assert not any(hit["file"] == os.path.join("pkg1", "mod1.py") for hit in watcher.index().query("handler 1", k=50))
+            hits = list(search_repo(repo, "brand_new", files=watcher.searchable_files()))
+            assert [os.path.basename(h["file"]) for h in hits] == ["new_module.py"]
+            
+            # Gitignored files are journaled but never indexed or parsed
+            watcher.graph()
+            with open(os.path.join(repo, ".gitignore"), 'w') as f:
+                f.write("generated_*.py\n")
+            with open(os.path.join(repo, "pkg2", "generated_zebu.py"), 'w') as f:
+                f.write("def zebu_generated():\n    pass\n")
+            wait_for(watcher, 3)
+            assert not any(hit["file"].endswith("generated_zebu.py") for hit in watcher.index().query("zebu generated", k=5))
+            assert not watcher.graph().lookup("zebu_generated")
+        finally:
+            watcher.stop()
+            retrieval.INDEX_DIR = default_dir
+    print("✅ Watcher test passed")
+
+
+def test_profiling_endpoints():
+    """Profiling is hidden without a token and captures the next N requests."""
+    import marshal
+    from fastapi.testclient import TestClient
+    from agent.deadline import TurnCancelled
+    from api.main import app
+    from api.profiling import MemoryTracker, profiler
+    
+    allocated = []
+    
+    def turn_work():
+        return [bytearray(1000) for _ in range(100)]
+    
+    def turn():
+        # Turns run on worker threads, not the event loop
+        with profiler.session_turn("s1"):
+            allocated.append(turn_work())
+    
+    saved = os.environ.pop("STUDYMATE_ADMIN_TOKEN", None)
+    try:
+        with TestClient(app) as client:
+            assert client.get("/admin/profile").status_code == 404
+            os.environ["STUDYMATE_ADMIN_TOKEN"] = "secret"
+            assert client.get("/admin/profile", headers={"X-Admin-Token": "wrong"}).status_code == 403
+            admin = {"X-Admin-Token": "secret"}
+            
+            for mode in ("sample", "cprofile"):
+                started = client.post("/admin/profile/start", headers=admin,
+                                      params={"mode": mode, "requests": 3, "interval_ms": 1, "memory": True})
+                assert started.status_code == 200
+                assert client.post("/admin/profile/start", headers=admin).status_code == 409
+                
+                worker = threading.Thread(target=turn)
+                worker.start()
+                worker.join()
+                time.sleep(0.2)
+                for _ in range(3):
+                    client.get("/health")
+                
+                status = client.get("/admin/profile", headers=admin).json()
+                assert not status["running"]
+                result = status["result"]
+                assert result["requests_seen"] == 3 and "max_ms" in result["loop_lag"]
+                assert result["memory"]["sessions"]["s1"]["net_bytes"] > 90_000
+                
+                if mode == "sample":
+                    folded = client.get("/admin/profile/download", headers=admin, params={"format": "folded"})
+                    stack, count = folded.text.splitlines()[0].rsplit(" ", 1)
+                    assert int(count) > 0 and ";" in stack
+                else:
+                    stats = client.get("/admin/profile/download", headers=admin, params={"format": "pstats"})
+                    functions = {func[2] for func in marshal.loads(stats.content)}
+                    assert "health" in functions
+                    if result["turns_profiled"]:
+                        assert "turn_work" in functions
+                    else:
+                        assert result["turns_unprofiled"] == 1
+            del allocated
+        
+        # A capture ending mid-turn does not swallow the turn's exception
+        tracker = MemoryTracker()
+        tracker.start()
+        try:
+            with tracker.turn("s2"):
+                tracker.stop()
+                raise TurnCancelled("deadline")
+        except TurnCancelled:
+            pass
+        else:
+            raise AssertionError("exception swallowed")
+    finally:
+        if saved is None:
+            os.environ.pop("STUDYMATE_ADMIN_TOKEN", None)
+        else:
+            os.environ["STUDYMATE_ADMIN_TOKEN"] = saved
+    print("✅ Profiling test passed")
+
+
+def test_disconnect_cancels_turn():
+    """A disconnected client or missed deadline stops the upstream stream and rolls back history."""
+    import httpx
+    import uvicorn
+    from agent.deadline import CancelScope, TurnCancelled, cancel_scope, cancellation_metrics
+    from agent.tools import assess_student_understanding, provide_progressive_hint
+    from api.main import app, sessions, agents
+    
+    def wait_until(condition):
+        for _ in range(100):
+            if condition():
+                return
+            time.sleep(0.05)
+        raise AssertionError("condition not reached")
+    
+    # 10 chunks 0.2 s apart: a full reply takes ~2 s
+    with StubOpenAIServer(stream_chunks=10, stream_delay=0.2) as server:
+        agent = StudyMateAgent(repo_path=None)
+        agent.transcript.append("assistant", "Hello!")
+        before = cancellation_metrics()
+        
+        # Deadline
+        start = time.perf_counter()
+        try:
+            agent.teach("What is recursion?", scope=CancelScope(timeout_s=0.5))
+            raise AssertionError("turn should have been cancelled")
+        except TurnCancelled as e:
+            assert e.reason == "deadline_exceeded"
+        assert time.perf_counter() - start < 1.5
+        assert len(agent.transcript) == 1
+        wait_until(lambda: server.aborted == 1)
+        
+        # Client disconnect through the API, against a real server
+        session_id = "cancel-session"
+        agents[session_id] = agent
+        sessions[session_id] = {"id": session_id, "messages": agent.transcript}
+        api = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=0, log_level="warning"))
+        thread = threading.Thread(target=api.run, daemon=True)
+        thread.start()
+        wait_until(lambda: api.started)
+        port = api.servers[0].sockets[0].getsockname()[1]
+        try:
+            try:
+                httpx.post(f"http://127.0.0.1:{port}/chat", timeout=0.6,
+                           json={"session_id": session_id, "message": "And loops?"})
+                raise AssertionError("request should have timed out")
+            except httpx.ReadTimeout:
+                pass
+            wait_until(lambda: cancellation_metrics()["client_disconnected"] > before["client_disconnected"])
+            wait_until(lambda: server.aborted == 2)
+            assert len(agent.transcript) == 1
+            
+            # The session still works afterwards
+            reply = httpx.post(f"http://127.0.0.1:{port}/chat", timeout=10,
+                               json={"session_id": session_id, "message": "Quick one", "timeout_s": 8})
+            assert reply.status_code == 200 and "part 9" in reply.json()["response"]
+            assert len(agent.transcript) == 3
+        finally:
+            api.should_exit = True
+            thread.join()
+            del agents[session_id], sessions[session_id]
+        
+        after = cancellation_metrics()
+        assert after["turns_cancelled"] - before["turns_cancelled"] == 2
+        assert after["model_calls_aborted"] - before["model_calls_aborted"] == 2
+        
+        # Tools with fallback replies still let cancellation through
+        scope = CancelScope()
+        scope.cancel("client_disconnected")
+        for call in (lambda: provide_progressive_hint.func("loops", 1),
+                     lambda: assess_student_understanding.func("A loop repeats", "loops")):
+            try:
+                with cancel_scope(scope):
+                    call()
+                raise AssertionError("tool swallowed the cancellation")
+            except TurnCancelled:
+                pass
+    print("✅ Cancellation test passed")
+
+
+def test_session_budget_degrades_then_refuses():
+    """A session nearing its token budget gets smaller prompts, then the fast tier, then 429."""
+    from fastapi.testclient import TestClient
+    from agent.budget import BudgetExceeded, SessionLedger
+    from agent.routing import ModelRouter, RoutedChatModel
+    from api.main import app, sessions, agents
+    
+    with StubOpenAIServer() as server:
+        router = ModelRouter({"quality": "quality-model", "fast": "fast-model"})
+        agent = StudyMateAgent(repo_path=None)
+        agent.llm = RoutedChatModel("teach", 0.7, router=router)
+        for i in range(6):
+            agent.transcript.append("user", f"Earlier question {i}")
+            agent.transcript.append("assistant", f"Earlier answer {i}")
+        
+        agent.teach("What is a closure?")
+        first = agent.ledger.snapshot()
+        assert first["llm_calls"] == 1 and first["prompt_tokens"] > 0 and first["llm_seconds"] > 0
+        assert first["by_site"]["teach"]["tokens"] == first["total_tokens"]
+        
+        # Room for a handful of turns: reduced from half, fast tier from 80%
+        agent.ledger.token_budget = 5 * first["total_tokens"]
+        agent.ledger.reduce_at, agent.ledger.cheap_at = 0.5, 0.8
+        levels = []
+        for i in range(20):
+            levels.append(agent.ledger.level())
+            try:
+                agent.teach(f"Follow-up {i}")
+            except BudgetExceeded:
+                break
+        else:
+            raise AssertionError("budget never ran out")
+        assert levels[0] == "normal" and levels[-1] == "exhausted"
+        assert "reduced" in levels and "cheap" in levels
+        
+        # Degraded turns send less history and switch to the fast tier
+        sent = server.requests[1:]
+        for level, request in zip(levels, sent):
+            assert request["model"] == ("fast-model" if level == "cheap" else "quality-model")
+        normal = len(sent[levels.index("normal")]["messages"])
+        reduced = len(sent[levels.index("reduced")]["messages"])
+        assert reduced < normal
+        assert router.metrics()["decisions"]["teach"]["fast-model"]["budget"] >= 1
+        # The refused turn left no trace
+        assert len(server.requests) == 1 + len(levels) - 1
+        assert agent.transcript.content(-2) != f"Follow-up {len(levels) - 1}"
+        
+        # Tools called during a session's turn are charged to it
+        from agent.tools import provide_progressive_hint
+        agent.ledger.run(provide_progressive_hint.func, "closures", 1)
+        usage = agent.ledger.snapshot()
+        assert usage["by_tool"]["provide_progressive_hint"]["calls"] == 1
+        assert usage["by_site"]["hint"]["calls"] == 1
+        
+        session_id = "budget-session"
+        agents[session_id] = agent
+        sessions[session_id] = {"id": session_id, "messages": agent.transcript}
+        try:
+            client = TestClient(app)
+            reply = client.post("/chat", json={"session_id": session_id, "message": "One more?"})
+            assert reply.status_code == 429
+            usage = client.get(f"/session/{session_id}/usage").json()
+            assert usage["budget"]["level"] == "exhausted"
+            assert usage["refused_turns"] == 2
+            assert usage["total_tokens"] >= usage["budget"]["tokens"]
+            assert client.get("/session/missing/usage").status_code == 404
+        finally:
+            del agents[session_id], sessions[session_id]
+    print("✅ Session budget test passed")
+
+
+def test_session_snapshot_restores_lazily():
+    """Sessions written on shutdown come back on first access, unaccessed ones are carried forward."""
+    from agent.transcript import Transcript
+    from api.snapshot import SessionStore
+    
+    def add(store, session_id, timestamp=None):
+        transcript = Transcript()
+        transcript.append("user", f"Hi from {session_id} ✨", timestamp)
+        transcript.append("assistant", "Hello!", timestamp)
+        agent = StudyMateAgent(repo_path=None, transcript=transcript, knowledge_level="beginner")
+        agent.session_id = session_id
+        agent.focus("recursion", "poor")
+        agent.ledger.record_llm("teach", 0.5, {"input_tokens": 120, "output_tokens": 30})
+        store.agents[session_id] = agent
+        store.sessions[session_id] = {"id": session_id, "student_name": "Ada", "messages": transcript}
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "sessions.snap")
+        first = SessionStore()
+        for session_id in ("a", "b", "c"):
+            add(first, session_id)
+        add(first, "stale", timestamp=time.time() - 3600)
+        assert first.save(path)["sessions"] == 4
+        
+        # Nothing is decoded until a session is asked for
+        second = SessionStore()
+        assert second.open(path) == 4
+        assert len(second.sessions) == 0 and "missing" not in second.sessions
+        agent = second.agents["b"]
+        session = second.sessions["b"]
+        assert second.stats == {"available": 4, "restored": 1}
+        assert session["student_name"] == "Ada" and session["messages"] is agent.transcript
+        assert agent.transcript.page() == first.sessions["b"]["messages"].page()
+        assert (agent.session_id, agent.active_concept, agent.struggle_count) == ("b", "recursion", 1)
+        assert agent.ledger.snapshot()["total_tokens"] == 150
+        
+        # Restored sessions are re-encoded, the rest copied; idle ones expire
+        agent.transcript.append("user", "Still here")
+        stats = second.save(path, max_idle_s=600)
+        assert stats == {"sessions": 3, "carried": 2, "bytes": os.path.getsize(path)}
+        
+        third = SessionStore()
+        third.open(path)
+        assert third.sessions.get("b")["messages"].content(-1) == "Still here"
+        assert third.agents.get("a") is not None and third.agents.get("stale") is None
+    print("✅ Session snapshot test passed")
+
+
+def test_code_graph_callers_and_dependencies():
+    """Import/call graph resolves imports, re-exports and self calls, and updates per file."""
+    from agent import codegraph, retrieval
+    from agent.codegraph import CodeGraph
+    from agent.tools import find_callers, find_dependency_path, module_dependencies
+    
+    files = {
+        "pkg/__init__.py": "from .core import Engine\n",
+        "pkg/core.py": (
+            "import json\n"
+            "from .util import clean\n\n"
+            "class Engine:\n"
+            "    def run(self, text):\n"
+            "        return self.step(clean(text))\n\n"
+            "    def step(self, text):\n"
+            "        items = []\n"
+            "        items.append(text)\n"
+            "        return json.dumps(items)\n"
+        ),
+        "pkg/util.py": "def clean(text):\n    return text.strip()\n",
+        "app.py": (
+            "from pkg import Engine\n\n"
+            "def main():\n"
+            "    engine = Engine()\n"
+            "    return engine.run(' hi ')\n"
+        ),
+    }
+    with tempfile.TemporaryDirectory() as repo:
+        for rel, body in files.items():
+            os.makedirs(os.path.join(repo, os.path.dirname(rel)), exist_ok=True)
+            with open(os.path.join(repo, rel), "w") as f:
+                f.write(body)
+        graph = CodeGraph.build(repo)
+        
+        assert [c["name"] for c in graph.callers("Engine.run")] == ["app.main"]
+        assert [c["name"] for c in graph.callers("step")] == ["pkg.core.Engine.run"]
+        assert {c["name"] for c in graph.callees("app.main")} == {"pkg.core.Engine", "pkg.core.Engine.run"}
+        assert {c["name"] for c in graph.callees("pkg.core.Engine.run")} == {"pkg.core.Engine.step", "pkg.util.clean"}
+        # list.append is not mistaken for a repository method
+        assert graph.callees("Engine.step") == []
+        assert {d["name"] for d in graph.dependencies("pkg/core.py")} == {"json", "pkg.util"}
+        assert {d["name"] for d in graph.dependencies("pkg.util", reverse=True)} == {"pkg.core"}
+        assert graph.path("app.py", "pkg/util.py") == ["app", "pkg", "pkg.core", "pkg.util"]
+        assert graph.path("app.main", "clean") == ["app.main", "pkg.core.Engine.run", "pkg.util.clean"]
+        assert graph.path("pkg.util", "app") is None
+        
+        # New functions relink everything; a body edit re-resolves one file
+        with open(os.path.join(repo, "pkg/util.py"), "a") as f:
+            f.write("\ndef shout(text):\n    return clean(text).upper()\n")
+        with open(os.path.join(repo, "app.py"), "a") as f:
+            f.write("\ndef again():\n    return main()\n")
+        updated = graph.updated(["pkg/util.py"]).updated(["app.py"])
+        assert [c["name"] for c in updated.callers("main")] == ["app.again"]
+        
+        core = os.path.join(repo, "pkg/core.py")
+        with open(core) as f:
+            text = f.read()
+        with open(core, "w") as f:
+            f.write(text.replace("items.append(text)", "items.append(clean(text))"))
+        updated = updated.updated(["pkg/core.py"])
+        rebuilt = CodeGraph.build(repo)
+        for name in ("clean", "shout", "main", "Engine.run", "step"):
+            assert updated.callers(name) == rebuilt.callers(name), name
+        assert {c["name"] for c in updated.callers("clean")} == {
+            "pkg.core.Engine.run", "pkg.core.Engine.step", "pkg.util.shout"
+        }
+        
+        # A file that does not parse before or after an edit is skipped
+        bad = os.path.join(repo, "bad.py")
+        with open(bad, "w") as f:
+            f.write("def broken(:\n")
+        updated = updated.updated(["bad.py"])
+        with open(bad, "w") as f:
+            f.write("def still_broken(:\n")
+        assert updated.updated(["bad.py"]).callers("clean") == updated.callers("clean")
+        
+        assert "**app.main** at app.py:5" in find_callers.func("Engine.run", repo)
+        assert "app → pkg → pkg.core → pkg.util" in find_dependency_path.func("app.py", "pkg/util.py", repo)
+        assert "External packages: json" in module_dependencies.func("pkg/core.py", repo)
+        assert "No function or class" in find_callers.func("missing_function", repo)
+        
+        # Like indexes, a checked graph is trusted for INDEX_CHECK_S
+        default_check = retrieval.INDEX_CHECK_S
+        try:
+            retrieval.INDEX_CHECK_S = 3600
+            cached = codegraph.get_graph(repo)
+            with open(os.path.join(repo, "later.py"), "w") as f:
+                f.write("from pkg.util import clean\n\ndef later():\n    return clean('x')\n")
+            assert codegraph.get_graph(repo) is cached
+            retrieval.INDEX_CHECK_S = 0
+            assert "later.later" in {c["name"] for c in codegraph.get_graph(repo).callers("clean")}
+        finally:
+            retrieval.INDEX_CHECK_S = default_check
+            codegraph._graphs.pop(os.path.abspath(repo), None)
+    print("✅ Code graph test passed")
+
+
+def test_semantic_response_cache():
+    """Rephrased opening questions reuse a reply; specific, follow-up or other-level ones do not."""
+    from fastapi.testclient import TestClient
+    from agent import core, retrieval
+    from agent.response_cache import ResponseCache, response_cache
+    from api.main import app
+    
+    saved = os.environ.get("STUDYMATE_RESPONSE_CACHE")
+    os.environ["STUDYMATE_RESPONSE_CACHE"] = "1"
+    response_cache.clear()
+    try:
+        with StubOpenAIServer() as server:
+            first = StudyMateAgent(repo_path=None)
+            reply = first.teach("What does this project do?")
+            assert len(server.requests) == 1
+            
+            # Same intent in other words: answered without a model call
+            second = StudyMateAgent(repo_path=None)
+            assert second.teach("Can you explain this repo?") == reply
+            assert "".join(StudyMateAgent(repo_path=None).teach_stream("explain the codebase please")) == reply
+            assert len(server.requests) == 1
+            assert second.transcript.page()[-1]["content"] == reply
+            
+            # Other level, file, negation or intent: always the model
+            StudyMateAgent(repo_path=None, knowledge_level="beginner").teach("What does this project do?")
+            StudyMateAgent(repo_path=None).teach("What does train.py do?")
+            StudyMateAgent(repo_path=None).teach("Why doesn't this project use a database?")
+            StudyMateAgent(repo_path=None).teach("How is this project structured?")
+            assert len(server.requests) == 5
+            
+            # Later turns: only context-free questions about the whole project
+            second.teach("Can you explain that again?")
+            second.teach("What does train.py do?")
+            assert len(server.requests) == 7
+            second.teach("So what does this repository do?")
+            assert len(server.requests) == 7
+            
+            metrics = TestClient(app).get("/metrics/response-cache").json()
+            assert metrics["hits"] == 3 and metrics["skipped"] == 2
+            assert metrics["hit_rate"] == 3 / metrics["lookups"]
+            
+            # Cacheable turns are asked without the (personal) greeting
+            greeted = StudyMateAgent(repo_path=None, knowledge_level="advanced")
+            greeted.transcript.append("assistant", "Welcome, Alice! What interests you?")
+            greeted.teach("What does this project do?")
+            assert "Alice" not in json.dumps(server.requests[-1]["messages"])
+            
+            # Without a watcher, editing the repository invalidates its entries
+            default_dir, default_check = retrieval.INDEX_DIR, retrieval.INDEX_CHECK_S
+            with tempfile.TemporaryDirectory() as repo, tempfile.TemporaryDirectory() as cache:
+                retrieval.INDEX_DIR, retrieval.INDEX_CHECK_S = cache, 0
+                try:
+                    with open(os.path.join(repo, "train.py"), "w") as f:
+                        f.write("def train():\n    pass\n")
+                    StudyMateAgent(repo_path=repo).teach("What does this project do?")
+                    calls = len(server.requests)
+                    # A hit only fingerprints the files; no index is loaded or built
+                    retrieval._indexes.pop(os.path.abspath(repo))
+                    StudyMateAgent(repo_path=repo).teach("Explain this repo")
+                    assert len(server.requests) == calls
+                    assert os.path.abspath(repo) not in retrieval._indexes
+                    with open(os.path.join(repo, "train.py"), "a") as f:
+                        f.write("\ndef evaluate():\n    pass\n")
+                    StudyMateAgent(repo_path=repo).teach("Explain this repo")
+                    assert len(server.requests) == calls + 1
+                    
+                    # A failing cache lookup costs the cache, not the turn
+                    def unreadable(path):
+                        raise PermissionError(path)
+                    core.repo_fingerprint = unreadable
+                    reply = StudyMateAgent(repo_path=repo).teach("Explain this repo")
+                    assert reply == f"Stub reply {calls + 2}"
+                    assert "".join(StudyMateAgent(repo_path=repo).teach_stream("Explain this repo")).startswith(
+                        f"Stub reply {calls + 3}")
+                finally:
+                    core.repo_fingerprint = retrieval.repo_fingerprint
+                    retrieval.INDEX_DIR, retrieval.INDEX_CHECK_S = default_dir, default_check
+                    retrieval._indexes.pop(os.path.abspath(repo), None)
+                    retrieval._checked.pop(os.path.abspath(repo), None)
+    finally:
+        response_cache.clear()
+        if saved is None:
+            os.environ.pop("STUDYMATE_RESPONSE_CACHE", None)
+        else:
+            os.environ["STUDYMATE_RESPONSE_CACHE"] = saved
+    
+    # A changed repository, eviction and expiry
+    cache = ResponseCache(max_entries=2)
+    key = cache.key(("/repo", 1), "intermediate", "What does this project do?", True)
+    cache.store(key, "It trains a model.")
+    assert cache.lookup(cache.key(("/repo", 2), "intermediate", "Explain this repo", True)) is None
+    assert cache.lookup(cache.key(("/repo", 1), "intermediate", "Explain this repo", True)) == "It trains a model."
+    for question in ("How do I run this project?", "How is the repo organized?"):
+        cache.store(cache.key(("/repo", 1), "intermediate", question, True), "...")
+    assert cache.lookup(key) is None and cache.metrics()["evictions"] == 1
+    expiring = ResponseCache(ttl_s=0)
+    expiring.store(key, "It trains a model.")
+    assert expiring.lookup(key) is None and expiring.metrics()["expired"] == 1
+    assert cache.key(("/repo", 1), "intermediate", "```\nprint(1)\n```", True) is None
+    print("✅ Semantic response cache test passed")
+
+
+def test_websocket_pushed_events():
+    """Ingest progress and a background greeting reach the session's WebSocket, before or after it opens."""
+    from fastapi.testclient import TestClient
+    import api.main as api
+    
+    model = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+    with tempfile.TemporaryDirectory() as repos, StubOpenAIServer(delays={model: 0.3}):
+        os.makedirs(os.path.join(repos, "demo"))
+        with open(os.path.join(repos, "demo", "app.py"), "w") as f:
+            f.write("def main():\n    return helper()\n\ndef helper():\n    return 1\n")
+        saved, api.REPOS_DIR = api.REPOS_DIR, repos
+        client = TestClient(api.app)
+        try:
+            assert client.post("/session/create", json={"github_url": "x", "repo_path": "../"}).status_code == 400
+            created = client.post("/session/create", json={
+                "github_url": "https://github.com/example/demo",
+                "repo_path": "demo",
+                "background_greeting": True,
+            }).json()
+            session_id = created["session_id"]
+            assert created["greeting"] == ""
+            
+            with client.websocket_connect(f"/ws/session/{session_id}") as ws:
+                assert ws.receive_json()["type"] == "ready"
+                # Five ingest steps and the greeting, in whichever order they finish
+                events = [ws.receive_json() for _ in range(6)]
+                assert all(e["type"] == "event" for e in events)
+                ingest = [(e["stage"], e["status"]) for e in events if e["event"] == "ingest"]
+                assert ingest == [("index", "started"), ("index", "done"),
+                                  ("graph", "started"), ("graph", "done"), ("ready", "done")]
+                greeting = [e["greeting"] for e in events if e["event"] == "greeting"]
+                assert greeting == [api.agents[session_id].transcript.content(-1)]
+                
+                # Pushed straight to an open connection
+                assert api.publish(session_id, {"event": "note", "text": "hi"}) == 1
+                assert ws.receive_json() == {"type": "event", "event": "note", "text": "hi"}
+            assert api.agents[session_id].repo_path == os.path.realpath(os.path.join(repos, "demo"))
+            del api.agents[session_id], api.sessions[session_id]
+        finally:
+            api.REPOS_DIR = saved
+    print("✅ WebSocket pushed events test passed")
+
+
+def test_websocket_streams_turns():
+    """Token frames add up to the done frame; malformed frames and mid-stream failures are reported."""
+    from fastapi.testclient import TestClient
+    from langchain_core.messages import AIMessageChunk
+    from agent.core import FALLBACK_REPLY
+    from api.main import app, sessions, agents
+    
+    class FailingModel:
+        def stream(self, messages):
+            yield AIMessageChunk(content="Partial answer")
+            raise RuntimeError("connection reset")
+    
+    def until_done(ws):
+        frames = [ws.receive_json()]
+        while frames[-1]["type"] not in ("done", "error"):
+            frames.append(ws.receive_json())
+        return frames
+    
+    with StubOpenAIServer(stream_chunks=3, stream_delay=0.05):
+        session_id = "ws-session"
+        agent = StudyMateAgent(repo_path=None)
+        agents[session_id] = agent
+        sessions[session_id] = {"id": session_id, "messages": agent.transcript}
+        try:
+            with TestClient(app).websocket_connect(f"/ws/session/{session_id}") as ws:
+                assert ws.receive_json()["type"] == "ready"
+                
+                # A malformed frame mid-turn is answered once the turn is done
+                ws.send_json({"type": "message", "message": "What is a closure?"})
+                ws.send_text("{not json")
+                frames = until_done(ws)
+                tokens = [f["content"] for f in frames if f["type"] == "token"]
+                assert frames[-1]["type"] == "done" and tokens
+                assert "".join(tokens) == frames[-1]["response"] == agent.transcript.content(-1)
+                assert ws.receive_json() == {"type": "error", "detail": "Frame is not valid JSON"}
+                
+                # The model fails part way: reset, then the recorded fallback
+                agent.llm = FailingModel()
+                ws.send_json({"type": "message", "message": "And a generator?"})
+                frames = until_done(ws)
+                assert [f["type"] for f in frames] == ["token", "reset", "done"]
+                assert frames[-1]["response"] == FALLBACK_REPLY == agent.transcript.content(-1)
+            
+            # A stream closed part way (its consumer went away) is rolled back
+            agent.llm = FailingModel()
+            mark = len(agent.transcript)
+            stream = agent.teach_stream("Abandoned question")
+            assert next(stream) == "Partial answer"
+            stream.close()
+            assert len(agent.transcript) == mark
+        finally:
+            del agents[session_id], sessions[session_id]
+    print("✅ WebSocket streaming test passed")
+
+
+def test_history_pages_and_etags():
+    """Full history without paging parameters; ETags are per page and per transcript version."""
+    from fastapi.testclient import TestClient
+    from agent.transcript import Transcript
+    from api.main import app, sessions
+    
+    session_id = "history-session"
+    transcript = Transcript()
+    for i in range(150):
+        transcript.append("user" if i % 2 == 0 else "assistant", f"Message {i}")
+    sessions[session_id] = {"id": session_id, "messages": transcript}
+    try:
+        client = TestClient(app)
+        url = f"/session/{session_id}/history"
+        full = client.get(url).json()
+        assert len(full["messages"]) == 150 and full["next_cursor"] is None
+        
+        first = client.get(url, params={"limit": 10})
+        assert first.json()["next_cursor"] == 10
+        etag = first.headers["ETag"]
+        assert client.get(url, params={"limit": 10}, headers={"If-None-Match": etag}).status_code == 304
+        # Another page never matches this page's ETag
+        second = client.get(url, params={"limit": 10, "cursor": 10}, headers={"If-None-Match": etag})
+        assert second.status_code == 200 and second.json()["messages"][0]["content"] == "Message 10"
+        
+        # A rolled back turn replaced by a new one: same length, new content
+        transcript.truncate(149)
+        transcript.append("assistant", "Different reply")
+        assert client.get(url, params={"limit": 10}, headers={"If-None-Match": etag}).status_code == 200
+    finally:
+        del sessions[session_id]
+    print("✅ History paging test passed")
+
+
+def test_gitignore_semantics():
+    """Root and nested .gitignore rules apply however the repo path is spelled."""
+    from agent.search import iter_text_files
+    
+    with tempfile.TemporaryDirectory() as repo:
+        files = {
+            ".gitignore": "*.log\nbuild/\n/top.txt\nsub/secret.txt\n",
+            "keep.py": "", "debug.log": "", "top.txt": "",
+            "build/out.py": "", "sub/build": "", "sub/top.txt": "",
+            "sub/secret.txt": "", "sub/.gitignore": "local.py\n",
+            "sub/local.py": "", "sub/deep/local.py": "", "other/local.py": "",
+            ".hidden/x.py": "", "node_modules/x.js": "",
+        }
+        for rel, text in files.items():
+            path = os.path.join(repo, rel)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as f:
+                f.write(text)
+        
+        expected = {"keep.py", "sub/build", "sub/top.txt", "other/local.py"}
+        for spelling in (repo, repo + os.sep, os.path.join(repo, "sub", "..")):
+            found = {
+                os.path.relpath(path, spelling).replace(os.sep, "/")
+                for path in iter_text_files(spelling)
+            }
+            assert found == expected, (spelling, found)
+    print("✅ Gitignore semantics test passed")
+
+
+def test_retrieval_index_build_save_query():
+    """Indexes answer queries, round-trip through disk and are re-checked at most every INDEX_CHECK_S."""
+    from agent import retrieval
+    from agent.retrieval import RepoIndex, get_index, index_path
+    
+    default_dir, default_check = retrieval.INDEX_DIR, retrieval.INDEX_CHECK_S
+    with tempfile.TemporaryDirectory() as repo, tempfile.TemporaryDirectory() as cache:
+        retrieval.INDEX_DIR = cache
+        try:
+            with open(os.path.join(repo, "train.py"), "w") as f:
+                f.write("def train_model(dataset):\n    optimizer = make_optimizer()\n    return fit(dataset)\n")
+            with open(os.path.join(repo, "serve.py"), "w") as f:
+                f.write("def serve_http(port):\n    start_server(port)\n")
+            
+            index = RepoIndex.build(repo)
+            assert sorted(set(index.paths)) == ["serve.py", "train.py"]
+            hits = index.query("where is the optimizer for training the model?")
+            assert hits[0]["file"] == "train.py" and hits[0]["start_line"] == 1
+            assert "make_optimizer" in index.context_for("optimizer")
+            assert index.query("") == [] and len(index.query("model", k=1)) == 1
+            
+            path = os.path.join(cache, "index.npz")
+            index.save(path)
+            loaded = RepoIndex.load(path)
+            assert loaded.paths == index.paths and loaded.fingerprint == index.fingerprint
+            assert loaded.query("serve http port")[0]["file"] == "serve.py"
+            
+            # get_index persists under INDEX_DIR and trusts a checked index for INDEX_CHECK_S
+            retrieval.INDEX_CHECK_S = 3600
+            current = get_index(repo)
+            assert os.path.dirname(index_path(repo)) == cache and os.path.exists(index_path(repo))
+            with open(os.path.join(repo, "train.py"), "a") as f:
+                f.write("\ndef evaluate_model():\n    pass\n")
+            assert get_index(repo) is current
+            retrieval.INDEX_CHECK_S = 0
+            rebuilt = get_index(repo)
+            assert rebuilt is not current and rebuilt.fingerprint != current.fingerprint
+            assert rebuilt.query("evaluate model")[0]["file"] == "train.py"
+        finally:
+            retrieval.INDEX_DIR, retrieval.INDEX_CHECK_S = default_dir, default_check
+            retrieval._indexes.pop(os.path.abspath(repo), None)
+            retrieval._checked.pop(os.path.abspath(repo), None)
+    print("✅ Retrieval index test passed")
+
+
+def test_transcript_columns():
+    """Transcripts round-trip through bytes, bump their generation on every change and page safely."""
+    from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+    from agent.transcript import Transcript
+    
+    transcript = Transcript()
+    assert len(transcript) == 0 and transcript.last_timestamp == 0.0 and transcript.page() == []
+    transcript.append("user", "What is a closure? ✨", timestamp=1000.0)
+    transcript.append("assistant", "What do you think happens to local variables?", timestamp=1001.5)
+    transcript.append("user", "They are kept", timestamp=1002.0)
+    assert transcript.count("user") == 2 and transcript.count("assistant") == 1
+    assert transcript.content(-1) == "They are kept" and transcript.last_timestamp == 1002.0
+    
+    restored = Transcript.from_bytes(bytearray(transcript.to_bytes()))
+    assert restored.page() == transcript.page() and restored.last_timestamp == 1002.0
+    assert Transcript.from_bytes(Transcript().to_bytes()).page() == []
+    
+    messages = transcript.to_messages("system", start=1)
+    assert [type(m) for m in messages] == [SystemMessage, AIMessage, HumanMessage]
+    
+    # Past the end: empty, never an error
+    assert transcript.page(3) == [] and transcript.page(10, 20) == []
+    assert [m["content"] for m in transcript.page(1, 10)][-1] == "They are kept"
+    
+    # Rolling back and re-appending restores the length but not the generation
+    generation = transcript.generation
+    transcript.truncate(2)
+    assert len(transcript) == 2 and transcript.generation != generation
+    truncated = transcript.generation
+    transcript.append("user", "They are kept")
+    assert len(transcript) == 3 and transcript.generation not in (generation, truncated)
+    transcript.clear()
+    assert len(transcript) == 0 and transcript.count("user") == 0
+    print("✅ Transcript test passed")
+
+
+def test_search_engine_modes():
+    """Literal, all-terms and regex search find case-insensitive hits and skip binary files."""
+    from agent.search import search_repo
+    
+    with tempfile.TemporaryDirectory() as repo:
+        files = {
+            "train.py": "import numpy\n\ndef Gradient_Descent(params, lr):\n    return params - lr\n",
+            "notes.md": "Gradient descent walks downhill.\nSee train.py for GRADIENT_DESCENT.\n",
+            "misc.py": "def unrelated():\n    pass\n",
+        }
+        for rel, text in files.items():
+            with open(os.path.join(repo, rel), "w") as f:
+                f.write(text)
+        with open(os.path.join(repo, "model.bin"), "wb") as f:
+            f.write(b"\0gradient_descent")
+        
+        hits = sorted(search_repo(repo, "gradient_descent"), key=lambda h: h["file"])
+        assert [(os.path.basename(h["file"]), h["line"]) for h in hits] == [("notes.md", 2), ("train.py", 3)]
+        assert "def Gradient_Descent" in hits[1]["snippet"] and "import numpy" in hits[1]["snippet"]
+        
+        everything = list(search_repo(repo, "gradient_descent", hits_per_file=5, workers=2))
+        assert len(everything) == 2
+        assert {os.path.basename(h["file"]) for h in search_repo(repo, "downhill gradient", "all")} == {"notes.md"}
+        assert not list(search_repo(repo, "downhill lr", "all"))
+        regex = list(search_repo(repo, r"def \w+\(\)", "regex"))
+        assert [os.path.basename(h["file"]) for h in regex] == ["misc.py"]
+        assert len(list(search_repo(repo, "e", max_results=2))) == 2
+        assert not list(search_repo(repo, "quux"))
+    print("✅ Search engine test passed")
+
+
 if __name__ == "__main__":
+    test_websocket_pushed_events()
+    test_search_engine_modes()
+    test_transcript_columns()
+    test_retrieval_index_build_save_query()
+    test_gitignore_semantics()
+    test_history_pages_and_etags()
+    test_websocket_streams_turns()
+    test_semantic_response_cache()
+    test_code_graph_callers_and_dependencies()
+    test_session_snapshot_restores_lazily()
+    test_session_budget_degrades_then_refuses()
+    test_disconnect_cancels_turn()
+    test_profiling_endpoints()
+    test_watcher_updates_only_changed_files()
+    test_analytics_matches_progress_files()
+    test_speculative_hint_is_served_from_cache()
+    test_router_fails_over_from_slow_model()
+    test_cassette_record_then_replay()
+    test_prompt_prefix_is_stable()
+    test_summaries_with_stub_model()
     test_agent()